@@ -0,0 +1,57 @@
+# Copyright (c) 2018 Siphon Contributors.
+# Distributed under the terms of the BSD 3-Clause License.
+# SPDX-License-Identifier: BSD-3-Clause
+"""Compare computing on big endian data, as sent by CDMRemote, with native data.
+
+Run with ``python benchmarks/cdmr_byteorder.py [number of values]``. For each
+operation, prints the time taken with the big endian data as sent and with data
+converted to native byte order, as done with
+:attr:`siphon.cdmr.Dataset.native_byteorder`. The one-time conversion cost is
+printed too.
+"""
+
+from __future__ import print_function
+
+import sys
+import timeit
+
+import numpy as np
+
+from siphon.cdmr.dataset import to_native
+
+OPERATIONS = [('sum', lambda a: a.sum()),
+              ('mean', lambda a: a.mean()),
+              ('a * 2 + 1', lambda a: a * 2 + 1),
+              ('sqrt', np.sqrt),
+              ('max', lambda a: a.max()),
+              ('sort', np.sort)]
+
+
+def best_time(func, repeat=5):
+    """Return the best time in seconds for a single call of `func`."""
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def main(size):
+    """Run the benchmarks for arrays of `size` float32 values."""
+    rng = np.random.RandomState(20180101)
+    big = rng.random_sample(size).astype('>f4')
+
+    # Conversion works in place on the (writable) decoded array
+    convert = best_time(lambda: to_native(big.copy())) - best_time(big.copy)
+    native = to_native(big.copy())
+
+    print('{0:d} float32 values ({1:.0f} MiB)'.format(size, big.nbytes / 2.**20))
+    print('One-time conversion to native: {0:8.2f} ms'.format(1000 * convert))
+    print()
+    print('{0:<12}{1:>14}{2:>14}{3:>10}'.format('operation', 'big endian ms', 'native ms',
+                                                'speedup'))
+    for name, func in OPERATIONS:
+        big_time = best_time(lambda: func(big))
+        native_time = best_time(lambda: func(native))
+        print('{0:<12}{1:>14.2f}{2:>14.2f}{3:>9.1f}x'.format(
+            name, 1000 * big_time, 1000 * native_time, big_time / native_time))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000000)
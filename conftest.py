@@ -0,0 +1,9 @@
+# Copyright (c) 2018 Siphon Contributors.
+# Distributed under the terms of the BSD 3-Clause License.
+# SPDX-License-Identifier: BSD-3-Clause
+"""Configure collection of tests and files for flake8."""
+
+import sys
+
+# Asynchronous support needs Python 3 syntax, so it can be neither imported nor linted
+collect_ignore = ['siphon/cdmr/async_support.py'] if sys.version_info < (3, 5) else []
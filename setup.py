@@ -19,6 +19,10 @@ dependencies = ['numpy>=1.8', 'protobuf>=3.0.0a3', 'requests>=1.2', 'beautifulso
 if sys.version_info < (3, 4):
     dependencies.append('enum34')
 
+# Thread pools (concurrent.futures) need the backport on Python 2. The marker is used
+# so that the requirement is correct in the universal wheel.
+dependencies.append('futures; python_version < "3"')
+
 setup(
     name='siphon',
     version=ver,
@@ -44,6 +48,9 @@ setup(
     install_requires=dependencies,
     extras_require={
         'netcdf': 'netCDF4>=1.1.0',
+        'arrow': 'pyarrow>=0.15',
+        'dask': 'dask[array]',
+        'async': 'aiohttp>=3.0',
         'dev': 'ipython[all]>=3.1',
         'test': ['pytest', 'pytest-flake8', 'pytest-runner',
                  'netCDF4>=1.1.0',
@@ -58,6 +65,12 @@ setup(
         'examples': ['matplotlib>=1.3', 'cartopy>=0.13.1', 'scipy', 'metpy']
     },
 
+    entry_points={
+        'xarray.backends': [
+            'siphon_cdmremote = siphon.cdmr.xarray_support:CDMRemoteBackendEntrypoint'
+        ]
+    },
+
     download_url='https://github.com/Unidata/siphon/archive/v{}.tar.gz'.format(ver),
     cmdclass=versioneer.get_cmdclass(),
 )
@@ -3,6 +3,6 @@
 # SPDX-License-Identifier: BSD-3-Clause
 """Support for using CDMRemote on a THREDDS Data Server (TDS)."""
 
-from .dataset import Dataset
+from .dataset import ChunkCache, Dataset, HeaderCache
 
-__all__ = ['Dataset']
+__all__ = ['ChunkCache', 'Dataset', 'HeaderCache']
@@ -0,0 +1,340 @@
+# Copyright (c) 2018 Siphon Contributors.
+# Distributed under the terms of the BSD 3-Clause License.
+# SPDX-License-Identifier: BSD-3-Clause
+"""Provide access to CDMRemote using :mod:`asyncio`.
+
+Requests are made using :mod:`aiohttp`, so that many reads (e.g. for different
+variables) can be in flight at once without a thread for each. This requires Python 3.
+"""
+
+import asyncio
+import functools
+
+from requests import HTTPError
+
+from .cdmremote import CDMRemote
+from .dataset import _max_request_items, Dataset, Group, Variable
+from .ncstream import iter_ncstream_messages
+from ..http_util import DataQuery, session_manager
+
+
+class AsyncCDMRemote(object):
+    """Provide asynchronous access to the CDMRemote endpoint on a TDS.
+
+    Responses are decoded using the same NcStream support as
+    :class:`~siphon.cdmr.cdmremote.CDMRemote`.
+
+    Attributes
+    ----------
+    max_concurrency : int
+        Maximum number of requests in flight at once; only changes made before the
+        first request take effect. Defaults to 8.
+    deflate : int
+        The deflate (compression) level to request data with; 0 disables compression.
+    struct_dtypes : dict
+        Mapping of variable names to the structured dtypes used to decode STRUCTURE and
+        SEQUENCE data. Filled in by :class:`AsyncDataset` from the header.
+    executor_bytes : int
+        Responses at least this large are decoded in the event loop's default executor,
+        rather than blocking the event loop. Defaults to 1 MiB.
+
+    """
+
+    max_concurrency = 8
+    executor_bytes = 1024 * 1024
+
+    def __init__(self, url, session=None):
+        """Initialize access to a particular url.
+
+        Parameters
+        ----------
+        url : str
+            The URL of the CDMRemote endpoint for the dataset
+        session : aiohttp.ClientSession, optional
+            The session used to make requests, e.g. one shared with the rest of an
+            application. By default, a session is created on first use, and closed
+            by :meth:`close`.
+
+        """
+        self._base = url
+        self._session = session
+        self._owns_session = session is None
+        self._semaphore = None
+        self.deflate = 0
+        self.struct_dtypes = {}
+
+    def _get_session(self):
+        """Get the session for requests, creating it if necessary."""
+        if self._session is None:
+            import aiohttp
+            self._session = aiohttp.ClientSession(
+                headers={'User-Agent': session_manager.user_agent})
+        return self._session
+
+    async def get_query(self, query):
+        """Make a GET request, including a query, to the endpoint.
+
+        Parameters
+        ----------
+        query : DataQuery
+            The query to pass when making the request
+
+        Returns
+        -------
+        bytes
+            The content of the response
+
+        Raises
+        ------
+        HTTPError
+            If the server returns anything other than a 200 (OK) code
+
+        """
+        # Created here so that it belongs to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        url = self._base[:-1] if self._base[-1] == '/' else self._base
+        url += '?' + str(query)
+        async with self._semaphore:
+            async with self._get_session().get(url) as resp:
+                if resp.status != 200:
+                    if resp.headers.get('Content-Type', '').startswith('text/html'):
+                        text = resp.reason
+                    else:
+                        text = await resp.text()
+                    raise HTTPError('Error accessing {0}\n'
+                                    'Server Error ({1:d}: {2})'.format(url, resp.status,
+                                                                       text))
+                return await resp.read()
+
+    async def _fetch(self, query):
+        content = await self.get_query(query)
+        decode = functools.partial(self._decode, content)
+        if len(content) >= self.executor_bytes:
+            # get_running_loop is new in Python 3.7
+            loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)()
+            return await loop.run_in_executor(None, decode)
+        return decode()
+
+    def _decode(self, content):
+        """Decode all of the NcStream messages in a response."""
+        return list(iter_ncstream_messages(content, dtypes=self.struct_dtypes or None))
+
+    async def fetch_header(self):
+        """Retrieve the header response from CDMRemote."""
+        return await self._fetch(self.query().add_query_parameter(req='header'))
+
+    async def fetch_data(self, **var):
+        """Retrieve data from CDMRemote for one or more variables."""
+        return await self.fetch_data_items(var.items())
+
+    async def fetch_data_items(self, items):
+        """Retrieve data from CDMRemote for a sequence of variables and indices.
+
+        Parameters
+        ----------
+        items : sequence of (str, indices) tuples
+            The name of each variable to request, with the indices to request
+
+        Returns
+        -------
+        list
+            The returned messages, in the same order as `items`
+
+        """
+        varstr = ','.join(name + CDMRemote._convert_indices(ind) for name, ind in items)
+        return await self._fetch(self.query().add_query_parameter(req='data', var=varstr))
+
+    def query(self):
+        """Generate a new query for CDMRemote, turning on compression if necessary."""
+        q = DataQuery()
+        if self.deflate:
+            q.add_query_parameter(deflate=self.deflate)
+        return q
+
+    async def close(self):
+        """Close the session, if it was created by this object."""
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        """Enter the context manager."""
+        return self
+
+    async def __aexit__(self, *args):
+        """Close the session when leaving the context manager."""
+        await self.close()
+
+
+class AsyncVariable(Variable):
+    """A Variable whose data are read using ``await var.read(index)``.
+
+    Indices are handled just as with :class:`~siphon.cdmr.dataset.Variable`, including
+    arrays of indices. Indexing directly only works for data included in the header.
+    """
+
+    def __getitem__(self, ind):
+        """Access data included in the header."""
+        if self._data is None:
+            raise TypeError('Data for {} must be read using "await var.read(ind)".'.format(
+                self.name))
+        return super(AsyncVariable, self).__getitem__(ind)
+
+    async def read(self, ind=slice(None)):
+        """Read data from the variable.
+
+        Parameters
+        ----------
+        ind : indices, optional
+            The indices to read, as would be used for a numpy array. Defaults to
+            reading all of the data.
+
+        Returns
+        -------
+        ndarray
+            The data read
+
+        """
+        if self._data is not None:
+            return self[ind]
+
+        ind, keep_dims = self._process_indices(ind)
+        if self._needs_pieces(ind):
+            requests, assemble = self._plan_pieces(ind)
+            batches = [requests[start:start + _max_request_items]
+                       for start in range(0, len(requests), _max_request_items)]
+            results = await asyncio.gather(*(self._fetch(batch) for batch in batches))
+            arr = assemble(data for batch in results for data in batch)
+        else:
+            arr = (await self._fetch([ind]))[0]
+        return self._remove_dims(arr, keep_dims)
+
+    async def _fetch(self, requests):
+        """Request data for several processed indices using a single request."""
+        messages = await self.dataset.cdmr.fetch_data_items([(self.path, req)
+                                                             for req in requests])
+        if len(messages) != len(requests):
+            raise RuntimeError('Requested {:d} pieces but received {:d} '
+                               'messages.'.format(len(requests), len(messages)))
+        return [self._set_dtype(arr) for arr in messages]
+
+
+class _AsyncMembers(object):
+    """Build asynchronous variables and groups for a Group."""
+
+    def _build_variable(self, var):
+        """Create an AsyncVariable from its NCStream message."""
+        new_var = AsyncVariable(self, var.name)
+        new_var.load_from_stream(var)
+        return new_var
+
+    def _build_group(self, grp):
+        """Create a child AsyncGroup from its NCStream message."""
+        new_group = AsyncGroup(self)
+        new_group.load_from_stream(grp)
+        return new_group
+
+
+class AsyncGroup(_AsyncMembers, Group):
+    """Group together asynchronous variables, attributes, and dimensions."""
+
+
+class AsyncDataset(_AsyncMembers, Dataset):
+    """Abstract away asynchronous access to the remote dataset.
+
+    Create using :meth:`open`. Variables are read using ``await var.read(index)``,
+    so different variables can be fetched concurrently, e.g. with
+    :func:`asyncio.gather`; the number of requests in flight is bounded by
+    :attr:`AsyncCDMRemote.max_concurrency`. :attr:`chunk_cache`, :attr:`header_cache`
+    and :attr:`max_workers` are not used.
+    """
+
+    def __init__(self, url, session=None):
+        """Initialize the dataset, without requesting the header."""
+        Group.__init__(self)
+        self.cdmr = AsyncCDMRemote(url, session)
+        self.url = url
+
+    @classmethod
+    async def open(cls, url, session=None):  # noqa: A003
+        """Open a dataset, requesting its header.
+
+        Parameters
+        ----------
+        url : str
+            The URL of the CDMRemote endpoint for the dataset
+        session : aiohttp.ClientSession, optional
+            The session used to make requests. By default, one is created and
+            closed by :meth:`close`.
+
+        Returns
+        -------
+        AsyncDataset
+
+        """
+        ds = cls(url, session)
+        ds._load_header(await ds.cdmr.fetch_header())
+        return ds
+
+    async def read_many(self, requests):
+        """Read data from several variables using a single request.
+
+        Parameters
+        ----------
+        requests : dict[str, indices]
+            Mapping of variable name (or path) to the indices to read
+
+        Returns
+        -------
+        dict[str, ndarray]
+            The data read for each variable
+
+        """
+        ret = {}
+        pending = []
+        pieces = {}
+        for name, ind in requests.items():
+            var = self._find_variable(name)
+            if var._data is not None:
+                ret[name] = var[ind]
+                continue
+
+            processed, keep_dims = var._process_indices(ind)
+            if var._needs_pieces(processed):
+                pieces[name] = (var, ind)
+            else:
+                pending.append((name, var, processed, keep_dims))
+
+        # Reads needing several pieces are made alongside the single request for the rest
+        results = await asyncio.gather(self._read_together(pending),
+                                       *(var.read(ind) for var, ind in pieces.values()))
+        ret.update(results[0])
+        ret.update(zip(pieces, results[1:]))
+        return ret
+
+    async def _read_together(self, pending):
+        """Read processed indices for several variables using a single request."""
+        if not pending:
+            return {}
+
+        messages = await self.cdmr.fetch_data_items([(var.path, ind)
+                                                     for _, var, ind, _ in pending])
+        if len(messages) != len(pending):
+            raise RuntimeError('Requested {:d} variables but received {:d} '
+                               'messages.'.format(len(pending), len(messages)))
+        return {name: var._remove_dims(var._set_dtype(arr), keep_dims)
+                for (name, var, _, keep_dims), arr in zip(pending, messages)}
+
+    async def close(self):
+        """Close the underlying session."""
+        await self.cdmr.close()
+
+    async def __aenter__(self):
+        """Enter the context manager."""
+        return self
+
+    async def __aexit__(self, *args):
+        """Close the session when leaving the context manager."""
+        await self.close()
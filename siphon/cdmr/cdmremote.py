@@ -3,22 +3,152 @@
 # SPDX-License-Identifier: BSD-3-Clause
 """Support talking to the CDMRemote endpoint on a THREDDS Data Server (TDS)."""
 
-from io import BytesIO
+from collections import namedtuple
+import threading
+import time
+import weakref
 
-from .ncstream import read_ncstream_messages
-from ..http_util import HTTPEndPoint
+from .ncstream import ChunkedReader, iter_ncstream_messages
+from ..http_util import HTTPEndPoint, session_manager
 
 
 class CDMRemote(HTTPEndPoint):
-    """Provide access to the various methods on the CDMRemote endpoint on a TDS."""
+    """Provide access to the various methods on the CDMRemote endpoint on a TDS.
+
+    Attributes
+    ----------
+    chunk_size : int
+        Number of bytes to read from the network at a time when decoding messages
+        from a response. Defaults to 64 KiB.
+    deflate : int or str
+        The deflate (compression) level to request data with; 0 disables compression.
+        Setting to ``'auto'`` chooses the level for each variable from the observed
+        throughput and decompression time (see :attr:`deflate_stats`).
+    deflate_stats : DeflateStats
+        The statistics used to choose the deflate level when :attr:`deflate` is
+        ``'auto'``.
+    struct_dtypes : dict
+        Mapping of variable names to the structured dtypes (see
+        :func:`~siphon.cdmr.ncstream.struct_to_dtype`) used to decode STRUCTURE and
+        SEQUENCE data. Filled in by :class:`~siphon.cdmr.Dataset` from the header.
+    decompress_workers : int
+        Number of threads used to decompress data in responses containing several
+        compressed messages. Defaults to 1, which decompresses each message as it is
+        read. The threads are kept between requests until :meth:`close`.
+
+    Notes
+    -----
+    Each thread making requests uses its own HTTP session, since sessions are not safe
+    to share between threads, so a single instance can be used for concurrent reads.
+    :meth:`close` closes all of them, along with the decompression threads. Sessions
+    of threads that have finished are closed when another thread creates its session.
+
+    """
+
+    chunk_size = 65536
+    decompress_workers = 1
 
     def __init__(self, url):
         """Initialize access to a particular url."""
+        self._local = threading.local()
+        self._sessions = []  # (weak reference to thread, session)
+        self._sessions_lock = threading.Lock()
+        self._executor = None
+        self._executor_lock = threading.Lock()
         super(CDMRemote, self).__init__(url)
         self.deflate = 0
+        self.deflate_stats = DeflateStats()
+        self.struct_dtypes = {}
+
+    @property
+    def _session(self):
+        """Get the HTTP session for the current thread, creating it if necessary."""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._session = session_manager.create_session()
+        return session
+
+    @_session.setter
+    def _session(self, session):
+        """Set the HTTP session for the current thread."""
+        self._local.session = session
+        with self._sessions_lock:
+            # Close the sessions of threads that have finished, so that pools that
+            # replace their threads do not accumulate sessions
+            finished = [s for thread, s in self._sessions if not _is_alive(thread)]
+            self._sessions = [(thread, s) for thread, s in self._sessions
+                              if _is_alive(thread)]
+            self._sessions.append((weakref.ref(threading.current_thread()), session))
+        for old in finished:
+            old.close()
+
+    def _get_executor(self):
+        """Get the pool of threads used for decompression, creating it if necessary.
+
+        Returns `None` if messages are to be decompressed as they are read.
+        """
+        workers = self.decompress_workers
+        with self._executor_lock:
+            if self._executor is not None and self._executor_workers != workers:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+            if self._executor is None and workers > 1:
+                from concurrent.futures import ThreadPoolExecutor
+                self._executor = ThreadPoolExecutor(max_workers=workers)
+                self._executor_workers = workers
+            return self._executor
+
+    def close(self):
+        """Close the HTTP sessions used by all threads, and the decompression threads."""
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+        with self._sessions_lock:
+            sessions, self._sessions = self._sessions, []
+            # Threads that make more requests get new sessions
+            self._local = threading.local()
+        for _, session in sessions:
+            session.close()
 
     def _fetch(self, query):
-        return read_ncstream_messages(BytesIO(self.get_query(query).content))
+        return list(self._iter_messages(query))
+
+    def _iter_messages(self, query, stats_key=None, level=None):
+        # Decode the messages as the response is downloaded, rather than first
+        # holding the whole response in memory
+        resp = self.get_query(query, stream=True)
+        executor = self._get_executor()
+        try:
+            if stats_key is None:
+                for msg in iter_ncstream_messages(
+                        ChunkedReader(resp.iter_content(self.chunk_size)), executor,
+                        2 * self.decompress_workers, self.struct_dtypes or None):
+                    yield msg
+            else:
+                # Keep track of time spent waiting on the network separately from time
+                # spent decoding, excluding time the caller spends between messages
+                chunks = _TimedChunks(resp.iter_content(self.chunk_size))
+                messages = iter_ncstream_messages(ChunkedReader(chunks), executor,
+                                                  2 * self.decompress_workers,
+                                                  self.struct_dtypes or None)
+                elapsed = 0
+                nbytes = 0
+                while True:
+                    start = time.time()
+                    msg = next(messages, None)
+                    elapsed += time.time() - start
+                    if msg is None:
+                        break
+                    nbytes += getattr(msg, 'nbytes', 0)
+                    yield msg
+
+                self.deflate_stats.record(stats_key, level, chunks.nbytes, nbytes,
+                                          chunks.seconds, elapsed - chunks.seconds)
+        finally:
+            resp.close()
 
     def fetch_capabilities(self):
         """Query the CDMRemote end point for its capabilities."""
@@ -30,10 +160,45 @@ class CDMRemote(HTTPEndPoint):
 
     def fetch_data(self, **var):
         """Retrieve data from CDMRemote for one or more variables."""
-        varstr = ','.join(name + self._convert_indices(ind)
-                          for name, ind in var.items())
+        return list(self.iter_data(**var))
+
+    def iter_data(self, **var):
+        """Retrieve data from CDMRemote for one or more variables, one message at a time.
+
+        Unlike :meth:`fetch_data`, each message is decoded and returned as soon as it
+        has been downloaded, so only the current message needs to be held in memory.
+        """
+        return self.iter_data_items(var.items())
+
+    def fetch_data_items(self, items):
+        """Retrieve data from CDMRemote for a sequence of variables and indices.
+
+        Parameters
+        ----------
+        items : sequence of (str, indices) tuples
+            The name of each variable to request, with the indices to request
+
+        Returns
+        -------
+        list
+            The returned messages, in the same order as `items`
+
+        """
+        return list(self.iter_data_items(items))
+
+    def iter_data_items(self, items):
+        """Retrieve data for a sequence of variables and indices, one message at a time."""
+        items = list(items)
+        varstr = ','.join(name + self._convert_indices(ind) for name, ind in items)
         query = self.query().add_query_parameter(req='data', var=varstr)
-        return self._fetch(query)
+        if self.deflate != 'auto':
+            return self._iter_messages(query)
+
+        key = ','.join(sorted(name for name, _ in items))
+        level = self.deflate_stats.choose(key)
+        if level:
+            query.add_query_parameter(deflate=level)
+        return self._iter_messages(query, key, level)
 
     def fetch_header(self):
         """Retrieve the header response from CDMRemote."""
@@ -56,14 +221,21 @@ class CDMRemote(HTTPEndPoint):
         """
         q = super(CDMRemote, self).query()
 
-        # Turn on compression if it's been set on the object
-        if self.deflate:
+        # Turn on compression if it's been set on the object. Adaptive compression
+        # is handled per request.
+        if self.deflate and self.deflate != 'auto':
             q.add_query_parameter(deflate=self.deflate)
 
         return q
 
     @staticmethod
     def _convert_indices(ind):
+        """Convert integers and slices to the CDMRemote section syntax.
+
+        CDMRemote only understands non-empty ranges with non-negative bounds, increasing
+        order, and a known end, so anything else needs to be resolved against the
+        shape beforehand--which :class:`siphon.cdmr.Dataset` does.
+        """
         reqs = []
         subset = False
         for i in ind:
@@ -72,8 +244,15 @@ class CDMRemote(HTTPEndPoint):
                     reqs.append(':')
                 else:
                     subset = True
+                    start = 0 if i.start is None else i.start
+                    if (i.stop is None or start < 0 or i.stop <= start
+                            or (i.step is not None and i.step < 1)):
+                        raise ValueError('Unable to request slice {} from CDMRemote; '
+                                         'bounds must be non-negative and increasing, '
+                                         'and stop must be given.'.format(i))
+
                     # Adjust for CDMRemote weird inclusive range
-                    slice_str = str(i.start) + ':' + str(i.stop - 1)
+                    slice_str = str(start) + ':' + str(i.stop - 1)
 
                     # Add step if necessary
                     if i.step:
@@ -85,3 +264,174 @@ class CDMRemote(HTTPEndPoint):
                 subset = True
 
         return '(' + ','.join(reqs) + ')' if subset else ''
+
+
+def _is_alive(thread_ref):
+    """Return whether the thread behind a weak reference is still running."""
+    thread = thread_ref()
+    return thread is not None and thread.is_alive()
+
+
+class _TimedChunks(object):
+    """Wrap an iterator of chunks, tracking the bytes and time spent waiting on them."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self.nbytes = 0
+        self.seconds = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.time()
+        try:
+            chunk = next(self._chunks)
+        finally:
+            self.seconds += time.time() - start
+        self.nbytes += len(chunk)
+        return chunk
+
+    next = __next__  # noqa: A003
+
+
+LevelStats = namedtuple('LevelStats', 'count ratio decode_rate')
+LevelStats.__doc__ = """Observed statistics for requests with a deflate level.
+
+Attributes
+----------
+count : int
+    Number of requests observed
+ratio : float
+    Bytes transferred per byte of decoded data
+decode_rate : float
+    Seconds spent decoding per byte of decoded data
+
+"""
+
+
+class DeflateStats(object):
+    """Choose deflate levels for CDMRemote requests from observed performance.
+
+    The link bandwidth is estimated from all requests, while the compression ratio
+    and decoding time are tracked for each variable (or set of variables) and deflate
+    level. The level with the smallest predicted time per byte of data is chosen;
+    levels that have not yet been tried for a variable are tried first, and every
+    `explore_interval` requests the least recently tried level is used again, so that
+    the choice follows changes in the link.
+    """
+
+    def __init__(self, levels=(0, 1, 5), smoothing=0.3, explore_interval=20):
+        """Initialize the statistics.
+
+        Parameters
+        ----------
+        levels : sequence of int, optional
+            The deflate levels to choose between. Defaults to 0 (off), 1, and 5.
+        smoothing : float, optional
+            Weight given to the newest observation in the moving averages.
+            Defaults to 0.3.
+        explore_interval : int, optional
+            Number of requests for a variable between retries of other levels.
+            Defaults to 20.
+
+        """
+        self.levels = tuple(levels)
+        self.smoothing = smoothing
+        self.explore_interval = explore_interval
+        self.bandwidth = None
+        self._stats = {}
+        self._last_used = {}
+        self._requests = {}
+        self._tried = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, key):
+        """Get the statistics for each level for a variable."""
+        return dict(self._stats[key])
+
+    def __contains__(self, key):
+        """Return whether there are statistics for a variable."""
+        return key in self._stats
+
+    def predicted_rate(self, key, level):
+        """Get the predicted seconds per byte of data for a variable at a level.
+
+        Returns :data:`None` if there is not enough information.
+        """
+        stats = self._stats.get(key, {}).get(level)
+        if stats is None or not self.bandwidth:
+            return None
+        return stats.ratio / self.bandwidth + stats.decode_rate
+
+    def choose(self, key):
+        """Choose the deflate level for the next request for a variable."""
+        with self._lock:
+            count = self._requests.get(key, 0)
+            self._requests[key] = count + 1
+            tried = self._tried.setdefault(key, set())
+            untried = [level for level in self.levels if level not in tried]
+            if untried:
+                # Mark it now so that a request that gives no data still moves us on
+                tried.add(untried[0])
+                return untried[0]
+
+            if count % self.explore_interval == self.explore_interval - 1:
+                last_used = self._last_used.get(key, {})
+                return min(self.levels, key=lambda level: last_used.get(level, 0))
+
+            stats = dict(self._stats.get(key, {}))
+
+        # Only levels with statistics can be compared
+        candidates = [level for level in self.levels if level in stats]
+        if not candidates:
+            return self.levels[0]
+
+        # Without a bandwidth estimate, no time has been spent waiting on the network,
+        # so decoding time is all that matters
+        if not self.bandwidth:
+            return min(candidates, key=lambda level: (stats[level].decode_rate,
+                                                      stats[level].ratio))
+        return min(candidates, key=lambda level: self.predicted_rate(key, level))
+
+    def record(self, key, level, wire_bytes, nbytes, network_seconds, decode_seconds):
+        """Record the observed performance of a request.
+
+        Parameters
+        ----------
+        key : str
+            The variable (or variables) requested
+        level : int
+            The deflate level used
+        wire_bytes : int
+            The number of bytes transferred
+        nbytes : int
+            The number of bytes of decoded data
+        network_seconds : float
+            Time spent waiting on the network
+        decode_seconds : float
+            Time spent decoding (including decompression)
+
+        """
+        with self._lock:
+            self._tried.setdefault(key, set()).add(level)
+        if not nbytes or not wire_bytes:
+            return
+
+        def smooth(old, new):
+            return new if old is None else old + self.smoothing * (new - old)
+
+        with self._lock:
+            if network_seconds > 0:
+                self.bandwidth = smooth(self.bandwidth, wire_bytes / float(network_seconds))
+
+            stats = self._stats.setdefault(key, {})
+            old = stats.get(level)
+            ratio = wire_bytes / float(nbytes)
+            decode_rate = max(decode_seconds, 0) / float(nbytes)
+            if old is None:
+                stats[level] = LevelStats(1, ratio, decode_rate)
+            else:
+                stats[level] = LevelStats(old.count + 1, smooth(old.ratio, ratio),
+                                          smooth(old.decode_rate, decode_rate))
+            self._last_used.setdefault(key, {})[level] = time.time()
@@ -3,29 +3,45 @@
 # SPDX-License-Identifier: BSD-3-Clause
 """Provide access to the CDMRemoteFeature endpoint on TDS."""
 
-from io import BytesIO
-
-from .ncstream import read_cdmrf_messages
+from .ncstream import ChunkedReader, iter_cdmrf_messages, read_cdmrf_messages
 from ..ncss import NCSS
 
 
 class CDMRemoteFeature(NCSS):
     """Communicate to the CDMRemoteFeature HTTP endpoint."""
 
+    # Number of bytes to read from the network at a time when decoding messages
+    chunk_size = 65536
+
     @staticmethod
     def _parse_messages(resp):
         """Parse server responses as CDMRemoteFeature messages."""
-        return read_cdmrf_messages(BytesIO(resp))
+        return read_cdmrf_messages(resp)
+
+    def _iter_messages(self, query):
+        """Decode the messages in the response to a query as they are downloaded."""
+        resp = self.get_query(query, stream=True)
+        try:
+            for msg in iter_cdmrf_messages(ChunkedReader(resp.iter_content(self.chunk_size))):
+                yield msg
+        finally:
+            resp.close()
 
-    def _get_metadata(self):
-        """Get header information and store as metadata for the endpoint."""
-        self.metadata = self.fetch_header()
-        self.variables = {g.name for g in self.metadata.grids}
+    def _fetch_metadata(self):
+        """Get header information to use as metadata for the endpoint."""
+        return self.fetch_header()
+
+    @property
+    def variables(self):
+        """Get the names of all grids available from the endpoint."""
+        if self._variables is None:
+            self._variables = {g.name for g in self.metadata.grids}
+        return self._variables
 
     def fetch_header(self):
         """Make a header request to the endpoint."""
         query = self.query().add_query_parameter(req='header')
-        return self._parse_messages(self.get_query(query).content)[0]
+        return list(self._iter_messages(query))[0]
 
     def fetch_feature_type(self):
         """Request the featureType from the endpoint."""
@@ -35,11 +51,15 @@ class CDMRemoteFeature(NCSS):
     def fetch_coords(self, query):
         """Pull down coordinate data from the endpoint."""
         q = query.add_query_parameter(req='coord')
-        return self._parse_messages(self.get_query(q).content)
+        return list(self._iter_messages(q))
 
     def get_data(self, query):
         """Pull down data (coverages) from the endpoint."""
-        return self._parse_messages(self.get_data_raw(query))
+        return list(self.iter_data(query))
+
+    def iter_data(self, query):
+        """Pull down data (coverages) from the endpoint, one message at a time."""
+        return self._iter_messages(query.add_query_parameter(req='data'))
 
     def get_data_raw(self, query):
         """Pull down the data but don't parse."""
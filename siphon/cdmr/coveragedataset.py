@@ -3,12 +3,17 @@
 # SPDX-License-Identifier: BSD-3-Clause
 """Provide access to a TDS Coverage Dataset."""
 
-from collections import OrderedDict
+from collections import namedtuple, OrderedDict
+from copy import deepcopy
 import logging
+import threading
 import warnings
 
+from . import cdmrfeature_pb2 as cdmrf
 from .cdmremotefeature import CDMRemoteFeature
-from .dataset import AttributeContainer
+from .dataset import AttributeContainer, LazyMembers
+from .ncstream import (data_type_to_numpy, read_cdmrf_messages, unpack_coord_axis,
+                       unpack_geo_array)
 
 logging.basicConfig(level=logging.WARNING)
 log = logging.getLogger(__name__)
@@ -23,8 +28,20 @@ class CoverageDataset(AttributeContainer):
     """Wrap dataset access using CDMRemoteFeature and Coverages.
 
     This is still experimental.
+
+    Grids are available from :attr:`grids`, which creates each :class:`Grid` when it
+    is first accessed.
+
+    Attributes
+    ----------
+    header_cache : HeaderCache or None
+        Persistent cache for the dataset header (see :class:`~siphon.cdmr.HeaderCache`).
+        Defaults to :data:`None`, which disables caching.
+
     """
 
+    header_cache = None
+
     def __init__(self, url):
         """Initialize CoverageDataset from a url pointing to CDMRemoteFeature endpoint."""
         super(CoverageDataset, self).__init__()
@@ -38,13 +55,20 @@ class CoverageDataset(AttributeContainer):
         self.type = None
         self.axes = OrderedDict()
         self.coord_systems = OrderedDict()
-        self.grids = OrderedDict()
+        self.grids = LazyMembers(lambda cov: Grid(self, cov))
         self.transforms = OrderedDict()
+        self._coords = {}
+        self._coords_lock = threading.Lock()
         self._read_header()
 
     def _read_header(self):
         """Get the needed header information to initialize dataset."""
-        self._header = self.cdmrf.fetch_header()
+        if self.header_cache is not None:
+            query = self.cdmrf.query().add_query_parameter(req='header')
+            self._header = read_cdmrf_messages(self.header_cache.fetch(self.cdmrf,
+                                                                       query))[0]
+        else:
+            self._header = self.cdmrf.fetch_header()
         self.load_from_stream(self._header)
 
     def load_from_stream(self, header):
@@ -66,7 +90,78 @@ class CoverageDataset(AttributeContainer):
             self.axes[ax.name] = ax
 
         for cov in header.grids:
-            self.grids[cov.name] = cov
+            self.grids.add_packed(cov.name, cov)
+
+    def query(self):
+        """Create a query for subsetting grids from this dataset.
+
+        Returns
+        -------
+        NCSSQuery
+            The query, which can be passed to :meth:`get_data` or :meth:`Grid.get_data`
+
+        """
+        return self.cdmrf.query()
+
+    def coords(self, coord_sys):
+        """Get the coordinate values for the axes of a coordinate system.
+
+        Values are computed from the header where possible, and otherwise requested
+        from the server. They are cached for each coordinate system.
+
+        Parameters
+        ----------
+        coord_sys : str
+            The name of the coordinate system
+
+        Returns
+        -------
+        OrderedDict[str, `numpy.ndarray`]
+            The values for each axis
+
+        """
+        with self._coords_lock:
+            if coord_sys not in self._coords:
+                self._coords[coord_sys] = OrderedDict(
+                    (name, self._axis_values(self.axes[name]))
+                    for name in self.coord_systems[coord_sys].axisNames)
+            return self._coords[coord_sys]
+
+    def _axis_values(self, axis):
+        """Get the values for a coordinate axis, requesting them if necessary."""
+        values = unpack_coord_axis(axis)
+        if values is None:
+            values = self.cdmrf.fetch_coords(self.query().variables(axis.name))[0]
+        return values
+
+    def dimensions(self, coord_sys):
+        """Get the names of the axes that are dimensions of data for a coordinate system.
+
+        Scalar and dependent axes do not add a dimension to the data.
+        """
+        return tuple(name for name in self.coord_systems[coord_sys].axisNames
+                     if self.axes[name].depend == cdmrf.independent)
+
+    def get_data(self, query):
+        """Request data for the grids in a query.
+
+        Parameters
+        ----------
+        query : NCSSQuery
+            The query, including the names of the grids and any subsetting
+
+        Returns
+        -------
+        OrderedDict[str, GridData]
+            The data for each grid, along with its coordinates
+
+        """
+        ret = OrderedDict()
+        for resp in self.cdmrf.get_data(deepcopy(query)):
+            axes = {axis.name: axis for axis in resp.coordAxes}
+            for geo in resp.geoArray:
+                ret[geo.coverageName] = _unpack_grid_data(geo, axes)
+        return ret
 
     def __str__(self):
         """Create a string representation of CoverageDataset."""
@@ -104,3 +199,90 @@ class CoverageDataset(AttributeContainer):
             for att in self.ncattrs():
                 print_groups.append('{0}{1}: {2}'.format(indent, att, getattr(self, att)))
         return '\n'.join(print_groups)
+
+
+GridData = namedtuple('GridData', 'values dimensions coords')
+GridData.__doc__ = """Data returned for a grid.
+
+Attributes
+----------
+values : `numpy.ndarray`
+    The data
+dimensions : tuple[str]
+    The names of the axes for each dimension of `values`
+coords : OrderedDict[str, `numpy.ndarray`]
+    The values for each axis of the subset, including scalar axes
+
+"""
+
+
+def _unpack_grid_data(geo, axes):
+    """Decode a GeoReferencedArray along with its coordinate axes."""
+    values = unpack_geo_array(geo)
+    coords = OrderedDict((name, unpack_coord_axis(axes[name]))
+                         for name in geo.axisName if name in axes)
+    dims = tuple(name for name in geo.axisName
+                 if name not in axes or axes[name].depend == cdmrf.independent)
+    if len(dims) != values.ndim:
+        log.warning('Could not match axes %s to data with shape %s', geo.axisName,
+                    values.shape)
+    return GridData(values, dims, coords)
+
+
+class Grid(AttributeContainer):
+    """Provide access to a single grid from a :class:`CoverageDataset`.
+
+    Creating the grid does not make any requests; data are requested using
+    :meth:`get_data`.
+    """
+
+    def __init__(self, dataset, coverage):
+        """Initialize the grid from its Coverage message."""
+        super(Grid, self).__init__()
+        self.dataset = dataset
+        self.name = coverage.name
+        self.units = coverage.units
+        self.description = coverage.description
+        self.coord_sys = coverage.coordSys
+        self.dtype = data_type_to_numpy(coverage.dataType)
+        self._coverage = coverage
+        self._unpack_attrs(coverage.atts)
+
+    @property
+    def dimensions(self):
+        """Get the names of the axes for each dimension of the grid."""
+        return self.dataset.dimensions(self.coord_sys)
+
+    @property
+    def shape(self):
+        """Get the shape of the full grid."""
+        return tuple(self.dataset.axes[name].nvalues for name in self.dimensions)
+
+    @property
+    def coords(self):
+        """Get the coordinate values for the full grid."""
+        return self.dataset.coords(self.coord_sys)
+
+    def get_data(self, query=None):
+        """Request data for the grid, optionally subset.
+
+        Parameters
+        ----------
+        query : NCSSQuery, optional
+            Subsetting (e.g. time, vertical level, lon/lat box) to apply, such as from
+            :meth:`CoverageDataset.query`. Any variables in the query are replaced by
+            this grid. Defaults to requesting the whole grid.
+
+        Returns
+        -------
+        GridData
+            The data along with its coordinates
+
+        """
+        query = self.dataset.query() if query is None else deepcopy(query)
+        query.var = {self.name}
+        return self.dataset.get_data(query)[self.name]
+
+    def __str__(self):
+        """Return a string representation of the grid."""
+        return str(self._coverage)
@@ -0,0 +1,101 @@
+# Copyright (c) 2018 Siphon Contributors.
+# Distributed under the terms of the BSD 3-Clause License.
+# SPDX-License-Identifier: BSD-3-Clause
+"""Provide lazy dask arrays for variables accessed using CDMRemote."""
+
+from collections import OrderedDict
+import threading
+
+import dask.array as da
+from dask.base import tokenize
+import numpy as np
+
+from .cdmremote import CDMRemote
+from .dataset import block_shape, set_dtype
+
+# CDMRemote instances (and their HTTP sessions) for each thread, so that tasks run by
+# the same worker reuse connections. Only the most recently used are kept open, so that
+# long-running workers do not hold a session for every dataset they have read.
+_local = threading.local()
+_max_remotes = 4
+
+
+def _get_cdmr(url, deflate):
+    """Get a CDMRemote instance for the current thread."""
+    remotes = getattr(_local, 'remotes', None)
+    if remotes is None:
+        remotes = _local.remotes = OrderedDict()
+
+    key = (url, deflate)
+    cdmr = remotes.pop(key, None)
+    if cdmr is None:
+        while remotes and len(remotes) >= _max_remotes:
+            remotes.popitem(last=False)[1].close()
+        cdmr = CDMRemote(url)
+        cdmr.deflate = deflate
+
+    # Keep in order of use, most recent last
+    remotes[key] = cdmr
+    return cdmr
+
+
+class RemoteArray(object):
+    """Provide array-like access to a CDMRemote variable for dask.
+
+    Only the information needed to make requests (the dataset URL, variable path, shape,
+    and dtype) is held, so that instances can be pickled and sent to other processes.
+    Each indexing operation makes one request.
+    """
+
+    def __init__(self, url, path, shape, dtype, deflate=0, native=False):
+        """Initialize the array."""
+        self.url = url
+        self.path = path
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.ndim = len(self.shape)
+        self.deflate = deflate
+        self.native = native
+
+    @classmethod
+    def from_variable(cls, var):
+        """Create an array for a :class:`~siphon.cdmr.dataset.Variable`."""
+        return cls(var.dataset.url, var.path, var.shape, var.dtype,
+                   var.dataset.cdmr.deflate, var.dataset.native_byteorder)
+
+    def __getitem__(self, key):
+        """Request the data for a tuple of slices and integers."""
+        if not isinstance(key, tuple):
+            key = (key,)
+
+        # Let numpy work out the shape of the result, using a view that takes no memory
+        shape = np.broadcast_to(np.empty((), dtype=self.dtype), self.shape)[key].shape
+        if not all(shape):
+            return np.empty(shape, dtype=self.dtype)
+
+        ind = []
+        for i, size in zip(key + (slice(None),) * (self.ndim - len(key)), self.shape):
+            if isinstance(i, slice):
+                start, stop, step = i.indices(size)
+                ind.append(slice(start, stop, step if step != 1 else None))
+            else:
+                ind.append(i % size)
+
+        arr = _get_cdmr(self.url, self.deflate).fetch_data(**{self.path: ind})[0]
+        return set_dtype(arr, self.dtype, self.native).reshape(shape)
+
+
+def to_dask(var, chunks=None, chunk_bytes=32 * 1024 * 1024):
+    """Create a lazy :class:`dask.array.Array` for a CDMRemote variable.
+
+    See :meth:`siphon.cdmr.dataset.Variable.to_dask`.
+    """
+    if var.dtype.kind == 'O' or '*' in var.dimensions:
+        raise ValueError('Only variables with fixed-size data can be read with dask.')
+
+    arr = RemoteArray.from_variable(var)
+    if chunks is None:
+        chunks = block_shape(arr.shape, arr.dtype.itemsize, chunk_bytes)
+    name = 'cdmremote-' + tokenize(arr.url, arr.path, arr.deflate, arr.native, chunks)
+    return da.from_array(arr, chunks=chunks, name=name, lock=False, fancy=False,
+                         meta=np.empty((0,) * arr.ndim, dtype=arr.dtype))
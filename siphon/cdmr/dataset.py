@@ -7,21 +7,43 @@ from __future__ import print_function
 
 from collections import OrderedDict
 import enum
+import hashlib
+import itertools
+import json
 import logging
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
 
 from .cdmremote import CDMRemote
-from .ncstream import unpack_attribute, unpack_variable
+from .ncstream import (read_ncstream_messages, SequenceData, struct_to_dtype,
+                       unpack_attribute, unpack_variable_data, unpack_variable_type)
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:  # Python 2
+    from collections import MutableMapping
 
 logging.basicConfig(level=logging.WARNING)
 log = logging.getLogger(__name__)
 
+# Limit on the number of pieces of a variable sent in one request, to keep URLs sane
+_max_request_items = 64
+
 
 class AttributeContainer(object):
-    """Unpack and provide access to attributes."""
+    """Unpack and provide access to attributes.
+
+    Attribute values are only unpacked from the header when first accessed.
+    """
 
     def __init__(self):
         """Initialize the container."""
         self._attrs = []
+        self._packed_attrs = {}
 
     def ncattrs(self):
         """Return a list of all available attributes."""
@@ -29,9 +51,85 @@ class AttributeContainer(object):
 
     def _unpack_attrs(self, attrs):
         for att in attrs:
-            name, val = unpack_attribute(att)
-            self._attrs.append(name)
+            self._attrs.append(att.name)
+            # Attributes shadowing anything already set are unpacked now so they
+            # still take precedence
+            if hasattr(self, att.name):
+                name, val = unpack_attribute(att)
+                setattr(self, name, val)
+            else:
+                self._packed_attrs[att.name] = att
+
+    def __getattr__(self, name):
+        """Unpack an attribute on first access."""
+        # Only called when normal lookup fails. Look in __dict__ directly to avoid
+        # recursion before __init__ has run.
+        packed = self.__dict__.get('_packed_attrs', {})
+        att = packed.get(name)
+        if att is not None:
+            # Only remove the packed value once set, so that another thread looking at
+            # the same time can always find one or the other
+            _, val = unpack_attribute(att)
             setattr(self, name, val)
+            packed.pop(name, None)
+            return val
+        raise AttributeError('{0!r} object has no attribute {1!r}'.format(
+            type(self).__name__, name))
+
+
+class LazyMembers(MutableMapping):
+    """Ordered mapping of members of a Group that are built on first access.
+
+    Names are known up front, but each value is only created, from its header message,
+    when it is accessed.
+    """
+
+    def __init__(self, build):
+        """Initialize with the function that creates a member from its message."""
+        self._build = build
+        self._members = OrderedDict()
+        self._packed = {}
+        self._lock = threading.Lock()
+
+    def add_packed(self, name, msg):
+        """Add a member to be built from `msg` when accessed."""
+        self._members[name] = None
+        self._packed[name] = msg
+
+    def __getitem__(self, name):
+        """Get a member, creating it if necessary."""
+        with self._lock:
+            if name in self._packed:
+                self._members[name] = self._build(self._packed.pop(name))
+            return self._members[name]
+
+    def __setitem__(self, name, value):
+        """Set a member."""
+        with self._lock:
+            self._packed.pop(name, None)
+            self._members[name] = value
+
+    def __delitem__(self, name):
+        """Remove a member."""
+        with self._lock:
+            self._packed.pop(name, None)
+            del self._members[name]
+
+    def __contains__(self, name):
+        """Return whether there is a member with a name, without creating it."""
+        return name in self._members
+
+    def __iter__(self):
+        """Iterate over the member names."""
+        return iter(self._members)
+
+    def __len__(self):
+        """Return the number of members."""
+        return len(self._members)
+
+    def __repr__(self):
+        """Return a representation of the names in the mapping."""
+        return '{0}({1})'.format(type(self).__name__, list(self._members))
 
 
 class Group(AttributeContainer):
@@ -40,8 +138,8 @@ class Group(AttributeContainer):
     def __init__(self, parent=None):
         """Initialize a Group."""
         super(Group, self).__init__()
-        self.groups = OrderedDict()
-        self.variables = OrderedDict()
+        self.groups = LazyMembers(self._build_group)
+        self.variables = LazyMembers(self._build_variable)
         self.dimensions = OrderedDict()
         self.types = OrderedDict()
         if parent:
@@ -59,7 +157,10 @@ class Group(AttributeContainer):
             return self.dataset.path + '/' + self.name
 
     def load_from_stream(self, group):
-        """Load a Group from an NCStream object."""
+        """Load a Group from an NCStream object.
+
+        Variables and child groups are only created when first accessed.
+        """
         self._unpack_attrs(group.atts)
         self.name = group.name
 
@@ -69,25 +170,31 @@ class Group(AttributeContainer):
             new_dim.load_from_stream(dim)
 
         for var in group.vars:
-            new_var = Variable(self, var.name)
-            self.variables[var.name] = new_var
-            new_var.load_from_stream(var)
+            self.variables.add_packed(var.name, var)
 
         for grp in group.groups:
-            new_group = Group(self)
-            self.groups[grp.name] = new_group
-            new_group.load_from_stream(grp)
+            self.groups.add_packed(grp.name, grp)
 
         for struct in group.structs:
-            new_var = Variable(self, struct.name)
-            self.variables[struct.name] = new_var
-            new_var.load_from_stream(struct)
+            self.variables.add_packed(struct.name, struct)
 
         if group.enumTypes:
             for en in group.enumTypes:
                 self.types[en.name] = enum.Enum(en.name,
                                                 [(typ.value, typ.code) for typ in en.map])
 
+    def _build_variable(self, var):
+        """Create a Variable from its NCStream message."""
+        new_var = Variable(self, var.name)
+        new_var.load_from_stream(var)
+        return new_var
+
+    def _build_group(self, grp):
+        """Create a child Group from its NCStream message."""
+        new_group = Group(self)
+        new_group.load_from_stream(grp)
+        return new_group
+
     def __str__(self):
         """Return a string representation of the Group and its members."""
         print_groups = []
@@ -125,21 +232,155 @@ class Group(AttributeContainer):
 
 
 class Dataset(Group):
-    """Abstract away access to the remote dataset."""
+    """Abstract away access to the remote dataset.
+
+    Attributes
+    ----------
+    chunk_cache : ChunkCache or None
+        Cache for blocks of variable data. When set, reads from variables are
+        satisfied from previously fetched blocks, with only the missing blocks
+        requested from the server. Defaults to :data:`None`, which disables caching.
+    header_cache : HeaderCache or None
+        Persistent cache for the dataset header. When set, datasets opened recently
+        are loaded from the stored header rather than requesting it from the server.
+        Defaults to :data:`None`, which disables caching.
+    native_byteorder : bool
+        Whether to convert data read from variables to native byte order. Data are
+        sent big endian, which NumPy supports directly but with slower computation.
+        When true, each read is byte swapped once, in place where possible. Defaults
+        to :data:`False`, which keeps the byte order sent in the dtype.
+    max_workers : int
+        Maximum number of concurrent requests used for a single read from a variable.
+        Reads larger than :attr:`split_bytes` are split along their outermost
+        dimension into up to this many requests, which are downloaded and decoded in
+        parallel by a pool of threads kept until :meth:`close`. Defaults to 1, which
+        disables splitting.
+    split_bytes : int
+        Minimum number of bytes for each piece of a split read. Defaults to 8 MiB.
+
+    """
+
+    chunk_cache = None
+    header_cache = None
+    native_byteorder = False
+    max_workers = 1
+    split_bytes = 8 * 1024 * 1024
 
     def __init__(self, url):
         """Initialize the dataset."""
         super(Dataset, self).__init__()
         self.cdmr = CDMRemote(url)
         self.url = url
+        self._executor = None
+        self._executor_lock = threading.Lock()
         self._read_header()
 
+    def _get_executor(self):
+        """Get the pool of threads used for split reads, creating it if necessary.
+
+        Keeping the threads between reads lets each reuse its HTTP session.
+        """
+        with self._executor_lock:
+            if self._executor is not None and self._executor_workers != self.max_workers:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+            if self._executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+                self._executor_workers = self.max_workers
+            return self._executor
+
+    def close(self):
+        """Release the threads and HTTP sessions used for reading data."""
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+        self.cdmr.close()
+
+    def __enter__(self):
+        """Enter the context manager."""
+        return self
+
+    def __exit__(self, *args):
+        """Close the dataset when leaving the context manager."""
+        self.close()
+
     def _read_header(self):
-        messages = self.cdmr.fetch_header()
+        if self.header_cache is not None:
+            query = self.cdmr.query().add_query_parameter(req='header')
+            messages = read_ncstream_messages(self.header_cache.fetch(self.cdmr, query))
+        else:
+            messages = self.cdmr.fetch_header()
+        self._load_header(messages)
+
+    def _load_header(self, messages):
+        """Populate the Dataset from the messages of a header response."""
         if len(messages) != 1:
             log.warning('Receive %d messages for header!', len(messages))
         self._header = messages[0]
         self.load_from_stream(self._header.root)
+        self._register_structs(self._header.root)
+
+    def _register_structs(self, group, prefix=''):
+        """Give the structured dtypes of variables to CDMRemote for decoding data."""
+        for struct in group.structs:
+            self.cdmr.struct_dtypes[prefix + struct.name] = struct_to_dtype(struct)
+        for grp in group.groups:
+            self._register_structs(grp, prefix + grp.name + '/')
+
+    def read_many(self, requests):
+        """Read data from several variables using a single request.
+
+        Variables whose data were included in the header are read locally; all others
+        are requested from the server together, and each returned message is matched
+        to the variable that asked for it. This does not use :attr:`chunk_cache`.
+
+        Parameters
+        ----------
+        requests : dict[str, indices]
+            Mapping of variable name to the indices to read, as would be passed to
+            ``Variable.__getitem__``. Variables in groups can be given by their path,
+            e.g. ``'group/var'``.
+
+        Returns
+        -------
+        dict[str, ndarray]
+            The data read for each variable
+
+        """
+        ret = {}
+        pending = []
+        for name, ind in requests.items():
+            var = self._find_variable(name)
+            if var._data is not None:
+                ret[name] = var[ind]
+                continue
+
+            ind, keep_dims = var._process_indices(ind)
+            if var._needs_pieces(ind):
+                ret[name] = var._remove_dims(var._read_pieces(ind), keep_dims)
+            else:
+                pending.append((name, var, ind, keep_dims))
+
+        if pending:
+            messages = self.cdmr.fetch_data_items([(var.path, ind)
+                                                   for _, var, ind, _ in pending])
+            if len(messages) != len(pending):
+                raise RuntimeError('Requested {:d} variables but received {:d} '
+                                   'messages.'.format(len(pending), len(messages)))
+            for (name, var, _, keep_dims), arr in zip(pending, messages):
+                ret[name] = var._remove_dims(var._set_dtype(arr), keep_dims)
+        return ret
+
+    def _find_variable(self, path):
+        """Find a variable given its path relative to the root group."""
+        parts = path.strip('/').split('/')
+        group = self
+        for name in parts[:-1]:
+            group = group.groups[name]
+        return group.variables[parts[-1]]
 
     def __str__(self):
         """Return a string representation of the Dataset and all contained members."""
@@ -157,7 +398,8 @@ class Variable(AttributeContainer):
         self._group = group
         self.name = name
         self.dimensions = ()
-        self._data = None
+        self._stream_var = None
+        self._unpacked_data = None
         self.dataset = group.dataset
         self._enum = False
 
@@ -165,6 +407,17 @@ class Variable(AttributeContainer):
         """Return the parent Group."""
         return self._group
 
+    @property
+    def _data(self):
+        """Get the data included in the header, if any, unpacking it on first use."""
+        stream_var = self._stream_var
+        if stream_var is not None:
+            # Unpacking again in another thread at the same time is harmless
+            data = unpack_variable_data(stream_var, self.dtype)
+            self._unpacked_data = data.reshape(self.shape) if data is not None else None
+            self._stream_var = None
+        return self._unpacked_data
+
     @property
     def path(self):
         """Return the full path to the Variable, including any parent Groups."""
@@ -177,66 +430,213 @@ class Variable(AttributeContainer):
             return self._data if not self.shape else self._data[ind]
         else:
             ind, keep_dims = self._process_indices(ind)
-
-            # Get the data for our request. We assume we only get 1 message.
-            messages = self.dataset.cdmr.fetch_data(**{self.path: ind})
-            arr = messages[0]
-
-            # Get the proper byte ordering.
-            # We handle structures by looking for a structured dtype. By convention,
-            # this has a single field which is has a void type and the byte order encoded
-            # in its name. This is because we can't retrieve a useful byte order from
-            # any of these flexible types.
-            if arr.dtype == 'O' and hasattr(arr[0], 'dtype'):
-                byteorder = arr[0].dtype.byteorder
-            elif arr.dtype.fields and arr.dtype.names[0] in ('>', '<'):
-                byteorder = arr.dtype.names[0]
+            if self._needs_pieces(ind):
+                arr = self._read_pieces(ind)
             else:
-                byteorder = arr.dtype.byteorder
-
-            # Set the dtype on the returned data to our own dtype, with byte ordering set
-            # based on what was returned. This allows us to handle structures.
-            dt = self.dtype.newbyteorder(byteorder)
-
-            if arr.dtype == 'O':
-                if hasattr(arr[0], 'dtype'):
-                    for subarray in arr:
-                        subarray.dtype = dt
-            # Don't reset dtype if we've already decoded to struct
-            elif arr.dtype.fields and arr.dtype.fields == dt.fields:
-                pass
-            else:
-                arr.dtype = dt
+                arr = self._read_cached(ind)
+            return self._remove_dims(arr, keep_dims)
+
+    @staticmethod
+    def _remove_dims(arr, keep_dims):
+        """Remove the dimensions that have had an index applied.
 
-            # Need to handle removing dimensions that have had an index
-            # applied -- the protocol returns them with size 1, but numpy
-            # behavior removes them
-            if keep_dims:
-                return arr.reshape(*[arr.shape[i] for i in keep_dims])
+        The protocol returns them with size 1, but numpy behavior removes them.
+        """
+        if keep_dims:
+            return arr.reshape(*[arr.shape[i] for i in keep_dims])
+        else:
+            return arr.squeeze()
+
+    def _read_cached(self, ind):
+        """Read data for processed indices, using the chunk cache if possible."""
+        cache = self.dataset.chunk_cache
+        if cache is not None and cache.can_cache(self):
+            return cache.read(self, ind)
+        return self._read(ind)
+
+    @staticmethod
+    def _needs_pieces(ind):
+        """Determine whether processed indices cannot be sent as a single request."""
+        return any(np.ndim(i) or (isinstance(i, slice) and i.start is not None
+                                  and i.start >= i.stop) for i in ind)
+
+    def _read_pieces(self, ind):
+        """Read data for processed indices that include arrays of integers.
+
+        Each array is coalesced into as few slices as possible, and each combination of
+        slices is requested separately--rather than requesting everything between the
+        first and last index. The pieces are then assembled and put back into the
+        requested order. All dimensions are kept, like :meth:`_read`.
+        """
+        requests, assemble = self._plan_pieces(ind)
+        cache = self.dataset.chunk_cache
+        if len(requests) <= 1 or (cache is not None and cache.can_cache(self)):
+            results = (self._read_cached(req) for req in requests)
+        else:
+            results = self._read_batches(requests)
+        return assemble(results)
+
+    def _plan_pieces(self, ind):
+        """Find the requests needed for processed indices that include arrays.
+
+        Returns the list of processed indices to request, along with a function that
+        assembles the output from the data read for each of them, in order.
+        """
+        # For each dimension, find the pieces to request along with where each goes
+        # in the output.
+        pieces = []
+        out_shape = []
+        final_shape = []
+        reorder = []
+        for i, size in zip(ind, self.shape):
+            if isinstance(i, slice):
+                pieces.append([(i, slice(None))])
+                out_shape.append(len(range(*i.indices(size))))
+                final_shape.append(out_shape[-1])
+            elif np.ndim(i):
+                slices, inverse = coalesce_indices(i)
+                offsets = np.cumsum([0] + [len(range(*s.indices(size))) for s in slices])
+                pieces.append([(s, slice(start, end))
+                               for s, start, end in zip(slices, offsets[:-1], offsets[1:])])
+                reorder.append((len(out_shape), inverse))
+                out_shape.append(offsets[-1])
+                final_shape.append(inverse.size)
             else:
-                return arr.squeeze()
+                pieces.append([(i, slice(None))])
+                out_shape.append(1)
+                final_shape.append(1)
+
+        combos = list(itertools.product(*pieces)) if all(final_shape) else []
+
+        def assemble(results):
+            out = np.empty(final_shape, dtype=self.dtype) if not combos else None
+            for combo, data in zip(combos, results):
+                if out is None:
+                    out = np.empty(out_shape, dtype=data.dtype)
+                out[tuple(dest for _, dest in combo)] = data.reshape(
+                    [len(range(*req.indices(size))) if isinstance(req, slice) else 1
+                     for (req, _), size in zip(combo, self.shape)])
+
+            # Put the values for index arrays back into the requested order
+            if combos:
+                for axis, inverse in reorder:
+                    out = np.take(out, inverse, axis=axis)
+            return out
+
+        return [[req for req, _ in combo] for combo in combos], assemble
+
+    def _read_batches(self, requests):
+        """Request data for several processed indices, with several pieces per request."""
+        for start in range(0, len(requests), _max_request_items):
+            batch = requests[start:start + _max_request_items]
+            messages = self.dataset.cdmr.fetch_data_items([(self.path, req)
+                                                           for req in batch])
+            if len(messages) != len(batch):
+                raise RuntimeError('Requested {:d} pieces but received {:d} '
+                                   'messages.'.format(len(batch), len(messages)))
+            for arr in messages:
+                yield self._set_dtype(arr)
+
+    def _read(self, ind):
+        """Request data for processed indices, keeping all dimensions."""
+        # Only split reads of fixed-size data, which can go into a single array
+        fixed_size = self.dtype.kind != 'O' and '*' not in self.dimensions
+        if self.dataset.max_workers > 1 and fixed_size:
+            counts = [len(range(*i.indices(size))) if isinstance(i, slice) else 1
+                      for i, size in zip(ind, self.shape)]
+            nbytes = int(np.prod(counts)) * self.dtype.itemsize
+            pieces = min(self.dataset.max_workers, nbytes // self.dataset.split_bytes)
+            split_dims = [dim for dim, count in enumerate(counts) if count > 1]
+            if pieces > 1 and split_dims:
+                return self._read_split(ind, counts, split_dims[0], pieces)
+
+        return self._read_one(ind)
+
+    def _read_one(self, ind):
+        """Request data for processed indices with a single request."""
+        # Get the data for our request. We assume we only get 1 message.
+        messages = self.dataset.cdmr.fetch_data(**{self.path: ind})
+        return self._set_dtype(messages[0])
+
+    def _read_split(self, ind, counts, dim, pieces):
+        """Request data with concurrent requests for pieces along a dimension.
+
+        Each piece is copied into a single output array as it arrives.
+        """
+        from concurrent.futures import as_completed
+
+        start, _, step = ind[dim].indices(self.shape[dim])
+        bounds = np.linspace(0, counts[dim], min(pieces, counts[dim]) + 1).astype(int)
+        pool = self.dataset._get_executor()
+        futures = {}
+        for low, high in zip(bounds[:-1], bounds[1:]):
+            sub = list(ind)
+            sub[dim] = slice(start + low * step, start + (high - 1) * step + 1, step)
+            futures[pool.submit(self._read_one, sub)] = (low, high)
+
+        out = None
+        for fut in as_completed(futures):
+            arr = fut.result()
+            if out is None:
+                out = np.empty(counts, dtype=arr.dtype)
+            low, high = futures[fut]
+            out[(slice(None),) * dim + (slice(low, high),)] = arr
+        return out
+
+    def _set_dtype(self, arr):
+        """Set our dtype on a returned array, with the byte order that was sent."""
+        # Sequences give all the records from the variable
+        if isinstance(arr, SequenceData):
+            arr = arr.records
+        return set_dtype(arr, self.dtype, self.dataset.native_byteorder)
+
+    def to_dask(self, chunks=None, chunk_bytes=32 * 1024 * 1024):
+        """Get the Variable's data as a lazy :class:`dask.array.Array`.
+
+        Each chunk is read using its own CDMRemote request. The tasks only refer to
+        the dataset's URL and the variable's path, so they can be pickled to run on a
+        process pool or a distributed cluster. Requires :mod:`dask`.
+
+        Parameters
+        ----------
+        chunks : tuple, optional
+            The chunks to use, in any form accepted by :func:`dask.array.from_array`.
+            By default, chunks of about `chunk_bytes` are chosen that keep the inner
+            dimensions whole.
+        chunk_bytes : int, optional
+            Target size of the default chunks in bytes. Defaults to 32 MiB.
+
+        Returns
+        -------
+        dask.array.Array
+
+        """
+        from .dask_support import to_dask
+        return to_dask(self, chunks, chunk_bytes)
 
     def _process_indices(self, ind):
-        # Make sure we have a list of indices
-        try:
+        # Make sure we have a list of indices. Anything other than a tuple, such as a
+        # list or array, is an index for the first dimension.
+        if isinstance(ind, tuple):
             ind = list(ind)
-        except TypeError:
+        else:
             ind = [ind]
 
         # Make sure we don't have too many things to index
         if len(ind) > self.ndim:
             # But allow a full slice on a scalar variable
-            if not (self.ndim == 0 and len(ind) == 1 and ind[0] == slice(None)):
+            if not (self.ndim == 0 and len(ind) == 1 and isinstance(ind[0], slice)
+                    and ind[0] == slice(None)):
                 raise IndexError('Too many dimensions to index.')
 
         # Expand to a slice/ellipsis for every dimension
-        if Ellipsis not in ind and len(ind) < self.ndim:
+        if not any(i is Ellipsis for i in ind) and len(ind) < self.ndim:
             ind.append(Ellipsis)
 
-        # Check for ellipsis
-        if Ellipsis in ind:
+        # Check for ellipsis; arrays can't be compared with ==, so look for it by identity
+        if any(i is Ellipsis for i in ind):
             num_empty = self.ndim - len(ind) + 1
-            ellip_ind = ind.index(Ellipsis)
+            ellip_ind = [i is Ellipsis for i in ind].index(True)
             ind.pop(ellip_ind)
             ind[ellip_ind:ellip_ind] = [slice(None)] * num_empty
 
@@ -258,26 +658,48 @@ class Variable(AttributeContainer):
                 if is_vlen:
                     raise RuntimeError("Can't slice along vlen dimension (%d)!", dim)
 
-                # Adjust start and stop to handle negative indexing
-                # and partial support for slicing beyond end.
-                if i.start is None:
-                    start = 0
-                else:
-                    start = self._adjust_index(dim, i.start)
+                # Adjust start and stop to handle negative indexing, open ends,
+                # and slicing beyond end.
+                start, stop, step = i.indices(self.shape[dim])
 
-                if i.stop is None:
-                    stop = self.shape[dim]
+                # Negative steps are read in increasing order and then reversed
+                if step < 0:
+                    ind[dim] = np.arange(start, stop, step)
                 else:
-                    stop = self._adjust_index(dim, i.stop)
-
-                # Need to create new slice for adjusted values
-                ind[dim] = slice(start, stop, i.step)
+                    # Need to create new slice for adjusted values
+                    ind[dim] = slice(start, max(start, stop), step if step > 1 else None)
+            elif np.ndim(i):
+                if self.dimensions and self.dimensions[dim] == '*':
+                    raise RuntimeError("Can't index along vlen dimension (%d)!", dim)
+                keep_dims.append(dim)
+                ind[dim] = self._process_array_index(dim, i)
             else:
                 # Adjust start and stop to handle negative indexing
                 ind[dim] = self._adjust_index(dim, i)
 
         return ind, keep_dims
 
+    def _process_array_index(self, dim, index):
+        """Turn an array of integers or booleans into non-negative integer indices."""
+        index = np.asarray(index)
+        if index.ndim != 1:
+            raise IndexError('Only one-dimensional index arrays are supported.')
+
+        size = self.shape[dim]
+        if index.dtype.kind == 'b':
+            if index.size != size:
+                raise IndexError('Boolean index of size {:d} does not match dimension {:d} '
+                                 'of size {:d}.'.format(index.size, dim, size))
+            return np.nonzero(index)[0]
+        elif index.size and index.dtype.kind not in 'iu':
+            raise IndexError('Index arrays must contain integers or booleans.')
+
+        index = index.astype(np.intp)
+        if index.size and (index.min() < -size or index.max() >= size):
+            raise IndexError('Index out of bounds for dimension {:d} with '
+                             'size {:d}.'.format(dim, size))
+        return index % size if size else index
+
     def _adjust_index(self, dim, index):
         if index < 0:
             return self.shape[dim] + index
@@ -298,12 +720,11 @@ class Variable(AttributeContainer):
         self.ndim = len(var.shape)
         self._unpack_attrs(var.atts)
 
-        data, dt, type_name = unpack_variable(var)
-        if data is not None:
-            data = data.reshape(self.shape)
-        self._data = data
-        self.dtype = dt
-        self.datatype = type_name
+        self.dtype, self.datatype = unpack_variable_type(var)
+
+        # Any data included in the header is unpacked on first use
+        if getattr(var, 'data', None):
+            self._stream_var = var
 
         if hasattr(var, 'enumType') and var.enumType:
             self.datatype = var.enumType
@@ -325,6 +746,150 @@ class Variable(AttributeContainer):
         return '\n'.join(groups)
 
 
+def coalesce_indices(indices):
+    """Group integer indices into as few slices as possible.
+
+    The sorted, unique indices are split into runs with a constant step, each of which
+    can be requested as a single slice.
+
+    Parameters
+    ----------
+    indices : sequence of int
+        The (non-negative) indices
+
+    Returns
+    -------
+    slices : list[slice]
+        Slices that, taken in order, give the sorted unique indices
+    inverse : ndarray
+        Position of each of the original indices within the data selected by `slices`
+
+    """
+    uniq, inverse = np.unique(np.asarray(indices, dtype=np.intp).ravel(),
+                              return_inverse=True)
+    slices = []
+    start = 0
+    while start < uniq.size:
+        end = start + 1
+        if end < uniq.size:
+            step = uniq[end] - uniq[start]
+            while end + 1 < uniq.size and uniq[end + 1] - uniq[end] == step:
+                end += 1
+            slices.append(slice(int(uniq[start]), int(uniq[end]) + 1,
+                                int(step) if step != 1 else None))
+        else:
+            slices.append(slice(int(uniq[start]), int(uniq[start]) + 1))
+        start = end + 1
+    return slices, inverse
+
+
+def block_shape(shape, itemsize, nbytes):
+    """Divide an array shape into blocks of a target size.
+
+    Inner dimensions are kept whole as long as the block stays within `nbytes`.
+
+    Parameters
+    ----------
+    shape : tuple[int]
+        The shape of the array
+    itemsize : int
+        The number of bytes for each element
+    nbytes : int
+        The target number of bytes for each block
+
+    Returns
+    -------
+    tuple[int]
+        The shape of each block
+
+    """
+    ret = []
+    inner = itemsize
+    for size in reversed(shape):
+        block = max(1, min(size, nbytes // inner))
+        ret.append(block)
+        inner *= block
+    return tuple(reversed(ret))
+
+
+def set_dtype(arr, dtype, native=False):
+    """Set a dtype on an array returned from the server, keeping the byte order sent.
+
+    If `native` is true, the data are then converted to native byte order (see
+    :func:`to_native`).
+    """
+    # Structures that have already been decoded using our dtype are left alone
+    if arr.dtype.names and arr.dtype.names[0] not in ('>', '<'):
+        return to_native(arr) if native else arr
+
+    # Get the proper byte ordering.
+    # We handle structures by looking for a structured dtype. By convention,
+    # this has a single field which is has a void type and the byte order encoded
+    # in its name. This is because we can't retrieve a useful byte order from
+    # any of these flexible types.
+    if arr.dtype == 'O' and hasattr(arr[0], 'dtype'):
+        byteorder = arr[0].dtype.byteorder
+    elif arr.dtype.fields and arr.dtype.names[0] in ('>', '<'):
+        byteorder = arr.dtype.names[0]
+    else:
+        byteorder = arr.dtype.byteorder
+
+    # Set the dtype on the returned data to our own dtype, with byte ordering set
+    # based on what was returned. This allows us to handle structures.
+    dt = dtype.newbyteorder(byteorder)
+
+    if arr.dtype == 'O':
+        if hasattr(arr[0], 'dtype'):
+            for subarray in arr:
+                subarray.dtype = dt
+    # Don't reset dtype if we've already decoded to struct
+    elif arr.dtype.fields and arr.dtype.fields == dt.fields:
+        pass
+    else:
+        arr.dtype = dt
+
+    return to_native(arr) if native else arr
+
+
+def to_native(arr):
+    """Convert an array to native byte order.
+
+    Writable arrays are byte swapped in place; read-only ones (e.g. views of a
+    response) are copied once. Arrays of variable-length data have each element
+    converted.
+    """
+    if arr.dtype == 'O':
+        for i, subarray in enumerate(arr.flat):
+            if hasattr(subarray, 'dtype'):
+                arr.flat[i] = to_native(subarray)
+        return arr
+    elif arr.dtype.isnative:
+        return arr
+    elif arr.dtype.hasobject:
+        # Structures with string or vlen members can't be viewed as another dtype, so
+        # copy the fields one by one, leaving the objects alone
+        out = np.empty(arr.shape, dtype=_native_dtype(arr.dtype))
+        for name in arr.dtype.names:
+            out[name] = arr[name]
+        return out
+
+    native = arr.dtype.newbyteorder('=')
+    if arr.flags.writeable:
+        return arr.byteswap(inplace=True).view(native)
+    return arr.byteswap().view(native)
+
+
+def _native_dtype(dtype):
+    """Get a dtype in native byte order, handling structures field by field."""
+    if dtype.names:
+        return np.dtype([(name, _native_dtype(dtype.fields[name][0]))
+                         for name in dtype.names])
+    elif dtype.subdtype is not None:
+        base, shape = dtype.subdtype
+        return np.dtype((_native_dtype(base), shape))
+    return dtype if dtype.kind == 'O' else dtype.newbyteorder('=')
+
+
 class Dimension(object):
     """Hold information about dimensions shared between variables."""
 
@@ -377,3 +942,302 @@ class Dimension(object):
         return ''.join(grps)
 
     __repr__ = __str__
+
+
+class ChunkCache(object):
+    """Cache blocks of variable data for a :class:`Dataset`.
+
+    Each variable is divided into fixed-size blocks, with the inner dimensions kept
+    whole as far as the block size allows. Reads are mapped onto these blocks; blocks
+    that are not in the cache are merged into contiguous regions, which are requested
+    from the server together, and the result is assembled from the blocks. The least
+    recently used blocks are dropped once the cache grows beyond `max_bytes`. A single
+    cache can be shared between datasets.
+
+    Variables with variable-length dimensions or object (string, opaque, vlen) data
+    are not cached.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, block_bytes=1024 * 1024):
+        """Initialize the cache.
+
+        Parameters
+        ----------
+        max_bytes : int, optional
+            The maximum number of bytes of data to hold. Defaults to 256 MiB.
+        block_bytes : int, optional
+            The target size of each block in bytes. Defaults to 1 MiB.
+
+        """
+        self.max_bytes = max_bytes
+        self.block_bytes = block_bytes
+        self._blocks = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Return the number of blocks held."""
+        return len(self._blocks)
+
+    @property
+    def nbytes(self):
+        """Get the number of bytes of data held."""
+        return self._nbytes
+
+    def clear(self):
+        """Remove all blocks."""
+        with self._lock:
+            self._blocks.clear()
+            self._nbytes = 0
+
+    @staticmethod
+    def can_cache(var):
+        """Return whether reads from a variable can use the cache."""
+        return bool(var.ndim and var.dtype.kind != 'O' and '*' not in var.dimensions)
+
+    @staticmethod
+    def _key(var, coords):
+        """Get the key for a block, which is unique across datasets sharing the cache."""
+        return var.dataset.url, var.path, coords
+
+    def block_shape(self, var):
+        """Get the shape of the blocks used for a variable."""
+        return block_shape(var.shape, var.dtype.itemsize, self.block_bytes)
+
+    def read(self, var, ind):
+        """Read data from a variable using cached blocks.
+
+        Parameters
+        ----------
+        var : Variable
+            The variable to read
+        ind : list
+            Processed indices (integers and slices) for every dimension
+
+        Returns
+        -------
+        ndarray
+            The requested data, with integer indices kept as dimensions of size 1
+
+        """
+        block_shape = self.block_shape(var)
+        wanted = [i.indices(size) if isinstance(i, slice) else (i, i + 1, 1)
+                  for i, size in zip(ind, var.shape)]
+        needed = [np.unique(np.arange(*w) // b) for w, b in zip(wanted, block_shape)]
+        if not all(n.size for n in needed):
+            return var._read(ind)
+
+        blocks = OrderedDict()
+        missing = []
+        with self._lock:
+            for coords in itertools.product(*needed):
+                key = self._key(var, coords)
+                block = self._blocks.pop(key, None)
+                if block is None:
+                    missing.append(coords)
+                else:
+                    # Re-insert to mark as most recently used
+                    self._blocks[key] = blocks[coords] = block
+
+        if missing:
+            blocks.update(self._fetch(var, missing, block_shape))
+
+        # Assemble the blocks covering the request and pull out the requested indices
+        lows = [n[0] * b for n, b in zip(needed, block_shape)]
+        highs = [min((n[-1] + 1) * b, size)
+                 for n, b, size in zip(needed, block_shape, var.shape)]
+        out = np.empty([high - low for low, high in zip(lows, highs)],
+                       dtype=next(iter(blocks.values())).dtype)
+        for coords in itertools.product(*needed):
+            block = blocks[coords]
+            out[tuple(slice(c * b - low, c * b - low + size)
+                      for c, b, low, size in zip(coords, block_shape, lows,
+                                                 block.shape))] = block
+
+        return out[tuple(slice(start - low, stop - low, step)
+                         for (start, stop, step), low in zip(wanted, lows))]
+
+    def _fetch(self, var, missing, block_shape):
+        """Request the regions covering the missing blocks and split them into blocks.
+
+        The missing blocks are merged into contiguous boxes, which are all requested
+        together, so that blocks already held are not downloaded again.
+        """
+        boxes = _merge_blocks(missing)
+        requests = [[slice(lo * b, min((hi + 1) * b, size))
+                     for (lo, hi), b, size in zip(box, block_shape, var.shape)]
+                    for box in boxes]
+        if len(requests) == 1:
+            regions = [var._read(requests[0])]
+        else:
+            regions = var._read_batches(requests)
+
+        blocks = {}
+        for box, region in zip(boxes, regions):
+            for coords in itertools.product(*[range(lo, hi + 1) for lo, hi in box]):
+                blocks[coords] = region[tuple(slice((c - lo) * b, (c - lo + 1) * b)
+                                              for c, (lo, _), b in zip(coords, box,
+                                                                       block_shape))
+                                        ].copy()
+        self._store(var, blocks)
+        return blocks
+
+    def _store(self, var, blocks):
+        """Add blocks to the cache, dropping the least recently used as needed."""
+        with self._lock:
+            for coords, block in blocks.items():
+                key = self._key(var, coords)
+                old = self._blocks.pop(key, None)
+                if old is not None:
+                    self._nbytes -= old.nbytes
+                if block.nbytes <= self.max_bytes:
+                    self._blocks[key] = block
+                    self._nbytes += block.nbytes
+
+            while self._nbytes > self.max_bytes:
+                _, block = self._blocks.popitem(last=False)
+                self._nbytes -= block.nbytes
+
+
+def _merge_blocks(coords):
+    """Merge block coordinates into as few contiguous boxes as is simple.
+
+    Blocks are joined along the last dimension first, and then boxes that match in
+    all other dimensions are joined along each earlier dimension in turn.
+
+    Returns
+    -------
+    list
+        The boxes, each a list of inclusive ``(low, high)`` block ranges per dimension
+
+    """
+    boxes = [[(c, c) for c in coord] for coord in coords]
+    if not boxes:
+        return boxes
+
+    for dim in reversed(range(len(boxes[0]))):
+        def key(box):
+            return box[:dim] + box[dim + 1:], box[dim]
+
+        merged = []
+        for box in sorted(boxes, key=key):
+            last = merged[-1] if merged else None
+            if (last is not None and key(last)[0] == key(box)[0]
+                    and last[dim][1] + 1 == box[dim][0]):
+                last[dim] = (last[dim][0], box[dim][1])
+            else:
+                merged.append(list(box))
+        boxes = merged
+    return boxes
+
+
+class HeaderCache(object):
+    """Store dataset headers on disk to avoid requesting them again.
+
+    The raw header response is stored for each URL, along with the validators (ETag
+    and Last-Modified) the server sent with it. Headers stored within `max_age` seconds
+    are used without contacting the server. Older headers are revalidated with a
+    conditional request, so that only a changed header is downloaded again.
+
+    A single cache can be used by both :class:`Dataset` and
+    :class:`~siphon.cdmr.coveragedataset.CoverageDataset`.
+    """
+
+    def __init__(self, path=None, max_age=3600):
+        """Initialize the cache.
+
+        Parameters
+        ----------
+        path : str, optional
+            Directory to store headers in. Defaults to ``~/.cache/siphon/headers``.
+        max_age : float, optional
+            Number of seconds a stored header is used without revalidating it with
+            the server. Defaults to 1 hour.
+
+        """
+        if path is None:
+            path = os.path.join(os.path.expanduser('~'), '.cache', 'siphon', 'headers')
+        self.path = path
+        self.max_age = max_age
+
+    def _filename(self, url):
+        """Get the file holding the header for a URL."""
+        return os.path.join(self.path,
+                            hashlib.sha1(url.encode('utf-8')).hexdigest() + '.hdr')
+
+    def fetch(self, endpoint, query):
+        """Get the raw response for a header request, using the stored copy if valid.
+
+        Parameters
+        ----------
+        endpoint : `~siphon.http_util.HTTPEndPoint`
+            The endpoint to request the header from
+        query : `~siphon.http_util.DataQuery`
+            The query for the header
+
+        Returns
+        -------
+        bytes
+            The content of the header response
+
+        """
+        url = endpoint._base + '?' + str(query)
+        info, content = self._load(url)
+        if info is not None and time.time() - info['time'] < self.max_age:
+            return content
+
+        headers = {}
+        if info is not None:
+            if info.get('etag'):
+                headers['If-None-Match'] = info['etag']
+            if info.get('last_modified'):
+                headers['If-Modified-Since'] = info['last_modified']
+
+        resp = endpoint.get_query(query, headers=headers)
+        if resp.status_code == 304:
+            log.debug('Stored header still valid for %s', url)
+        else:
+            content = resp.content
+            info = {'url': url, 'etag': resp.headers.get('ETag'),
+                    'last_modified': resp.headers.get('Last-Modified')}
+        info['time'] = time.time()
+        self._store(url, info, content)
+        return content
+
+    def _load(self, url):
+        """Read the stored information and content for a URL."""
+        try:
+            with open(self._filename(url), 'rb') as fobj:
+                info = json.loads(fobj.readline().decode('utf-8'))
+                content = fobj.read()
+        except (IOError, OSError, ValueError):
+            return None, None
+
+        # Guard against hash collisions
+        if info.get('url') != url:
+            return None, None
+        return info, content
+
+    def _store(self, url, info, content):
+        """Write the information and content for a URL, replacing any existing."""
+        try:
+            os.makedirs(self.path)
+        except OSError:
+            if not os.path.isdir(self.path):
+                raise
+
+        # Write to a temporary file and move into place so readers never see a
+        # partially written header
+        fd, tmp_name = tempfile.mkstemp(dir=self.path)
+        with os.fdopen(fd, 'wb') as fobj:
+            fobj.write(json.dumps(info).encode('utf-8') + b'\n')
+            fobj.write(content)
+        replace = getattr(os, 'replace', os.rename)
+        replace(tmp_name, self._filename(url))
+
+    def clear(self):
+        """Remove all stored headers."""
+        if os.path.isdir(self.path):
+            for name in os.listdir(self.path):
+                if name.endswith('.hdr'):
+                    os.remove(os.path.join(self.path, name))
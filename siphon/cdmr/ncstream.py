@@ -5,9 +5,10 @@
 
 from __future__ import print_function
 
-from collections import OrderedDict
-import itertools
+from collections import deque, namedtuple
 import logging
+import mmap
+import sys
 import zlib
 
 import numpy as np
@@ -32,21 +33,32 @@ log = logging.getLogger(__name__)
 #
 # NCStream handling
 #
-def read_ncstream_data(fobj):
-    """Handle reading an NcStream v1 data block from a file-like object."""
+def read_ncstream_data(fobj, executor=None, dtypes=None):
+    """Handle reading an NcStream v1 data block from a file-like object.
+
+    If `executor` is given, compressed data are decompressed using it, and a
+    :class:`~concurrent.futures.Future` for the array is returned instead.
+
+    STRUCTURE data are decoded using the structured dtype for the variable in `dtypes`
+    (see :func:`struct_to_dtype`), and SEQUENCE data are returned as
+    :class:`SequenceData`. Without a dtype, each row is left as raw bytes in a single
+    field whose name is the byte order.
+    """
     data = read_proto_object(fobj, stream.Data)
     if data.dataType in (stream.STRING, stream.OPAQUE) or data.vdata:
         log.debug('Reading string/opaque/vlen')
         num_obj = read_var_int(fobj)
         log.debug('Num objects: %d', num_obj)
-        blocks = [read_block(fobj) for _ in range(num_obj)]
+        blocks = [_to_bytes(read_block(fobj)) for _ in range(num_obj)]
         if data.dataType == stream.STRING:
             blocks = [b.decode('utf-8', errors='ignore') for b in blocks]
 
         # Again endian isn't coded properly
         dt = data_type_to_numpy(data.dataType).newbyteorder('>')
         if data.vdata:
-            return np.array([np.frombuffer(b, dtype=dt) for b in blocks])
+            # Convert all the blocks at once and split into views
+            sizes = [len(b) // dt.itemsize for b in blocks]
+            return split_vlen(np.frombuffer(b''.join(blocks), dtype=dt), sizes)
         else:
             return np.array(blocks, dtype=dt)
     elif data.dataType in _dtypeLookup:
@@ -59,8 +71,9 @@ def read_ncstream_data(fobj):
 
         # Handle decompressing the bytes
         if data.compress == stream.DEFLATE:
-            bin_data = zlib.decompress(bin_data)
-            assert len(bin_data) == data.uncompressedSize
+            if executor is not None:
+                return executor.submit(_inflate_data, data, bin_data, dt)
+            return _inflate_data(data, bin_data, dt)
         elif data.compress != stream.NONE:
             raise NotImplementedError('Compression type {0} not implemented!'.format(
                 data.compress))
@@ -69,32 +82,133 @@ def read_ncstream_data(fobj):
         return reshape_array(data, np.frombuffer(bin_data, dtype=dt))
     elif data.dataType == stream.STRUCTURE:
         sd = read_proto_object(fobj, stream.StructureData)
-
-        # Make a datatype appropriate to the rows of struct
-        endian = '>' if data.bigend else '<'
-        dt = np.dtype([(endian, np.void, sd.rowLength)])
-
-        # Turn bytes into an array
-        return reshape_array(data, np.frombuffer(sd.data, dtype=dt))
+        dt = (dtypes or {}).get(data.varName)
+        return reshape_array(data, decode_structure_data([sd], data.bigend, dt))
     elif data.dataType == stream.SEQUENCE:
         log.debug('Reading sequence')
         blocks = []
         magic = read_magic(fobj)
         while magic != MAGIC_VEND:
-            if magic == MAGIC_VDATA:
+            if magic != MAGIC_VDATA:
                 log.error('Bad magic for struct/seq data!')
             blocks.append(read_proto_object(fobj, stream.StructureData))
             magic = read_magic(fobj)
-        return data, blocks
+
+        dt = (dtypes or {}).get(data.varName)
+        offsets = np.cumsum([0] + [_num_rows(sd) for sd in blocks])
+        return SequenceData(decode_structure_data(blocks, data.bigend, dt), offsets)
     else:
         raise NotImplementedError("Don't know how to handle data type: {0}".format(
             data.dataType))
 
 
-def read_ncstream_data2(fobj):
-    """Handle reading an NcStream v2 data block from a file-like object."""
+SequenceData = namedtuple('SequenceData', 'records offsets')
+SequenceData.__doc__ = """Decoded data for a sequence.
+
+Attributes
+----------
+records : `numpy.ndarray`
+    All of the records, in a single structured array
+offsets : `numpy.ndarray`
+    The index in `records` where each block of rows starts, with the total number of
+    records at the end
+
+"""
+
+
+def decode_structure_data(blocks, bigend, dtype=None):
+    """Decode the rows from StructureData messages into a single structured array.
+
+    The rows are decoded in bulk, without any per-row Python operations. Without
+    string or opaque members, the returned array is a view of the message data when
+    there is only a single block.
+
+    Parameters
+    ----------
+    blocks : sequence of StructureData
+        The messages holding the rows
+    bigend : bool
+        Whether the data are big endian
+    dtype : `numpy.dtype`, optional
+        The structured dtype for the rows, from :func:`struct_to_dtype`. If not given,
+        each row is left as raw bytes in a single field named by the byte order.
+
+    Returns
+    -------
+    `numpy.ndarray`
+        The decoded rows
+
+    """
+    endian = '>' if bigend else '<'
+    data = blocks[0].data if len(blocks) == 1 else b''.join(sd.data for sd in blocks)
+    if dtype is None:
+        row_length = blocks[0].rowLength if blocks else 0
+        return np.frombuffer(data, dtype=np.dtype([(endian, np.void, row_length)]))
+
+    # Strings and opaque values are stored on a heap, with the index in the row
+    rows = np.frombuffer(data, dtype=_heap_index_dtype(dtype).newbyteorder(endian))
+    if not dtype.hasobject:
+        return rows
+
+    heap = np.empty(sum(len(sd.sdata) for sd in blocks), dtype=np.object_)
+    heap[:] = [s for sd in blocks for s in sd.sdata]
+    if len(blocks) > 1:
+        # Each block has its own heap, so offset the indices to the combined one
+        heap_start = np.cumsum([0] + [len(sd.sdata) for sd in blocks[:-1]])
+        heap_offsets = np.repeat(heap_start, [_num_rows(sd) for sd in blocks])
+    else:
+        heap_offsets = 0
+    return _fill_from_heap(rows, dtype.newbyteorder(endian), heap, heap_offsets)
+
+
+def _num_rows(sd):
+    """Get the number of rows in a StructureData message."""
+    if sd.nrows:
+        return sd.nrows
+    return len(sd.data) // sd.rowLength if sd.rowLength else 0
+
+
+def _heap_index_dtype(dtype):
+    """Replace object fields in a structured dtype with integer heap indices."""
+    if dtype.names is None:
+        if dtype.subdtype is not None:
+            base, shape = dtype.subdtype
+            return np.dtype((_heap_index_dtype(base), shape))
+        return np.dtype('i4') if dtype.hasobject else dtype
+    return np.dtype([(name, _heap_index_dtype(dtype.fields[name][0]))
+                     for name in dtype.names])
+
+
+def _fill_from_heap(rows, dtype, heap, heap_offsets):
+    """Create an array of `dtype` from rows, looking up object fields on the heap."""
+    if dtype.names is None:
+        if dtype.hasobject:
+            # Broadcast the per-row offsets over any member dimensions
+            offsets = np.reshape(heap_offsets, np.shape(heap_offsets)
+                                 + (1,) * (rows.ndim - np.ndim(heap_offsets)))
+            return heap[rows + offsets]
+        return rows
+
+    out = np.empty(rows.shape, dtype=dtype)
+    for name in dtype.names:
+        out[name] = _fill_from_heap(rows[name], dtype.fields[name][0], heap, heap_offsets)
+    return out
+
+
+def _inflate_data(data_header, bin_data, dt):
+    """Decompress the data for a message into an array."""
+    arr = inflate(bin_data, data_header.uncompressedSize).view(dt)
+    return reshape_array(data_header, arr)
+
+
+def read_ncstream_data2(fobj, dtypes=None):
+    """Handle reading an NcStream v2 data block from a file-like object.
+
+    STRUCTURE data are decoded using the structured dtype for the variable in `dtypes`
+    (see :func:`struct_to_dtype`), if present.
+    """
     data = read_proto_object(fobj, stream.DataCol)
-    return datacol_to_array(data)
+    return datacol_to_array(data, (dtypes or {}).get(data.name))
 
 
 def read_ncstream_err(fobj):
@@ -110,10 +224,41 @@ ncstream_table = {MAGIC_HEADER: lambda f: read_proto_object(f, stream.Header),
 
 
 def read_ncstream_messages(fobj):
-    """Read a collection of NcStream messages from a file-like object."""
+    """Read a collection of NcStream messages from a file-like object.
+
+    `fobj` can also be a bytes-like object holding the messages, in which case arrays
+    of uncompressed data are views of it, rather than copies.
+    """
     return read_messages(fobj, ncstream_table)
 
 
+def iter_ncstream_messages(fobj, executor=None, read_ahead=4, dtypes=None):
+    """Iterate over NcStream messages from a file-like object, decoding each as read.
+
+    Parameters
+    ----------
+    fobj : file-like or bytes-like object
+        The source of the messages
+    executor : `concurrent.futures.Executor`, optional
+        If given, compressed data blocks are decompressed concurrently using this.
+        Since zlib releases the GIL, a thread pool allows using several cores.
+    read_ahead : int, optional
+        When using `executor`, the maximum number of messages read ahead of the one
+        being returned. Defaults to 4.
+    dtypes : dict, optional
+        Mapping of variable names to the structured dtypes used to decode STRUCTURE
+        and SEQUENCE data.
+
+    """
+    if executor is None and dtypes is None:
+        return iter_messages(fobj, ncstream_table)
+
+    table = dict(ncstream_table)
+    table[MAGIC_DATA] = lambda f: read_ncstream_data(f, executor, dtypes)
+    table[MAGIC_DATA2] = lambda f: read_ncstream_data2(f, dtypes)
+    return iter_messages(fobj, table, read_ahead if executor is not None else 0)
+
+
 #
 # CDMRemoteFeature handling
 #
@@ -124,17 +269,38 @@ cdmrf_table = {MAGIC_HEADERCOV: lambda f: read_proto_object(f, cdmrf.CoverageDat
 
 
 def read_cdmrf_messages(fobj):
-    """Read a collection of CDMRemoteFeature messages from a file-like object."""
+    """Read a collection of CDMRemoteFeature messages from a file-like or bytes-like object."""
     return read_messages(fobj, cdmrf_table)
 
 
+def iter_cdmrf_messages(fobj):
+    """Iterate over CDMRemoteFeature messages from a file-like object."""
+    return iter_messages(fobj, cdmrf_table)
+
+
 #
 # General Utilities
 #
 def read_messages(fobj, magic_table):
     """Read messages from a file-like object until stream is exhausted."""
-    messages = []
+    return list(iter_messages(fobj, magic_table))
+
+
+def iter_messages(fobj, magic_table, read_ahead=0):
+    """Iterate over messages from a file-like object until stream is exhausted.
+
+    Each message is only read from `fobj` once the previous one has been consumed, so
+    this can decode messages as they arrive from a stream. Bytes-like objects are read
+    in place using :class:`BufferReader`.
+
+    Functions in `magic_table` can return a :class:`~concurrent.futures.Future` for a
+    message, in which case up to `read_ahead` further messages are read while waiting
+    for its result. Messages are always returned in order.
+    """
+    if isinstance(fobj, (bytes, bytearray, memoryview)):
+        fobj = BufferReader(fobj)
 
+    pending = deque()
     while True:
         magic = read_magic(fobj)
         if not magic:
@@ -142,12 +308,158 @@ def read_messages(fobj, magic_table):
 
         func = magic_table.get(magic)
         if func is not None:
-            messages.append(func(fobj))
+            pending.append(func(fobj))
         else:
             log.error('Unknown magic: ' + str(' '.join('{0:02x}'.format(b)
                                                        for b in bytearray(magic))))
 
-    return messages
+        while pending and (len(pending) > read_ahead or _is_ready(pending[0])):
+            yield _result(pending.popleft())
+
+    while pending:
+        yield _result(pending.popleft())
+
+
+def _is_ready(msg):
+    """Return whether a message, possibly still being decoded, is available."""
+    done = getattr(msg, 'done', None)
+    return done is None or done()
+
+
+def _result(msg):
+    """Get a message, waiting for it if still being decoded."""
+    return msg.result() if hasattr(msg, 'done') else msg
+
+
+def inflate(compressed, nbytes):
+    """Decompress zlib-compressed data into an array.
+
+    The expected size is given to :mod:`zlib` as the initial size of its output buffer,
+    so the buffer does not need to be grown while decompressing, and the array is a
+    (read-only) view of the decompressed bytes.
+
+    Parameters
+    ----------
+    compressed : bytes-like object
+        The compressed data
+    nbytes : int
+        The size of the decompressed data
+
+    Returns
+    -------
+    `numpy.ndarray`
+        The decompressed bytes, as an array of `numpy.uint8`
+
+    """
+    data = zlib.decompress(compressed, zlib.MAX_WBITS, max(nbytes, 1))
+    if len(data) != nbytes:
+        raise ValueError('Decompressed data size {0} does not match expected size '
+                         '{1}.'.format(len(data), nbytes))
+    return np.frombuffer(data, dtype=np.uint8)
+
+
+class BufferReader(object):
+    """Provide a file-like interface to an in-memory buffer, without copying.
+
+    Reads return :class:`memoryview` slices of the buffer, so that arrays created from
+    them with :func:`numpy.frombuffer` are views of the original data. Variable-length
+    integers are decoded directly from the buffer.
+    """
+
+    def __init__(self, buf):
+        """Initialize the reader from a bytes-like object."""
+        self._view = memoryview(buf)
+        self._pos = 0
+
+    def read(self, size=-1):
+        """Read up to `size` bytes, or everything remaining if `size` is negative."""
+        start = self._pos
+        end = len(self._view) if size < 0 else min(start + size, len(self._view))
+        self._pos = end
+        return self._view[start:end]
+
+    def tell(self):
+        """Return the current position in the buffer."""
+        return self._pos
+
+    def read_var_int(self):
+        """Read a variable-length integer."""
+        # A 64-bit value needs at most 10 bytes
+        val = 0
+        for count, byte in enumerate(bytearray(self._view[self._pos:self._pos + 10]), 1):
+            val |= (byte & 0x7F) << (7 * (count - 1))
+            if not byte & 0x80:
+                self._pos += count
+                return val
+        raise ValueError('Unterminated variable-length integer.')
+
+
+class ChunkedReader(object):
+    """Provide a file-like interface to an iterable of chunks of bytes.
+
+    Only as many chunks are pulled from the iterable as needed to satisfy each read,
+    which allows messages to be decoded from a streaming HTTP response (e.g.
+    :meth:`requests.Response.iter_content`) while the rest is still downloading.
+    Unlike reading from the raw response, reads only return fewer bytes than
+    requested at the end of the stream.
+
+    Reads of at least `direct_size` bytes are copied from the chunks straight into a
+    newly allocated :class:`bytearray`, which is returned without further copies.
+    """
+
+    direct_size = 65536
+
+    def __init__(self, chunks):
+        """Initialize the reader from an iterable of `bytes`."""
+        self._chunks = iter(chunks)
+        self._buf = bytearray()
+        self._pos = 0
+
+    def read(self, size=-1):
+        """Read up to `size` bytes, or everything remaining if `size` is negative."""
+        if size >= self.direct_size and len(self._buf) - self._pos < size:
+            return self._read_direct(size)
+
+        while size < 0 or len(self._buf) - self._pos < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+
+            # Drop what has already been read before adding more
+            if self._pos:
+                del self._buf[:self._pos]
+                self._pos = 0
+            self._buf.extend(chunk)
+
+        end = len(self._buf) if size < 0 else min(self._pos + size, len(self._buf))
+        ret = bytes(self._buf[self._pos:end])
+        self._pos = end
+        return ret
+
+    def _read_direct(self, size):
+        """Read `size` bytes into a new buffer."""
+        out = bytearray(size)
+        view = memoryview(out)
+        filled = len(self._buf) - self._pos
+        view[:filled] = self._buf[self._pos:]
+        self._buf = bytearray()
+        self._pos = 0
+
+        while filled < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            count = min(len(chunk), size - filled)
+            view[filled:filled + count] = memoryview(chunk)[:count]
+            filled += count
+            if count < len(chunk):
+                self._buf.extend(memoryview(chunk)[count:])
+
+        # Can only resize once the view is gone
+        del view
+        if filled < size:
+            del out[filled:]
+        return out
 
 
 def read_proto_object(fobj, klass):
@@ -173,7 +485,7 @@ def read_magic(fobj):
         magic byte sequence read
 
     """
-    return fobj.read(4)
+    return _to_bytes(fobj.read(4))
 
 
 def read_block(fobj):
@@ -189,7 +501,7 @@ def read_block(fobj):
 
     Returns
     -------
-    bytes
+    bytes-like
         block of bytes read
 
     """
@@ -215,21 +527,58 @@ def process_vlen(data_header, array):
     ndarray
         object array containing sub-sequences from the original primitive array
 
+    See Also
+    --------
+    split_vlen
+
     """
-    source = iter(array)
-    return np.array([np.fromiter(itertools.islice(source, size), dtype=array.dtype)
-                     for size in data_header.vlens])
+    return split_vlen(array, data_header.vlens)
 
 
-def datacol_to_array(datacol):
-    """Convert DataCol from NCStream v2 into an array with appropriate type.
+def split_vlen(values, sizes):
+    """Split a flat array of values into variable-length pieces.
+
+    The pieces are views of `values`, found from the cumulative sum of `sizes`, so no
+    data are copied. If all pieces have the same size, the values are instead returned
+    as a 2D array with a row for each piece.
+
+    Parameters
+    ----------
+    values : :class:`numpy.ndarray`
+        1D array of all values
+    sizes : sequence of int
+        The number of values in each piece
+
+    Returns
+    -------
+    ndarray
+        object array containing sub-sequences of `values`
+
+    """
+    sizes = np.asarray(sizes, dtype=np.intp)
+    offsets = np.cumsum(sizes)
+    if sizes.size and offsets[-1] == values.size and (sizes == sizes[0]).all():
+        return values.reshape(sizes.size, sizes[0])
+
+    ret = np.empty(sizes.size, dtype=np.object_)
+    for ind, (start, end) in enumerate(zip(offsets - sizes, offsets)):
+        ret[ind] = values[start:end]
+    return ret
+
+
+def datacol_to_array(datacol, dtype=None):
+    """Convert DataCol from NcStream v2 into an array with appropriate type.
 
     Depending on the data type specified, this extracts data from the appropriate members
-    and packs into a :class:`numpy.ndarray`, recursing as necessary for compound data types.
+    and packs into a :class:`numpy.ndarray`. For STRUCTURE data, the columns for the
+    members are decoded directly into the fields of a single structured array.
 
     Parameters
     ----------
     datacol : DataCol
+    dtype : `numpy.dtype`, optional
+        The structured dtype for STRUCTURE data, from :func:`struct_to_dtype`. If not
+        given, it is built from the headers of the member columns.
 
     Returns
     -------
@@ -238,22 +587,17 @@ def datacol_to_array(datacol):
 
     """
     if datacol.dataType == stream.STRING:
-        arr = np.array(datacol.stringdata, dtype=np.object)
+        arr = np.array(datacol.stringdata, dtype=object)
     elif datacol.dataType == stream.OPAQUE:
-        arr = np.array(datacol.opaquedata, dtype=np.object)
+        arr = np.array(datacol.opaquedata, dtype=object)
     elif datacol.dataType == stream.STRUCTURE:
-        members = OrderedDict((mem.name, datacol_to_array(mem))
-                              for mem in datacol.structdata.memberData)
-        log.debug('Struct members:\n%s', str(members))
-
-        # str() around name necessary because protobuf gives unicode names, but dtype doesn't
-        # support them on Python 2
-        dt = np.dtype([(str(name), arr.dtype) for name, arr in members.items()])
-        log.debug('Struct dtype: %s', str(dt))
-
-        arr = np.empty((datacol.nelems,), dtype=dt)
-        for name, arr_data in members.items():
-            arr[name] = arr_data
+        shape = _datacol_shape(datacol)
+        if dtype is None:
+            dtype = _datacol_dtype(datacol, len(shape))
+        log.debug('Struct dtype: %s', str(dtype))
+
+        arr = np.empty(shape, dtype=dtype)
+        _fill_from_datacol(arr, datacol)
     else:
         # Make an appropriate datatype
         endian = '>' if datacol.bigend else '<'
@@ -278,6 +622,56 @@ def datacol_to_array(datacol):
     return arr
 
 
+def _datacol_shape(datacol):
+    """Get the shape of the data in a DataCol."""
+    return tuple(r.size for r in datacol.section.range) or (datacol.nelems,)
+
+
+def _datacol_dtype(datacol, ndim):
+    """Build the structured dtype for STRUCTURE data from its member columns.
+
+    Each member's section includes the `ndim` dimensions of the structure, followed by
+    those of the member itself, which become subarray fields. Strings, opaque, and
+    vlen members are held as objects.
+    """
+    fields = []
+    for mem in datacol.structdata.memberData:
+        mem_shape = _datacol_shape(mem)
+        if mem.dataType == stream.STRUCTURE:
+            dt = _datacol_dtype(mem, len(mem_shape))
+        elif mem.isVlen or mem.dataType in (stream.STRING, stream.OPAQUE):
+            dt = np.dtype(object)
+        else:
+            dt = data_type_to_numpy(mem.dataType).newbyteorder('>' if mem.bigend else '<')
+
+        # str() around name necessary because protobuf gives unicode names, but dtype
+        # doesn't support them on Python 2
+        fields.append((str(mem.name), dt, mem_shape[ndim:]))
+    return np.dtype(fields)
+
+
+def _fill_from_datacol(arr, datacol):
+    """Decode the member columns of STRUCTURE data into the fields of `arr`."""
+    for mem in datacol.structdata.memberData:
+        field = arr[str(mem.name)]
+        if mem.dataType == stream.STRUCTURE:
+            _fill_from_datacol(field, mem)
+        elif mem.isVlen:
+            dt = data_type_to_numpy(mem.dataType).newbyteorder('>' if mem.bigend else '<')
+            values = np.frombuffer(mem.primdata, dtype=dt)
+            pieces = np.empty(len(mem.vlens), dtype=np.object_)
+            for ind, piece in enumerate(split_vlen(values, mem.vlens)):
+                pieces[ind] = piece
+            field[...] = pieces.reshape(field.shape)
+        elif mem.dataType == stream.STRING:
+            field[...] = np.array(mem.stringdata, dtype=object).reshape(field.shape)
+        elif mem.dataType == stream.OPAQUE:
+            field[...] = np.array(mem.opaquedata, dtype=object).reshape(field.shape)
+        else:
+            dt = data_type_to_numpy(mem.dataType).newbyteorder('>' if mem.bigend else '<')
+            field[...] = np.frombuffer(mem.primdata, dtype=dt).reshape(field.shape)
+
+
 def reshape_array(data_header, array):
     """Extract the appropriate array shape from the header.
 
@@ -320,26 +714,41 @@ def data_type_to_numpy(datatype, unsigned=False):
 
 
 def struct_to_dtype(struct):
-    """Convert a Structure specification to a numpy structured dtype."""
+    """Convert a Structure specification to a numpy structured dtype.
+
+    Members with dimensions become subarray fields. Nested structures are converted
+    recursively.
+    """
     # str() around name necessary because protobuf gives unicode names, but dtype doesn't
     # support them on Python 2
-    fields = [(str(var.name), data_type_to_numpy(var.dataType, var.unsigned))
-              for var in struct.vars]
+    fields = [(str(var.name), data_type_to_numpy(var.dataType, var.unsigned),
+               _member_shape(var)) for var in struct.vars]
     for s in struct.structs:
-        fields.append((str(s.name), struct_to_dtype(s)))
+        fields.append((str(s.name), struct_to_dtype(s), _member_shape(s)))
 
     log.debug('Structure fields: %s', fields)
     dt = np.dtype(fields)
     return dt
 
 
+def _member_shape(var):
+    """Get the shape of a structure member from its dimensions."""
+    return tuple(dim.length for dim in var.shape)
+
+
 def unpack_variable(var):
     """Unpack an NCStream Variable into information we can use."""
+    dt, type_name = unpack_variable_type(var)
+    return unpack_variable_data(var, dt), dt, type_name
+
+
+def unpack_variable_type(var):
+    """Get the numpy dtype and type name for an NCStream Variable or Structure."""
     # If we actually get a structure instance, handle turning that into a variable
     if var.dataType == stream.STRUCTURE:
-        return None, struct_to_dtype(var), 'Structure'
+        return struct_to_dtype(var), 'Structure'
     elif var.dataType == stream.SEQUENCE:
-        log.warning('Sequence support not implemented!')
+        return struct_to_dtype(var), 'Sequence'
 
     dt = data_type_to_numpy(var.dataType, var.unsigned)
     if var.dataType == stream.OPAQUE:
@@ -348,6 +757,13 @@ def unpack_variable(var):
         type_name = 'string'
     else:
         type_name = dt.name
+    return dt, type_name
+
+
+def unpack_variable_data(var, dt):
+    """Unpack the data included with an NCStream Variable, if any."""
+    if var.dataType in (stream.STRUCTURE, stream.SEQUENCE):
+        return None
 
     if var.data:
         log.debug('Storing variable data: %s %s', dt, var.data)
@@ -359,7 +775,58 @@ def unpack_variable(var):
     else:
         data = None
 
-    return data, dt, type_name
+    return data
+
+
+def unpack_coord_axis(axis):
+    """Get the coordinate values for a CDMRemoteFeature CoordAxis.
+
+    Values for regularly spaced axes are computed from the start, end, and number of
+    values. For interval axes, the midpoints of the intervals are returned.
+
+    Parameters
+    ----------
+    axis : CoordAxis
+        The axis message
+
+    Returns
+    -------
+    `numpy.ndarray` or None
+        The coordinate values, or :data:`None` if they are not included in the message
+        and need to be requested separately.
+
+    """
+    spacing = axis.spacing
+    if spacing == cdmrf.regularPoint:
+        return np.linspace(axis.startValue, axis.endValue, axis.nvalues)
+    elif spacing == cdmrf.regularInterval:
+        edges = np.linspace(axis.startValue, axis.endValue, axis.nvalues + 1)
+        return 0.5 * (edges[:-1] + edges[1:])
+
+    if not axis.values:
+        return None
+
+    # Values are always sent as big endian doubles
+    values = np.frombuffer(axis.values, dtype='>f8')
+    if spacing == cdmrf.contiguousInterval:
+        return 0.5 * (values[:-1] + values[1:])
+    elif spacing == cdmrf.discontiguousInterval:
+        return values.reshape(-1, 2).mean(axis=1)
+    return values
+
+
+def unpack_geo_array(geo):
+    """Unpack the data for a CDMRemoteFeature GeoReferencedArray into an array."""
+    endian = '>' if geo.bigend else '<'
+    dt = data_type_to_numpy(geo.dataType).newbyteorder(endian)
+    if geo.compress == stream.DEFLATE:
+        arr = inflate(geo.primdata, geo.uncompressedSize).view(dt)
+    elif geo.compress == stream.NONE:
+        arr = np.frombuffer(geo.primdata, dtype=dt)
+    else:
+        raise NotImplementedError('Compression type {0} not implemented!'.format(
+            geo.compress))
+    return arr.reshape(tuple(geo.shape))
 
 
 _attrConverters = {stream.Attribute.BYTE: np.dtype('>b'),
@@ -411,6 +878,10 @@ def read_var_int(file_obj):
         the variable-length value read
 
     """
+    # Readers over a buffer can decode in place
+    if isinstance(file_obj, BufferReader):
+        return file_obj.read_var_int()
+
     # Read all bytes from here, stopping with the first one that does not have
     # the MSB set. Save the lower 7 bits, and keep stacking to the *left*.
     val = 0
@@ -424,3 +895,396 @@ def read_var_int(file_obj):
             break
 
     return val
+
+
+def _to_bytes(buf):
+    """Get `bytes` from a bytes-like object, copying only if necessary."""
+    if isinstance(buf, bytes):
+        return buf
+    return buf.tobytes() if isinstance(buf, memoryview) else bytes(buf)
+
+
+#
+# Stored NcStream files
+#
+MessageInfo = namedtuple('MessageInfo', 'offset size magic name')
+MessageInfo.__doc__ = """Location of a message within a stored NcStream file.
+
+Attributes
+----------
+offset : int
+    The position of the start of the message (its magic bytes)
+size : int
+    The number of bytes in the message
+magic : bytes
+    The magic bytes identifying the kind of message
+name : str or None
+    The variable name for data messages
+
+"""
+
+
+class NcStreamFile(object):
+    """Provide random access to the messages in a stored NcStream file.
+
+    The file is memory-mapped and scanned once to build an index of where each message
+    is, decoding only the small headers of data messages. Messages are decoded when
+    accessed, directly from the mapped file, so arrays of uncompressed data are
+    read-only views of the file rather than copies.
+
+    Examples
+    --------
+    >>> with NcStreamFile('response.ncs') as ncs:  # doctest: +SKIP
+    ...     temp = ncs.find('Temperature')[0]
+
+    """
+
+    def __init__(self, path, magic_table=None, dtypes=None):
+        """Open a file and index its messages.
+
+        Parameters
+        ----------
+        path : str
+            The path to the file
+        magic_table : dict, optional
+            Mapping of magic bytes to the functions to decode each kind of message.
+            Defaults to the table for NcStream, as used by
+            :func:`read_ncstream_messages`. Use ``cdmrf_table`` for CDMRemoteFeature.
+        dtypes : dict, optional
+            Mapping of variable names to the structured dtypes used to decode
+            STRUCTURE and SEQUENCE data.
+
+        """
+        if magic_table is None:
+            magic_table = dict(ncstream_table)
+            if dtypes is not None:
+                magic_table[MAGIC_DATA] = lambda f: read_ncstream_data(f, dtypes=dtypes)
+                magic_table[MAGIC_DATA2] = lambda f: read_ncstream_data2(f, dtypes)
+        self._magic_table = magic_table
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # Empty file
+            self._map = None
+        self._view = memoryview(self._map) if self._map is not None else memoryview(b'')
+        self.index = self._build_index()
+
+    def _build_index(self):
+        """Scan the file for the location of each message."""
+        index = []
+        reader = BufferReader(self._view)
+        while True:
+            offset = reader.tell()
+            magic = read_magic(reader)
+            if not magic:
+                break
+
+            if magic not in self._magic_table:
+                log.error('Unknown magic: ' + str(' '.join('{0:02x}'.format(b)
+                                                           for b in bytearray(magic))))
+                continue
+
+            name = None
+            if magic == MAGIC_DATA:
+                name = _skip_ncstream_data(reader)
+            else:
+                read_block(reader)
+            index.append(MessageInfo(offset, reader.tell() - offset, magic, name))
+        return index
+
+    def __len__(self):
+        """Return the number of messages."""
+        return len(self.index)
+
+    def __getitem__(self, item):
+        """Decode the message at a position in the index."""
+        info = self.index[item]
+        reader = BufferReader(self._view[info.offset:info.offset + info.size])
+        read_magic(reader)
+        return self._magic_table[info.magic](reader)
+
+    def __iter__(self):
+        """Decode each of the messages in turn."""
+        for i in range(len(self)):
+            yield self[i]
+
+    def find(self, name):
+        """Decode all the data messages for a variable.
+
+        Parameters
+        ----------
+        name : str
+            The name of the variable
+
+        Returns
+        -------
+        list
+            The decoded data from each message for the variable
+
+        """
+        return [self[i] for i, info in enumerate(self.index) if info.name == name]
+
+    def close(self):
+        """Close the file.
+
+        Arrays that are views of the file must be released first.
+        """
+        if hasattr(self._view, 'release'):
+            self._view.release()
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        """Enter a context, returning the file."""
+        return self
+
+    def __exit__(self, *args):
+        """Close the file when leaving a context."""
+        self.close()
+
+
+def _skip_ncstream_data(fobj):
+    """Move past an NcStream v1 data message, only decoding its header.
+
+    Returns the name of the variable.
+    """
+    data = read_proto_object(fobj, stream.Data)
+    if data.dataType in (stream.STRING, stream.OPAQUE) or data.vdata:
+        for _ in range(read_var_int(fobj)):
+            read_block(fobj)
+    elif data.dataType == stream.SEQUENCE:
+        while read_magic(fobj) not in (MAGIC_VEND, b''):
+            read_block(fobj)
+    else:
+        read_block(fobj)
+    return data.varName
+
+
+#
+# NcStream writing
+#
+_numpy_lookup = {'S1': stream.CHAR, 'i1': stream.BYTE, 'i2': stream.SHORT,
+                 'i4': stream.INT, 'i8': stream.LONG, 'f4': stream.FLOAT,
+                 'f8': stream.DOUBLE, 'u1': stream.UBYTE, 'u2': stream.USHORT,
+                 'u4': stream.UINT, 'u8': stream.ULONG}
+
+
+def numpy_to_data_type(dtype, example=None):
+    """Convert a numpy dtype to an ncstream datatype.
+
+    Object arrays are STRING or OPAQUE depending on whether `example`, an element of the
+    array, is text or bytes.
+    """
+    dtype = np.dtype(dtype)
+    if dtype.names is not None:
+        return stream.STRUCTURE
+    elif dtype.kind in 'OUS' and dtype.str[1:] != 'S1':
+        if dtype.kind == 'O' and isinstance(example, (bytes, bytearray)):
+            return stream.OPAQUE
+        return stream.STRING
+
+    try:
+        return _numpy_lookup[dtype.str[1:]]
+    except KeyError:
+        raise ValueError('No NcStream data type for {0}.'.format(dtype))
+
+
+def encode_var_int(value):
+    """Encode a variable-length integer."""
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def encode_block(data):
+    """Encode a block of bytes, prefixed by its length."""
+    return encode_var_int(len(data)) + _to_bytes(data)
+
+
+def encode_proto_object(obj):
+    """Encode a protobuf object as a block."""
+    return encode_block(obj.SerializeToString())
+
+
+def encode_header(header):
+    """Encode an NcStream Header message."""
+    return MAGIC_HEADER + encode_proto_object(header)
+
+
+def encode_ncstream_err(message):
+    """Encode an NcStream error message."""
+    return MAGIC_ERR + encode_proto_object(stream.Error(message=message))
+
+
+def encode_ncstream_data(arr, name, deflate=0):
+    """Encode an array as an NcStream v1 data message.
+
+    This is the inverse of :func:`read_ncstream_data`. Numeric data are written big
+    endian, optionally compressed.
+
+    Parameters
+    ----------
+    arr : array-like or SequenceData
+        The data. Object arrays hold strings, bytes (opaque), or arrays (vlen).
+    name : str
+        The name of the variable
+    deflate : int, optional
+        The zlib compression level for numeric data. Defaults to 0, no compression.
+
+    Returns
+    -------
+    bytes
+        The encoded message
+
+    """
+    if isinstance(arr, SequenceData):
+        return _encode_sequence(arr, name)
+
+    arr = np.asarray(arr)
+    example = arr.flat[0] if arr.dtype.kind == 'O' and arr.size else None
+    vlen = isinstance(example, np.ndarray)
+    if vlen:
+        data_type = numpy_to_data_type(example.dtype)
+    else:
+        data_type = numpy_to_data_type(arr.dtype, example)
+    header = stream.Data(varName=name, dataType=data_type, bigend=True, version=2,
+                         vdata=vlen)
+    for size in arr.shape:
+        header.section.range.add(size=size)
+
+    if vlen or data_type in (stream.STRING, stream.OPAQUE):
+        if vlen:
+            blocks = [np.asarray(item, dtype=example.dtype.newbyteorder('>')).tobytes()
+                      for item in arr.flat]
+        elif data_type == stream.STRING:
+            blocks = [item if isinstance(item, bytes) else str(item).encode('utf-8')
+                      for item in arr.flat]
+        else:
+            blocks = [bytes(item) for item in arr.flat]
+        return (MAGIC_DATA + encode_proto_object(header) + encode_var_int(len(blocks))
+                + b''.join(encode_block(b) for b in blocks))
+    elif data_type == stream.STRUCTURE:
+        sd = _encode_structure_rows(arr.ravel())
+        return MAGIC_DATA + encode_proto_object(header) + encode_proto_object(sd)
+
+    body = np.ascontiguousarray(arr, dtype=arr.dtype.newbyteorder('>')).tobytes()
+    if deflate:
+        header.compress = stream.DEFLATE
+        header.uncompressedSize = len(body)
+        body = zlib.compress(body, deflate)
+    return MAGIC_DATA + encode_proto_object(header) + encode_block(body)
+
+
+def _encode_structure_rows(arr):
+    """Create a StructureData message holding the rows of a structured array."""
+    rows = np.empty(arr.shape, dtype=_heap_index_dtype(arr.dtype).newbyteorder('>'))
+    heap = []
+    _fill_heap_indices(rows, arr, heap)
+    return stream.StructureData(data=rows.tobytes(), sdata=heap, nrows=arr.size,
+                                rowLength=rows.dtype.itemsize)
+
+
+def _fill_heap_indices(rows, arr, heap):
+    """Copy structured data into rows, moving strings to the heap."""
+    if arr.dtype.names is None:
+        if arr.dtype.hasobject:
+            rows[...] = np.arange(len(heap), len(heap) + arr.size).reshape(arr.shape)
+            heap.extend(str(item) for item in arr.flat)
+        else:
+            rows[...] = arr
+        return
+
+    for name in arr.dtype.names:
+        _fill_heap_indices(rows[name], arr[name], heap)
+
+
+def _encode_sequence(seq, name):
+    """Encode sequence data, with a block of rows for each piece between offsets."""
+    header = stream.Data(varName=name, dataType=stream.SEQUENCE, bigend=True, version=2)
+    blocks = [MAGIC_VDATA + encode_proto_object(
+              _encode_structure_rows(seq.records[start:end]))
+              for start, end in zip(seq.offsets[:-1], seq.offsets[1:])]
+    return MAGIC_DATA + encode_proto_object(header) + b''.join(blocks) + MAGIC_VEND
+
+
+def encode_ncstream_data2(arr, name):
+    """Encode an array as an NcStream v2 data message.
+
+    This is the inverse of :func:`read_ncstream_data2`. Numeric data keep their byte
+    order.
+
+    Parameters
+    ----------
+    arr : array-like
+        The data. Object arrays hold strings, bytes (opaque), or arrays (vlen).
+    name : str
+        The name of the variable
+
+    Returns
+    -------
+    bytes
+        The encoded message
+
+    """
+    return MAGIC_DATA2 + encode_proto_object(array_to_datacol(arr, name))
+
+
+def array_to_datacol(arr, name):
+    """Convert an array into an NcStream v2 DataCol, the inverse of :func:`datacol_to_array`.
+
+    Parameters
+    ----------
+    arr : array-like
+        The data
+    name : str
+        The name of the variable
+
+    Returns
+    -------
+    DataCol
+
+    """
+    arr = np.asarray(arr)
+    example = arr.flat[0] if arr.dtype.kind == 'O' and arr.size else None
+    vlen = isinstance(example, np.ndarray)
+    if vlen:
+        data_type = numpy_to_data_type(example.dtype)
+    else:
+        data_type = numpy_to_data_type(arr.dtype, example)
+
+    col = stream.DataCol(name=name, dataType=data_type, version=3, nelems=arr.size)
+    for size in arr.shape:
+        col.section.range.add(size=size)
+
+    if vlen:
+        values = np.concatenate([np.asarray(item, dtype=example.dtype).ravel()
+                                 for item in arr.flat])
+        col.isVlen = True
+        col.vlens.extend(int(np.size(item)) for item in arr.flat)
+        col.nelems = values.size
+        col.bigend = _is_big_endian(values.dtype)
+        col.primdata = values.tobytes()
+    elif data_type == stream.STRING:
+        col.stringdata.extend(str(item) for item in arr.flat)
+    elif data_type == stream.OPAQUE:
+        col.opaquedata.extend(bytes(item) for item in arr.flat)
+    elif data_type == stream.STRUCTURE:
+        for member in arr.dtype.names:
+            col.structdata.memberData.add().CopyFrom(array_to_datacol(arr[member], member))
+    else:
+        col.bigend = _is_big_endian(arr.dtype)
+        col.primdata = np.ascontiguousarray(arr).tobytes()
+    return col
+
+
+def _is_big_endian(dtype):
+    """Return whether data with a dtype are stored big endian."""
+    order = dtype.byteorder
+    return order == '>' or (order == '=' and sys.byteorder == 'big')
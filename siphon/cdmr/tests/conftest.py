@@ -0,0 +1,66 @@
+# Copyright (c) 2018 Siphon Contributors.
+# Distributed under the terms of the BSD 3-Clause License.
+# SPDX-License-Identifier: BSD-3-Clause
+"""Shared fixtures for the CDMRemote tests."""
+
+import sys
+
+import numpy as np
+import pytest
+
+from siphon.cdmr import Dataset
+from siphon.cdmr.ncStream_pb2 import FLOAT, Header, STRING
+
+# Asynchronous support needs Python 3 syntax
+collect_ignore = ['test_async.py'] if sys.version_info < (3, 5) else []
+
+
+class FakeCDMRemote(object):
+    """Stand in for CDMRemote by serving float arrays from memory."""
+
+    def __init__(self, arrays):
+        """Hold mapping of variable name to dimension names and data."""
+        self.arrays = arrays
+        self.requests = []
+        self.deflate = 0
+        self.closed = False
+
+    def fetch_header(self):
+        """Create a header message describing the arrays."""
+        header = Header()
+        dims = {}
+        for name, (dim_names, arr) in self.arrays.items():
+            var = header.root.vars.add(name=name, dataType=FLOAT)
+            var.atts.add(name='units', dataType=STRING, sdata='K', len=1)
+            for dim_name, size in zip(dim_names, arr.shape):
+                dims[dim_name] = size
+                var.shape.add(name=dim_name, length=size)
+        for name, size in dims.items():
+            header.root.dims.add(name=name, length=size)
+        return [header]
+
+    def close(self):
+        """Record that the connection was closed."""
+        self.closed = True
+
+    def fetch_data(self, **var):
+        """Return the requested pieces of the arrays, as sent by the server."""
+        return self.fetch_data_items(var.items())
+
+    def fetch_data_items(self, items):
+        """Return the requested pieces of the arrays, in order."""
+        items = list(items)
+        self.requests.append(dict(items))
+        return [self.arrays[name.lstrip('/')][1][
+            tuple(slice(i, i + 1) if isinstance(i, int) else i for i in ind)].astype('>f4')
+            for name, ind in items]
+
+
+@pytest.fixture
+def fake_cdmr(monkeypatch):
+    """Provide a Dataset backed by a fake CDMRemote with two 3D variables."""
+    data = np.arange(4 * 5 * 6, dtype=np.float32).reshape(4, 5, 6)
+    fake = FakeCDMRemote({'temp': (('time', 'y', 'x'), data),
+                          'rh': (('time', 'y', 'x'), data / 120.)})
+    monkeypatch.setattr('siphon.cdmr.dataset.CDMRemote', lambda url: fake)
+    return Dataset('http://localhost:8080/thredds/cdmremote/fake'), fake, data
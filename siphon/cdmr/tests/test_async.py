@@ -0,0 +1,212 @@
+# Copyright (c) 2018 Siphon Contributors.
+# Distributed under the terms of the BSD 3-Clause License.
+# SPDX-License-Identifier: BSD-3-Clause
+"""Test asynchronous access to CDMRemote."""
+
+import asyncio
+import gc
+import re
+from urllib.parse import parse_qs
+import warnings
+
+import numpy as np
+from numpy.testing import assert_array_almost_equal, assert_array_equal
+import pytest
+from requests import HTTPError
+
+from siphon.cdmr.async_support import AsyncCDMRemote, AsyncDataset
+from siphon.cdmr.ncstream import encode_header, encode_ncstream_data
+
+url = 'http://localhost:8080/thredds/cdmremote/fake'
+
+
+def parse_section(section):
+    """Turn a CDMRemote section string into indices."""
+    ind = []
+    for part in section.split(','):
+        if part == ':':
+            ind.append(slice(None))
+        elif ':' in part:
+            bounds = [int(b) for b in part.split(':')]
+            ind.append(slice(bounds[0], bounds[1] + 1, *bounds[2:]))
+        else:
+            ind.append(int(part))
+    return ind
+
+
+class FakeResponse(object):
+    """Stand in for an aiohttp response."""
+
+    def __init__(self, session, status, content):
+        """Hold the content to return."""
+        self.session = session
+        self.status = status
+        self.reason = 'Fake'
+        self.headers = {}
+        self.content = content
+
+    async def __aenter__(self):
+        """Track the number of responses open at once."""
+        self.session.in_flight += 1
+        self.session.max_in_flight = max(self.session.in_flight, self.session.max_in_flight)
+        await asyncio.sleep(0.01)
+        return self
+
+    async def __aexit__(self, *args):
+        """Finish the response."""
+        self.session.in_flight -= 1
+
+    async def read(self):
+        """Return the content."""
+        return self.content
+
+    async def text(self):
+        """Return the content as text."""
+        return self.content.decode('utf-8')
+
+
+class FakeSession(object):
+    """Stand in for an aiohttp session that encodes responses from a FakeCDMRemote."""
+
+    def __init__(self, fake):
+        """Wrap the FakeCDMRemote."""
+        self.fake = fake
+        self.urls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def get(self, url):
+        """Respond to a request."""
+        self.urls.append(url)
+        params = parse_qs(url.split('?', 1)[1])
+        if params['req'] == ['header']:
+            return FakeResponse(self, 200, encode_header(self.fake.fetch_header()[0]))
+
+        items = []
+        for name, section in re.findall(r'([\w/]+)(?:\(([^)]*)\))?',
+                                        params['var'][0]):
+            if name.strip('/') not in self.fake.arrays:
+                return FakeResponse(self, 404, b'Unknown variable')
+            items.append((name, parse_section(section) if section else [slice(None)] * 3))
+        arrays = self.fake.fetch_data_items(items)
+        return FakeResponse(self, 200, b''.join(encode_ncstream_data(arr, name)
+                                                for (name, _), arr in zip(items, arrays)))
+
+
+@pytest.fixture
+def session(fake_cdmr):
+    """Provide a fake session and the data it serves."""
+    _, fake, data = fake_cdmr
+    return FakeSession(fake), data
+
+
+def run(coro):
+    """Run a coroutine to completion."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def test_async_read(session):
+    """Test reading variables from an AsyncDataset."""
+    session, data = session
+
+    async def read():
+        ds = await AsyncDataset.open(url, session)
+        var = ds.variables['temp']
+        assert var.shape == data.shape
+        assert var.units == 'K'
+        return await var.read(np.s_[1, :, 2:4]), await var.read()
+
+    subset, full = run(read())
+    assert_array_equal(subset, data[1, :, 2:4])
+    assert_array_equal(full, data)
+
+
+def test_async_fancy_indexing(session):
+    """Test reading arrays of indices asynchronously."""
+    session, data = session
+
+    async def read():
+        ds = await AsyncDataset.open(url, session)
+        return await ds.variables['temp'].read(np.s_[::-1, 0, [5, 0, 1, 3]])
+
+    assert_array_equal(run(read()), data[::-1, 0, [5, 0, 1, 3]])
+    assert len(session.urls) == 2
+
+
+def test_async_concurrency(session, monkeypatch):
+    """Test that reads are made concurrently, up to the limit."""
+    session, data = session
+    monkeypatch.setattr(AsyncCDMRemote, 'max_concurrency', 2)
+
+    async def read():
+        ds = await AsyncDataset.open(url, session)
+        var = ds.variables['rh']
+        return await asyncio.gather(*(var.read(i) for i in range(4)))
+
+    results = run(read())
+    for i, arr in enumerate(results):
+        assert_array_almost_equal(arr, data[i] / 120.)
+    assert session.max_in_flight == 2
+
+
+def test_async_read_many(session):
+    """Test reading several variables asynchronously."""
+    session, data = session
+
+    async def read():
+        ds = await AsyncDataset.open(url, session)
+        return await ds.read_many({'temp': np.s_[1, :, 2:4], 'rh': np.s_[[3, 1], 0]})
+
+    ret = run(read())
+    assert_array_equal(ret['temp'], data[1, :, 2:4])
+    assert_array_almost_equal(ret['rh'], data[[3, 1], 0] / 120.)
+    assert len(session.urls) == 3
+
+
+def test_async_read_many_bad_name(session):
+    """Test that an unknown variable fails without leaving reads unawaited."""
+    session, _ = session
+
+    async def read():
+        ds = await AsyncDataset.open(url, session)
+        return await ds.read_many({'temp': np.s_[[3, 1], 0], 'missing': 0})
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        with pytest.raises(KeyError):
+            run(read())
+        gc.collect()
+    assert not [w for w in caught if issubclass(w.category, RuntimeWarning)]
+    assert len(session.urls) == 1
+
+
+def test_async_decode_in_executor(session, monkeypatch):
+    """Test that large responses are decoded in the executor."""
+    session, data = session
+    monkeypatch.setattr(AsyncCDMRemote, 'executor_bytes', 0)
+
+    async def read():
+        ds = await AsyncDataset.open(url, session)
+        return await ds.variables['temp'].read(np.s_[2])
+
+    assert_array_equal(run(read()), data[2])
+
+
+def test_async_getitem(session):
+    """Test that indexing a variable whose data must be requested is an error."""
+    session, _ = session
+    ds = run(AsyncDataset.open(url, session))
+    with pytest.raises(TypeError):
+        ds.variables['temp'][0]
+
+
+def test_async_error(session):
+    """Test that error responses raise HTTPError."""
+    session, _ = session
+    cdmr = AsyncCDMRemote(url, session)
+    with pytest.raises(HTTPError):
+        run(cdmr.fetch_data(missing=[0]))
@@ -3,7 +3,15 @@
 # SPDX-License-Identifier: BSD-3-Clause
 """Test the CDM Remote HTTP API."""
 
-from siphon.cdmr.cdmremote import CDMRemote
+import threading
+import zlib
+
+import numpy as np
+from numpy.testing import assert_array_equal
+
+from siphon.cdmr.cdmremote import CDMRemote, DeflateStats
+from siphon.cdmr.ncstream import MAGIC_DATA
+from siphon.cdmr.ncStream_pb2 import Data, DEFLATE, FLOAT
 from siphon.testing import get_recorder
 
 recorder = get_recorder(__file__)
@@ -41,3 +49,208 @@ class TestCDMRmote(object):
         self.cdmr.deflate = 4
         d = self.cdmr.fetch_data(latitude=[slice(None)])
         assert d
+
+    @recorder.use_cassette('cdmr_enable_compression')
+    def test_iter_data(self):
+        """Test decoding data from CDMRemote as it is downloaded."""
+        self.cdmr.deflate = 4
+        messages = list(self.cdmr.iter_data(latitude=[slice(None)]))
+        assert len(messages) == 1
+        assert messages[0].size
+
+
+def test_deflate_stats_tries_levels():
+    """Test that untried deflate levels are chosen first."""
+    stats = DeflateStats(levels=(0, 1, 5))
+    for level in (0, 1, 5):
+        assert stats.choose('temp') == level
+        stats.record('temp', level, 100, 100, 1., 0.)
+
+
+def test_deflate_stats_slow_link():
+    """Test that compression is chosen when the network is the bottleneck."""
+    stats = DeflateStats(levels=(0, 1))
+    stats.record('temp', 0, 1000, 1000, 1., 0.001)
+    stats.record('temp', 1, 100, 1000, 0.1, 0.01)
+    assert stats.choose('temp') == 1
+    assert stats.predicted_rate('temp', 1) < stats.predicted_rate('temp', 0)
+    assert stats['temp'][1].ratio == 0.1
+
+
+def test_deflate_stats_fast_link():
+    """Test that compression is turned off when decompressing is the bottleneck."""
+    stats = DeflateStats(levels=(0, 1))
+    stats.record('temp', 0, 1000, 1000, 0.001, 0.)
+    stats.record('temp', 1, 900, 1000, 0.0009, 0.5)
+    assert stats.choose('temp') == 0
+    assert 'rh' not in stats
+
+
+def test_deflate_stats_explore():
+    """Test that other levels are periodically retried."""
+    stats = DeflateStats(levels=(0, 1), explore_interval=3)
+    stats.record('temp', 1, 1000, 1000, 1., 0.)
+    stats.record('temp', 0, 1000, 1000, 1., 0.)
+    assert [stats.choose('temp') for _ in range(3)] == [0, 0, 1]
+
+
+def test_deflate_stats_no_network_time():
+    """Test choosing a level when no time has been spent waiting on the network."""
+    stats = DeflateStats(levels=(0, 1))
+    stats.record('temp', 0, 1000, 1000, 0., 0.001)
+    stats.record('temp', 1, 100, 1000, 0., 0.01)
+    assert stats.bandwidth is None
+    assert stats.choose('temp') == 0
+
+
+def test_deflate_stats_empty_responses():
+    """Test that levels whose requests returned no data are not chosen forever."""
+    stats = DeflateStats(levels=(0, 1, 5))
+    assert [stats.choose('temp') for _ in range(3)] == [0, 1, 5]
+    stats.record('temp', 1, 1000, 1000, 1., 0.)
+    assert stats.choose('temp') == 1
+
+    stats.record('rh', 0, 0, 0, 0., 0.)
+    assert stats.choose('rh') == 1
+
+
+class FakeResponse(object):
+    """Mimic a streamed response."""
+
+    def __init__(self, content):
+        """Initialize with the content of the response."""
+        self.content = content
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        """Iterate over the content in chunks."""
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        """Close the response."""
+        self.closed = True
+
+
+def data_message(values, deflate=False):
+    """Create an NcStream v1 data message, optionally compressed."""
+    values = np.asarray(values, dtype='>f4')
+    header = Data(varName='temp', dataType=FLOAT, bigend=True, version=2)
+    header.section.range.add(size=values.size)
+    body = values.tobytes()
+    if deflate:
+        header.compress = DEFLATE
+        header.uncompressedSize = len(body)
+        body = zlib.compress(body)
+    header = header.SerializeToString()
+    # Sizes here are small enough to be single byte variable-length integers
+    return (MAGIC_DATA + bytes(bytearray([len(header)])) + header
+            + bytes(bytearray([len(body)])) + body)
+
+
+def test_auto_deflate(monkeypatch):
+    """Test that data requests with automatic compression record statistics."""
+    cdmr = CDMRemote('http://localhost:8080/thredds/cdmremote/test.nc')
+    cdmr.deflate = 'auto'
+    cdmr.deflate_stats = DeflateStats(levels=(0, 1))
+    queries = []
+    responses = []
+
+    def get_query(query, **kwargs):
+        queries.append(str(query))
+        responses.append(FakeResponse(data_message(np.zeros(16),
+                                                   deflate='deflate' in queries[-1])))
+        return responses[-1]
+
+    monkeypatch.setattr(cdmr, 'get_query', get_query)
+    for _ in range(2):
+        data, = cdmr.fetch_data(temp=[slice(None)])
+        assert_array_equal(data, np.zeros(16))
+
+    assert 'deflate' not in queries[0]
+    assert 'deflate=1' in queries[1]
+    assert all(resp.closed for resp in responses)
+    assert set(cdmr.deflate_stats['temp']) == {0, 1}
+    assert cdmr.deflate_stats['temp'][1].ratio < cdmr.deflate_stats['temp'][0].ratio
+
+
+def test_decompress_workers(monkeypatch):
+    """Test decompressing the messages in a response concurrently."""
+    cdmr = CDMRemote('http://localhost:8080/thredds/cdmremote/test.nc')
+    cdmr.deflate = 1
+    cdmr.decompress_workers = 2
+    values = [np.arange(i, i + 16) for i in range(5)]
+    content = b''.join(data_message(v, deflate=True) for v in values)
+    responses = []
+
+    def get_query(query, **kwargs):
+        responses.append(FakeResponse(content))
+        return responses[-1]
+
+    monkeypatch.setattr(cdmr, 'get_query', get_query)
+
+    messages = cdmr.fetch_data(temp=[slice(None)])
+    assert len(messages) == len(values)
+    for msg, v in zip(messages, values):
+        assert_array_equal(msg, v)
+    assert responses[0].closed
+
+    # The threads are kept for later requests, until closed
+    executor = cdmr._executor
+    assert executor is not None
+    assert len(cdmr.fetch_data(temp=[slice(None)])) == len(values)
+    assert cdmr._executor is executor
+    cdmr.close()
+    assert cdmr._executor is None
+
+
+def test_session_per_thread():
+    """Test that each thread uses its own HTTP session."""
+    cdmr = CDMRemote('http://localhost:8080/thredds/cdmremote/test.nc')
+    sessions = []
+    thread = threading.Thread(target=lambda: sessions.extend([cdmr._session] * 2))
+    thread.start()
+    thread.join()
+
+    assert sessions[0] is sessions[1]
+    assert sessions[0] is not cdmr._session
+    assert cdmr._session is cdmr._session
+
+
+def test_close_sessions():
+    """Test that closing closes the sessions of all threads."""
+    cdmr = CDMRemote('http://localhost:8080/thredds/cdmremote/test.nc')
+    sessions = [cdmr._session]
+    thread = threading.Thread(target=lambda: sessions.append(cdmr._session))
+    thread.start()
+    thread.join()
+
+    closed = []
+    for session in sessions:
+        session.close = lambda session=session: closed.append(session)
+    cdmr.close()
+    assert closed == sessions
+    assert cdmr._session is not sessions[0]
+
+
+def test_sessions_of_finished_threads():
+    """Test that sessions of threads that have finished are closed and dropped."""
+    cdmr = CDMRemote('http://localhost:8080/thredds/cdmremote/test.nc')
+    sessions = []
+    for _ in range(5):
+        thread = threading.Thread(target=lambda: sessions.append(cdmr._session))
+        thread.start()
+        thread.join()
+
+    # Only the main thread's and the last thread's sessions remain
+    assert len(cdmr._sessions) == 2
+    assert cdmr._sessions[-1][1] is sessions[-1]
+
+    # The next new session closes the one left by the finished thread
+    closed = []
+    sessions[-1].close = lambda: closed.append(sessions[-1])
+    thread = threading.Thread(target=lambda: cdmr._session)
+    thread.start()
+    thread.join()
+    assert closed == sessions[-1:]
+    assert len(cdmr._sessions) == 2
@@ -3,8 +3,13 @@
 # SPDX-License-Identifier: BSD-3-Clause
 """Test Coverage Dataset."""
 
+from datetime import datetime
+
+import numpy as np
+from numpy.testing import assert_almost_equal
 import pytest
 
+from siphon.cdmr import HeaderCache
 from siphon.cdmr.coveragedataset import CoverageDataset
 from siphon.testing import get_recorder
 
@@ -27,3 +32,60 @@ def test_simple_cdmremotefeature_str():
     cd = CoverageDataset('http://localhost:8080/thredds/cdmrfeature/grid/'
                          'test/HRRR_CONUS_2p5km_20160309_1600.grib2')
     assert str(cd)
+
+
+@pytest.mark.filterwarnings('ignore: CoverageDataset')
+def test_coverage_header_cache(monkeypatch, tmpdir):
+    """Test opening a CoverageDataset again using the stored header."""
+    monkeypatch.setattr(CoverageDataset, 'header_cache', HeaderCache(str(tmpdir)))
+    url = ('http://localhost:8080/thredds/cdmrfeature/grid/'
+           'test/HRRR_CONUS_2p5km_20160309_1600.grib2')
+    with recorder.use_cassette('hrrr_cdmremotefeature'):
+        cd = CoverageDataset(url)
+
+    # No request is made this time
+    cd2 = CoverageDataset(url)
+    assert list(cd2.grids) == list(cd.grids)
+
+
+@pytest.fixture
+def hrrr():
+    """Open the HRRR CoverageDataset."""
+    with pytest.warns(UserWarning), recorder.use_cassette('hrrr_cdmremotefeature'):
+        return CoverageDataset('http://localhost:8080/thredds/cdmrfeature/grid/'
+                               'test/HRRR_CONUS_2p5km_20160309_1600.grib2')
+
+
+def test_grid_coords(hrrr):
+    """Test getting the full coordinates for a grid from the header."""
+    grid = hrrr.grids['Wind_speed_height_above_ground_1_Hour_Maximum']
+    assert grid.units == 'm/s'
+    assert grid.dimensions == ('time2', 'height_above_ground2', 'y', 'x')
+    assert grid.shape == (15, 1, 1377, 2145)
+
+    coords = grid.coords
+    assert list(coords) == ['reftime', 'time2', 'height_above_ground2', 'y', 'x']
+    assert_almost_equal(coords['time2'][:2], [0.5, 1.5])
+    assert coords['x'].shape == (2145,)
+    assert_almost_equal(coords['x'][1] - coords['x'][0], 2.5397029)
+
+    # Coordinates are shared by grids with the same coordinate system
+    assert hrrr.coords(grid.coord_sys) is coords
+
+
+@recorder.use_cassette('cdmrf_data')
+def test_grid_get_data(hrrr):
+    """Test reading a subset of a grid along with its coordinates."""
+    grid = hrrr.grids['Wind_speed_height_above_ground_1_Hour_Maximum']
+    query = hrrr.query()
+    query.time(datetime(2016, 3, 9, 16))
+    query.lonlat_box(-106, -105, 39, 40)
+    data = grid.get_data(query)
+
+    assert data.values.shape == (1, 1, 49, 40)
+    assert data.values.dtype == np.float32
+    assert data.dimensions == ('time2', 'height_above_ground2', 'y', 'x')
+    assert_almost_equal(data.coords['time2'], [0.5])
+    assert data.coords['y'].shape == (49,)
+    assert_almost_equal(data.coords['x'][0], -980.3456218)
+    assert not query.var
@@ -3,11 +3,14 @@
 # SPDX-License-Identifier: BSD-3-Clause
 """Test the operation of the Dataset class from CDMRemote."""
 
+import threading
+
 import numpy as np
 from numpy.testing import assert_almost_equal, assert_array_almost_equal, assert_array_equal
 import pytest
 
-from siphon.cdmr import Dataset
+from siphon.cdmr import ChunkCache, Dataset, HeaderCache
+from siphon.cdmr.dataset import to_native, Variable
 from siphon.testing import get_recorder
 
 recorder = get_recorder(__file__)
@@ -458,3 +461,393 @@ class TestIndexing(object):
         """Test slices with strides."""
         subset = self.var[0, 0, ::2, ::2]
         assert subset.shape == ((self.var.shape[-2] + 1) // 2, (self.var.shape[-1] + 1) // 2)
+
+
+@pytest.mark.parametrize('ind', [np.s_[:], np.s_[1], np.s_[1:3, 2], np.s_[..., 4],
+                                 np.s_[::3, 1::2, -1], np.s_[-1, -2, 1:5:2]])
+def test_chunk_cache_read(fake_cdmr, ind):
+    """Test that reads through the chunk cache give the same data."""
+    ds, fake, data = fake_cdmr
+    ds.chunk_cache = ChunkCache(block_bytes=48)
+    var = ds.variables['temp']
+    assert_array_equal(var[ind], data[ind])
+    assert len(fake.requests) == 1
+
+    # Read again, which should come only from the cache
+    assert_array_equal(var[ind], data[ind])
+    assert len(fake.requests) == 1
+
+
+def test_chunk_cache_missing_blocks(fake_cdmr):
+    """Test that only blocks missing from the cache are requested."""
+    ds, fake, data = fake_cdmr
+    ds.chunk_cache = ChunkCache(block_bytes=48)
+    var = ds.variables['temp']
+    assert ds.chunk_cache.block_shape(var) == (1, 2, 6)
+
+    assert_array_equal(var[0:2], data[0:2])
+    assert_array_equal(var[1:3], data[1:3])
+    assert fake.requests[-1] == {'/temp': [slice(2, 3), slice(0, 5), slice(0, 6)]}
+    assert_array_equal(var[2, 1:3, 0], data[2, 1:3, 0])
+    assert len(fake.requests) == 2
+
+
+def test_chunk_cache_skips_cached_blocks(fake_cdmr):
+    """Test that blocks already held are not requested again with missing ones."""
+    ds, fake, data = fake_cdmr
+    ds.chunk_cache = ChunkCache(block_bytes=48)
+    var = ds.variables['temp']
+    items = []
+    fetch = fake.fetch_data_items
+    fake.fetch_data_items = lambda req: fetch(items.extend(req) or req)
+
+    var[1]
+    var[3]
+    del items[:]
+    assert_array_equal(var[0:4], data[0:4])
+    assert len(fake.requests) == 3
+    assert items == [('/temp', [slice(0, 1), slice(0, 5), slice(0, 6)]),
+                     ('/temp', [slice(2, 3), slice(0, 5), slice(0, 6)])]
+
+
+def test_chunk_cache_shared(fake_cdmr):
+    """Test that a cache shared between datasets keeps their blocks apart."""
+    ds, fake, data = fake_cdmr
+    ds.chunk_cache = ChunkCache(block_bytes=48)
+    other = Dataset('http://localhost:8080/thredds/cdmremote/other')
+    other.chunk_cache = ds.chunk_cache
+
+    ds.variables['temp'][0]
+    other.variables['temp'][0]
+    assert len(fake.requests) == 2
+
+
+def test_chunk_cache_bounded(fake_cdmr):
+    """Test that the chunk cache drops blocks to stay within its size."""
+    ds, fake, data = fake_cdmr
+    ds.chunk_cache = ChunkCache(max_bytes=200, block_bytes=48)
+    var = ds.variables['temp']
+    assert_array_equal(var[:], data)
+    assert 0 < ds.chunk_cache.nbytes <= 200
+
+    # Most recently used blocks are kept
+    var[3, 4]
+    assert len(fake.requests) == 1
+    var[0, 0]
+    assert len(fake.requests) == 2
+
+
+def test_read_many(fake_cdmr):
+    """Test reading several variables with a single request."""
+    ds, fake, data = fake_cdmr
+    ret = ds.read_many({'temp': np.s_[1, :, 2:4], 'rh': np.s_[:2, 0]})
+    assert len(fake.requests) == 1
+    assert_array_equal(ret['temp'], data[1, :, 2:4])
+    assert_array_almost_equal(ret['rh'], data[:2, 0] / 120.)
+    assert ret['rh'].dtype == np.dtype('>f4')
+
+
+def test_read_many_message_mismatch(fake_cdmr):
+    """Test that an unexpected number of messages is an error."""
+    ds, fake, _ = fake_cdmr
+    fake.fetch_data_items = lambda items: []
+    with pytest.raises(RuntimeError):
+        ds.read_many({'temp': 0})
+
+
+@pytest.mark.parametrize('ind, expected', [
+    (np.s_[[0, 2, 3]], np.s_[[0, 2, 3]]),
+    (np.s_[[3, 0, -1], 1], np.s_[[3, 0, 3], 1]),
+    (np.s_[np.array([True, False, True, True])], np.s_[[0, 2, 3]]),
+    (np.s_[::-1], np.s_[::-1]),
+    (np.s_[-1:0:-2, :, 5::-3], np.s_[-1:0:-2, :, 5::-3]),
+    (np.s_[::-1, 1, [4, 1, 0, 1]], np.s_[::-1, 1, [4, 1, 0, 1]]),
+    (np.s_[3:1], np.s_[3:1]),
+    (np.s_[[], 2], np.s_[[], 2])])
+def test_fancy_indexing(fake_cdmr, ind, expected):
+    """Test indexing with arrays, boolean masks, and negative steps."""
+    ds, fake, data = fake_cdmr
+    assert_array_equal(ds.variables['temp'][ind], data[expected])
+
+
+def test_fancy_indexing_orthogonal(fake_cdmr):
+    """Test that index arrays apply independently along each dimension."""
+    ds, fake, data = fake_cdmr
+    assert_array_equal(ds.variables['temp'][[0, 3], 2, [5, 1, 3]],
+                       data[np.ix_([0, 3], [2], [5, 1, 3])][:, 0])
+
+
+def test_fancy_indexing_coalesced(fake_cdmr):
+    """Test that index arrays are requested as a few slices rather than a whole slab."""
+    ds, fake, data = fake_cdmr
+    items = []
+    fetch = fake.fetch_data_items
+    fake.fetch_data_items = lambda req: fetch(items.extend(req) or req)
+
+    assert_array_equal(ds.variables['temp'][:, 0, [5, 0, 1, 3]], data[:, 0, [5, 0, 1, 3]])
+    assert len(fake.requests) == 1
+    assert items == [('/temp', [slice(None), 0, slice(0, 2)]),
+                     ('/temp', [slice(None), 0, slice(3, 6, 2)])]
+
+
+def test_fancy_indexing_read_many(fake_cdmr):
+    """Test that index arrays work when reading several variables."""
+    ds, fake, data = fake_cdmr
+    ret = ds.read_many({'temp': np.s_[[1, 3], 0], 'rh': np.s_[:2, 0]})
+    assert_array_equal(ret['temp'], data[[1, 3], 0])
+    assert_array_almost_equal(ret['rh'], data[:2, 0] / 120.)
+
+
+@pytest.mark.parametrize('ind', [np.s_[[4]], np.s_[[-5]], np.s_[np.array([True, False])],
+                                 np.s_[[[0]]], np.s_[[0.5]]])
+def test_fancy_indexing_bad(fake_cdmr, ind):
+    """Test that invalid index arrays raise errors."""
+    ds, _, _ = fake_cdmr
+    with pytest.raises(IndexError):
+        ds.variables['temp'][ind]
+
+
+@pytest.mark.parametrize('ind', [np.s_[:], np.s_[1], np.s_[::2, 1:4, :], np.s_[2, 1:5:2]])
+def test_split_read(fake_cdmr, ind):
+    """Test splitting large reads into concurrent requests."""
+    ds, fake, data = fake_cdmr
+    ds.max_workers = 2
+    ds.split_bytes = 8
+    assert_array_equal(ds.variables['temp'][ind], data[ind])
+    assert len(fake.requests) == 2
+
+
+def test_split_read_reuses_threads(fake_cdmr):
+    """Test that split reads share a pool of threads, released when closed."""
+    ds, fake, data = fake_cdmr
+    ds.max_workers = 2
+    ds.split_bytes = 8
+    with ds:
+        ds.variables['temp'][:]
+        pool = ds._executor
+        assert_array_equal(ds.variables['temp'][1:3], data[1:3])
+        assert ds._executor is pool
+    assert ds._executor is None
+    assert fake.closed
+
+
+def test_split_read_small(fake_cdmr):
+    """Test that reads smaller than the split size use a single request."""
+    ds, fake, data = fake_cdmr
+    ds.max_workers = 4
+    assert_array_equal(ds.variables['temp'][:], data)
+    assert len(fake.requests) == 1
+
+
+def test_to_dask(fake_cdmr, monkeypatch):
+    """Test reading a variable lazily using dask."""
+    pytest.importorskip('dask')
+    import siphon.cdmr.dask_support
+    ds, fake, data = fake_cdmr
+    monkeypatch.setattr(siphon.cdmr.dask_support, '_get_cdmr', lambda url, deflate: fake)
+
+    arr = ds.variables['temp'].to_dask(chunk_bytes=48)
+    assert not fake.requests
+    assert arr.chunks == ((1,) * 4, (2, 2, 1), (6,))
+    assert_array_equal(arr[1:3, 1:4].compute(scheduler='sync'), data[1:3, 1:4])
+    assert len(fake.requests) == 4
+
+
+@pytest.mark.parametrize('key', [np.s_[3:3, :], np.s_[1, 2:2], np.s_[::-1, 5:1], np.s_[2],
+                                 np.s_[1:3, 4], np.s_[-1, ::2, 3]])
+def test_remote_array_shape(fake_cdmr, monkeypatch, key):
+    """Test that indexing a RemoteArray gives the same shape as numpy, even if empty."""
+    pytest.importorskip('dask')
+    import siphon.cdmr.dask_support
+    ds, fake, data = fake_cdmr
+    monkeypatch.setattr(siphon.cdmr.dask_support, '_get_cdmr', lambda url, deflate: fake)
+
+    arr = siphon.cdmr.dask_support.RemoteArray.from_variable(ds.variables['temp'])
+    assert_array_equal(arr[key], data[key])
+    assert arr[key].shape == data[key].shape
+    assert len(fake.requests) == (2 if data[key].size else 0)
+
+
+def test_dask_remotes_closed(monkeypatch):
+    """Test that only the most recently used CDMRemote instances are kept open."""
+    pytest.importorskip('dask')
+    import siphon.cdmr.dask_support
+    monkeypatch.setattr(siphon.cdmr.dask_support, '_local', threading.local())
+    monkeypatch.setattr(siphon.cdmr.dask_support, '_max_remotes', 2)
+    closed = []
+    monkeypatch.setattr(siphon.cdmr.dask_support.CDMRemote, 'close',
+                        lambda self: closed.append(self._base))
+
+    get_cdmr = siphon.cdmr.dask_support._get_cdmr
+    first = get_cdmr('http://test/a', 0)
+    get_cdmr('http://test/b', 0)
+    assert get_cdmr('http://test/a', 0) is first
+    assert not closed
+
+    get_cdmr('http://test/c', 0)
+    assert closed == ['http://test/b']
+    assert get_cdmr('http://test/a', 0) is first
+
+
+def test_to_dask_pickle(fake_cdmr, monkeypatch):
+    """Test that the dask tasks can be pickled."""
+    pytest.importorskip('dask')
+    import pickle
+    import siphon.cdmr.dask_support
+    ds, fake, data = fake_cdmr
+    monkeypatch.setattr(siphon.cdmr.dask_support, '_get_cdmr', lambda url, deflate: fake)
+
+    arr = pickle.loads(pickle.dumps(ds.variables['temp'].to_dask(chunks=(2, 5, 6))))
+    assert_array_equal(arr.sum(axis=0).compute(scheduler='sync'), data.sum(axis=0))
+    assert len(fake.requests) == 2
+
+
+def test_header_cache(monkeypatch, tmpdir):
+    """Test opening a dataset again using the stored header."""
+    monkeypatch.setattr(Dataset, 'header_cache', HeaderCache(str(tmpdir)))
+    url = 'http://localhost:8080/thredds/cdmremote/nc4/compound/ref_tst_compounds.nc4'
+    with recorder.use_cassette('nc4_compound_ref'):
+        ds = Dataset(url)
+    assert len(tmpdir.listdir()) == 1
+
+    # No request is made this time
+    ds2 = Dataset(url)
+    assert list(ds2.variables) == list(ds.variables)
+    assert ds2.variables['obs'].dtype == ds.variables['obs'].dtype
+
+
+class FakeResponse(object):
+    """Mimic a response for a header request."""
+
+    def __init__(self, status_code, content=b'', headers=None):
+        """Initialize the response."""
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+
+class FakeEndPoint(object):
+    """Mimic an endpoint, recording requests and returning fixed responses."""
+
+    _base = 'http://localhost/thredds/cdmremote/test.nc'
+
+    def __init__(self, responses):
+        """Initialize with the responses to return."""
+        self.responses = list(responses)
+        self.headers = []
+
+    def get_query(self, query, headers=None):
+        """Return the next response."""
+        self.headers.append(headers)
+        return self.responses.pop(0)
+
+
+def test_header_cache_revalidate(tmpdir):
+    """Test that stale headers are revalidated with the server."""
+    cache = HeaderCache(str(tmpdir), max_age=0)
+    endpoint = FakeEndPoint([FakeResponse(200, b'header', {'ETag': '"abc"'}),
+                             FakeResponse(304),
+                             FakeResponse(200, b'new header')])
+    assert cache.fetch(endpoint, 'req=header') == b'header'
+    assert cache.fetch(endpoint, 'req=header') == b'header'
+    assert endpoint.headers[1] == {'If-None-Match': '"abc"'}
+    assert cache.fetch(endpoint, 'req=header') == b'new header'
+
+    cache.clear()
+    assert not tmpdir.listdir()
+
+
+def test_lazy_variables(fake_cdmr, monkeypatch):
+    """Test that variables are only created when accessed."""
+    ds, _, _ = fake_cdmr
+    built = []
+    load = Variable.load_from_stream
+
+    def load_from_stream(self, var):
+        built.append(var.name)
+        load(self, var)
+
+    monkeypatch.setattr(Variable, 'load_from_stream', load_from_stream)
+    assert list(ds.variables) == ['temp', 'rh']
+    assert 'rh' in ds.variables
+    assert not built
+
+    var = ds.variables['temp']
+    assert ds.variables['temp'] is var
+    assert built == ['temp']
+    assert var.shape == (4, 5, 6)
+
+
+def test_lazy_attributes(fake_cdmr):
+    """Test that attributes are unpacked when accessed."""
+    ds, _, _ = fake_cdmr
+    var = ds.variables['temp']
+    assert var.ncattrs() == ['units']
+    assert 'units' not in vars(var)
+    assert var.units == 'K'
+    assert 'units' in vars(var)
+    with pytest.raises(AttributeError):
+        var.long_name
+
+
+def test_to_native():
+    """Test converting big endian data to native byte order."""
+    arr = np.arange(5, dtype='>f4')
+    out = to_native(arr)
+    assert out.dtype.isnative
+    assert np.shares_memory(out, arr)
+    assert_array_equal(out, np.arange(5))
+
+    # Read-only data are copied
+    readonly = np.frombuffer(np.arange(5, dtype='>i2').tobytes(), dtype='>i2')
+    out = to_native(readonly)
+    assert out.dtype.isnative
+    assert_array_equal(out, np.arange(5))
+
+
+def test_to_native_struct():
+    """Test converting structured data to native byte order."""
+    arr = np.zeros(2, dtype=[('a', '>i4'), ('b', '>f8', 2)])
+    arr['a'] = [1, 2]
+    arr['b'] = 1.5
+    out = to_native(arr)
+    assert out.dtype.fields['a'][0].isnative
+    assert out.dtype.fields['b'][0].base.isnative
+    assert_array_equal(out['a'], [1, 2])
+    assert_array_equal(out['b'], 1.5)
+
+
+def test_to_native_struct_strings():
+    """Test converting structured data with string and vlen members."""
+    dt = np.dtype([('name', 'O'), ('lat', '>f4'), ('obs', [('temp', '>f8'), ('n', '>i2')]),
+                   ('levels', '>i4', 2), ('vals', 'O')])
+    arr = np.zeros(2, dtype=dt)
+    arr['name'] = ['KDEN', 'KBOU']
+    arr['lat'] = [39.8, 40.0]
+    arr['obs']['temp'] = [280.5, 281.5]
+    arr['obs']['n'] = [3, 4]
+    arr['levels'] = [[1, 2], [3, 4]]
+    arr['vals'][0] = np.arange(3, dtype='>f4')
+    arr['vals'][1] = np.arange(1, dtype='>f4')
+
+    out = to_native(arr)
+    assert out.dtype.fields['lat'][0].isnative
+    assert out.dtype.fields['obs'][0].fields['n'][0].isnative
+    assert out.dtype.fields['levels'][0].base.isnative
+    assert list(out['name']) == ['KDEN', 'KBOU']
+    assert_array_almost_equal(out['lat'], [39.8, 40.0])
+    assert_array_equal(out['obs']['temp'], [280.5, 281.5])
+    assert_array_equal(out['obs']['n'], [3, 4])
+    assert_array_equal(out['levels'], [[1, 2], [3, 4]])
+    assert out['vals'][0] is arr['vals'][0]
+
+
+def test_native_byteorder(fake_cdmr, monkeypatch):
+    """Test reading variables converted to native byte order."""
+    ds, _, data = fake_cdmr
+    assert ds.variables['temp'][0].dtype == np.dtype('>f4')
+
+    monkeypatch.setattr(Dataset, 'native_byteorder', True)
+    arr = ds.variables['temp'][1:3]
+    assert arr.dtype.isnative
+    assert_array_equal(arr, data[1:3])
@@ -3,12 +3,22 @@
 # SPDX-License-Identifier: BSD-3-Clause
 """Test the low-level ncstream interface."""
 
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
+import zlib
 
+import numpy as np
+from numpy.testing import assert_array_equal
 import pytest
 
-from siphon.cdmr.ncstream import read_ncstream_messages, read_var_int
-from siphon.cdmr.ncStream_pb2 import Header
+from siphon.cdmr.ncstream import (BufferReader, ChunkedReader, encode_header,
+                                  encode_ncstream_data, encode_ncstream_data2,
+                                  encode_ncstream_err, encode_var_int, inflate,
+                                  iter_ncstream_messages, MAGIC_DATA, MAGIC_VDATA,
+                                  MAGIC_VEND, NcStreamFile, read_ncstream_messages,
+                                  read_var_int, SequenceData, split_vlen, struct_to_dtype)
+from siphon.cdmr.ncStream_pb2 import (Data, DEFLATE, FLOAT, Header, INT, SEQUENCE, STRING,
+                                      STRUCTURE, Structure, StructureData)
 from siphon.testing import get_recorder
 
 recorder = get_recorder(__file__)
@@ -39,6 +49,52 @@ def test_read_var_int(src, result):
     assert read_var_int(BytesIO(src)) == result
 
 
+@pytest.mark.parametrize('src, result', [(b'\xb6\xe0\x02', 45110), (b'\x17', 23)])
+def test_read_var_int_buffer(src, result):
+    """Check that we properly read variable length integers from a buffer."""
+    f = BufferReader(src + b'\x01')
+    assert read_var_int(f) == result
+    assert f.read() == b'\x01'
+
+
+def float_data_message(values, deflate=False):
+    """Create an NcStream v1 message for an array of floats, optionally compressed."""
+    values = np.asarray(values, dtype='>f4')
+    header = Data(varName='a', dataType=FLOAT, bigend=True, version=2)
+    for size in values.shape:
+        header.section.range.add(size=size)
+    body = values.tobytes()
+    if deflate:
+        header.compress = DEFLATE
+        header.uncompressedSize = len(body)
+        body = zlib.compress(body)
+    header = header.SerializeToString()
+    # Sizes here are small enough to be single byte variable-length integers
+    return (MAGIC_DATA + bytes(bytearray([len(header)])) + header
+            + bytes(bytearray([len(body)])) + body)
+
+
+def test_buffer_data_view():
+    """Test that data read from a buffer are a view of it rather than a copy."""
+    data = float_data_message([[1, 2, 3], [4, 5, 6]])
+    messages = read_ncstream_messages(data)
+    assert len(messages) == 1
+    assert_array_equal(messages[0], [[1, 2, 3], [4, 5, 6]])
+    assert np.shares_memory(messages[0], np.frombuffer(data, dtype=np.uint8))
+
+
+def test_chunked_reader_direct():
+    """Test large reads from chunks going directly into a new buffer."""
+    data = bytes(bytearray(range(256))) * 1024
+    f = ChunkedReader(data[i:i + 1000] for i in range(0, len(data), 1000))
+    assert f.read(10) == data[:10]
+    block = f.read(ChunkedReader.direct_size)
+    assert isinstance(block, bytearray)
+    assert block == data[10:10 + ChunkedReader.direct_size]
+    assert f.read(5) == data[10 + ChunkedReader.direct_size:15 + ChunkedReader.direct_size]
+    assert len(f.read(len(data))) == len(data) - 15 - ChunkedReader.direct_size
+
+
 def test_header_message_def():
     """Test parsing of Header message."""
     f = get_header_remote()
@@ -62,6 +118,59 @@ def test_local_data():
     assert messages[0][0] == '2014-10-28T21:00:00Z'
 
 
+def test_chunked_reader():
+    """Test that reads from chunks return the full amount requested."""
+    f = ChunkedReader([b'ab', b'', b'cde', b'f'])
+    assert f.read(3) == b'abc'
+    assert f.read(1) == b'd'
+    assert f.read(5) == b'ef'
+    assert f.read(1) == b''
+
+
+def test_iter_messages_chunked():
+    """Test decoding messages from a stream of small chunks."""
+    msg = (b'\xab\xec\xce\xba\x17\n\x0breftime_ISO\x10\x07\x1a\x04\n'
+           b'\x02\x10\x01(\x02\x01\x142014-10-28T21:00:00Z')
+    data = msg * 2
+    chunks = (data[i:i + 5] for i in range(0, len(data), 5))
+    messages = iter_ncstream_messages(ChunkedReader(chunks))
+    assert next(messages)[0] == '2014-10-28T21:00:00Z'
+    assert next(messages)[0] == '2014-10-28T21:00:00Z'
+    assert next(messages, None) is None
+
+
+def test_inflate():
+    """Test decompressing into an array."""
+    data = np.arange(10000, dtype='>i4').tobytes()
+    out = inflate(zlib.compress(data), len(data))
+    assert out.dtype == np.uint8
+    assert out.tobytes() == data
+
+
+def test_inflate_bad_size():
+    """Test that decompressed data of the wrong size is an error."""
+    with pytest.raises(ValueError):
+        inflate(zlib.compress(b'abcdef'), 5)
+
+
+def test_iter_messages_compressed():
+    """Test decoding compressed messages."""
+    data = float_data_message(np.arange(16), deflate=True)
+    arr, = read_ncstream_messages(data)
+    assert_array_equal(arr, np.arange(16))
+
+
+def test_iter_messages_executor():
+    """Test decompressing several messages concurrently, keeping them in order."""
+    values = [np.arange(i, i + 16) for i in range(10)]
+    data = b''.join(float_data_message(v, deflate=i % 3) for i, v in enumerate(values))
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        messages = list(iter_ncstream_messages(BufferReader(data), pool, read_ahead=2))
+    assert len(messages) == len(values)
+    for msg, v in zip(messages, values):
+        assert_array_equal(msg, v)
+
+
 def test_bad_magic(caplog):
     """Test that we get notified of bad magic bytes in stream."""
     # Try reading a bad message
@@ -69,3 +178,247 @@ def test_bad_magic(caplog):
     read_ncstream_messages(f)
 
     assert 'Unknown magic' in caplog.text
+
+
+def test_split_vlen():
+    """Test splitting a flat array into variable-length views."""
+    values = np.arange(6)
+    arr = split_vlen(values, [1, 2, 3])
+    assert arr.dtype == np.object_
+    assert arr.shape == (3,)
+    assert_array_equal(arr[0], [0])
+    assert_array_equal(arr[1], [1, 2])
+    assert_array_equal(arr[2], [3, 4, 5])
+    assert all(np.shares_memory(piece, values) for piece in arr)
+
+
+def test_split_vlen_equal_sizes():
+    """Test that variable-length pieces of equal size collapse to a 2D array."""
+    arr = split_vlen(np.arange(6), [2, 2, 2])
+    assert_array_equal(arr, [[0, 1], [2, 3], [4, 5]])
+
+
+def station_struct():
+    """Create a structure definition with scalar, array, and string members."""
+    struct = Structure(name='obs', dataType=STRUCTURE)
+    struct.vars.add(name='id', dataType=INT)
+    struct.vars.add(name='temp', dataType=FLOAT).shape.add(length=2)
+    struct.vars.add(name='name', dataType=STRING)
+    return struct
+
+
+def struct_rows(ids, names, heap_start=0):
+    """Create the rows for :func:`station_struct` in a StructureData message."""
+    rows = np.zeros(len(ids), dtype=[('id', '>i4'), ('temp', '>f4', 2), ('name', '>i4')])
+    rows['id'] = ids
+    rows['temp'] = np.array(ids)[:, None] + [0.5, 0.25]
+    rows['name'] = np.arange(len(ids))
+    return StructureData(data=rows.tobytes(), sdata=names, nrows=len(ids),
+                         rowLength=rows.dtype.itemsize)
+
+
+def proto_block(msg):
+    """Create a length-prefixed block for a small protobuf message."""
+    msg = msg.SerializeToString()
+    return bytes(bytearray([len(msg)])) + msg
+
+
+def test_struct_to_dtype():
+    """Test converting a structure definition with member dimensions to a dtype."""
+    dt = struct_to_dtype(station_struct())
+    assert dt == np.dtype([('id', 'i4'), ('temp', 'f4', 2), ('name', 'O')])
+
+
+def test_structure_data():
+    """Test decoding structure data, including strings from the heap."""
+    header = Data(varName='obs', dataType=STRUCTURE, bigend=True, version=2)
+    header.section.range.add(size=3)
+    data = (MAGIC_DATA + proto_block(header)
+            + proto_block(struct_rows([1, 2, 3], ['a', 'b', 'c'])))
+    dt = struct_to_dtype(station_struct())
+    arr, = iter_ncstream_messages(data, dtypes={'obs': dt})
+    assert_array_equal(arr['id'], [1, 2, 3])
+    assert_array_equal(arr['temp'][:, 1], [1.25, 2.25, 3.25])
+    assert list(arr['name']) == ['a', 'b', 'c']
+
+    # Without a dtype, rows are left for the caller to handle
+    arr, = read_ncstream_messages(data)
+    assert arr.dtype.names == ('>',)
+    assert arr.shape == (3,)
+
+
+def test_sequence_data():
+    """Test decoding sequence data from several blocks into one array."""
+    header = Data(varName='obs', dataType=SEQUENCE, bigend=True, version=2)
+    data = (MAGIC_DATA + proto_block(header)
+            + MAGIC_VDATA + proto_block(struct_rows([1, 2], ['a', 'b']))
+            + MAGIC_VDATA + proto_block(struct_rows([3], ['c']))
+            + MAGIC_VEND)
+    dt = struct_to_dtype(station_struct())
+    seq, = iter_ncstream_messages(data, dtypes={'obs': dt})
+    assert_array_equal(seq.offsets, [0, 2, 3])
+    assert_array_equal(seq.records['id'], [1, 2, 3])
+    assert list(seq.records['name']) == ['a', 'b', 'c']
+
+
+@pytest.mark.parametrize('value', [0, 1, 127, 128, 300, 2**35])
+def test_encode_var_int(value):
+    """Test that encoded variable-length integers read back."""
+    assert read_var_int(BytesIO(encode_var_int(value))) == value
+
+
+@pytest.mark.parametrize('encode', [encode_ncstream_data, encode_ncstream_data2])
+@pytest.mark.parametrize('arr', [np.arange(24, dtype='>f4').reshape(2, 3, 4),
+                                 np.arange(10, dtype='<i8'),
+                                 np.arange(6, dtype=np.uint16).reshape(2, 3),
+                                 np.array([b'a', b'b', b'c'], dtype='S1')])
+def test_encode_roundtrip(encode, arr):
+    """Test that encoded arrays decode to the same values."""
+    out, = read_ncstream_messages(encode(arr, 'a'))
+    assert out.shape == arr.shape
+    assert_array_equal(out, arr)
+
+
+def test_encode_deflate():
+    """Test encoding compressed data."""
+    arr = np.zeros((100, 100), dtype='f8')
+    data = encode_ncstream_data(arr, 'a', deflate=6)
+    assert len(data) < arr.nbytes // 10
+    assert_array_equal(read_ncstream_messages(data)[0], arr)
+
+
+@pytest.mark.parametrize('encode', [encode_ncstream_data, encode_ncstream_data2])
+def test_encode_strings(encode):
+    """Test encoding string and opaque data."""
+    strings = np.array(['ab', 'cde', ''], dtype=object)
+    out, = read_ncstream_messages(encode(strings, 'a'))
+    assert list(out) == list(strings)
+
+    opaque = np.array([b'\x00\x01', b'\x02'], dtype=object)
+    out, = read_ncstream_messages(encode(opaque, 'a'))
+    assert list(out) == list(opaque)
+
+
+@pytest.mark.parametrize('encode', [encode_ncstream_data, encode_ncstream_data2])
+def test_encode_vlen(encode):
+    """Test encoding variable-length data."""
+    arr = np.empty(3, dtype=object)
+    arr[:] = [np.arange(2, dtype='>i4'), np.arange(3, dtype='>i4'), np.arange(1, dtype='>i4')]
+    out, = read_ncstream_messages(encode(arr, 'a'))
+    for item, expected in zip(out, arr):
+        assert_array_equal(item, expected)
+
+
+def test_encode_structure():
+    """Test encoding structure data, including strings, as NcStream v1."""
+    dt = struct_to_dtype(station_struct())
+    arr = np.empty(3, dtype=dt)
+    arr['id'] = [1, 2, 3]
+    arr['temp'] = [[1, 2], [3, 4], [5, 6]]
+    arr['name'] = ['a', 'b', 'c']
+    out, = iter_ncstream_messages(encode_ncstream_data(arr, 'obs'), dtypes={'obs': dt})
+    assert_array_equal(out['id'], arr['id'])
+    assert_array_equal(out['temp'], arr['temp'])
+    assert list(out['name']) == ['a', 'b', 'c']
+
+
+def test_encode_structure_datacol():
+    """Test encoding structure data as NcStream v2."""
+    arr = np.zeros(2, dtype=[('a', '>i4'), ('b', '<f8', 3)])
+    arr['a'] = [1, 2]
+    arr['b'] = [[1, 2, 3], [4, 5, 6]]
+    out, = read_ncstream_messages(encode_ncstream_data2(arr, 'obs'))
+    assert out.dtype.names == ('a', 'b')
+    assert_array_equal(out['a'], arr['a'])
+    assert_array_equal(out['b'], arr['b'])
+
+
+def test_datacol_structure_nested():
+    """Test decoding nested NcStream v2 structures, with strings, from the columns."""
+    dt = np.dtype([('id', '>i4'), ('name', object), ('pos', [('x', '<f4'), ('y', '<f4')], 2)])
+    arr = np.zeros(3, dtype=dt)
+    arr['id'] = [1, 2, 3]
+    arr['name'] = ['a', 'bc', '']
+    arr['pos']['x'] = np.arange(6).reshape(3, 2)
+    arr['pos']['y'] = -np.arange(6).reshape(3, 2)
+    out, = read_ncstream_messages(encode_ncstream_data2(arr, 'obs'))
+    assert out.dtype == dt
+    assert_array_equal(out['id'], arr['id'])
+    assert list(out['name']) == ['a', 'bc', '']
+    assert_array_equal(out['pos']['x'], arr['pos']['x'])
+    assert_array_equal(out['pos']['y'], arr['pos']['y'])
+
+
+def test_datacol_structure_dtype():
+    """Test decoding NcStream v2 structures using the dtype from the header."""
+    dt = struct_to_dtype(station_struct())
+    arr = np.zeros(2, dtype=[('id', '>i4'), ('temp', '>f4', 2), ('name', object)])
+    arr['id'] = [1, 2]
+    arr['temp'] = [[1, 2], [3, 4]]
+    arr['name'] = ['a', 'b']
+    out, = iter_ncstream_messages(encode_ncstream_data2(arr, 'obs'), dtypes={'obs': dt})
+    assert out.dtype == dt
+    assert_array_equal(out['temp'], arr['temp'])
+    assert list(out['name']) == ['a', 'b']
+
+
+def test_encode_sequence():
+    """Test encoding sequence data."""
+    dt = struct_to_dtype(station_struct())
+    records = np.zeros(3, dtype=dt)
+    records['id'] = [1, 2, 3]
+    records['name'] = ['a', 'b', 'c']
+    seq = SequenceData(records, np.array([0, 2, 3]))
+    out, = iter_ncstream_messages(encode_ncstream_data(seq, 'obs'), dtypes={'obs': dt})
+    assert_array_equal(out.offsets, seq.offsets)
+    assert_array_equal(out.records['id'], records['id'])
+    assert list(out.records['name']) == ['a', 'b', 'c']
+
+
+def test_encode_header_and_error():
+    """Test encoding header and error messages."""
+    header = Header(location='test', title='Test')
+    data = encode_header(header) + encode_ncstream_data(np.arange(3, dtype='f4'), 'a')
+    messages = read_ncstream_messages(data)
+    assert messages[0] == header
+    assert_array_equal(messages[1], np.arange(3))
+
+    with pytest.raises(RuntimeError) as exc:
+        read_ncstream_messages(encode_ncstream_err('bad request'))
+    assert 'bad request' in str(exc.value)
+
+
+def test_ncstream_file(tmpdir):
+    """Test indexing and lazily decoding messages from a stored file."""
+    dt = struct_to_dtype(station_struct())
+    records = np.zeros(2, dtype=dt)
+    records['id'] = [1, 2]
+    records['name'] = ['a', 'b']
+    path = tmpdir.join('test.ncs')
+    path.write_binary(encode_header(Header(title='Test'))
+                      + encode_ncstream_data(np.arange(10, dtype='f4'), 'a')
+                      + encode_ncstream_data(np.array(['x', 'y'], dtype=object), 's')
+                      + encode_ncstream_data(SequenceData(records, np.array([0, 1, 2])), 'obs')
+                      + encode_ncstream_data(np.arange(5, dtype='i2'), 'a', deflate=1))
+
+    with NcStreamFile(str(path), dtypes={'obs': dt}) as ncs:
+        assert len(ncs) == 5
+        assert [info.name for info in ncs.index] == [None, 'a', 's', 'obs', 'a']
+        assert ncs[0].title == 'Test'
+
+        first, second = ncs.find('a')
+        assert_array_equal(first, np.arange(10))
+        assert not first.flags.writeable
+        assert_array_equal(second, np.arange(5))
+        assert list(ncs[2]) == ['x', 'y']
+        assert_array_equal(ncs[3].records['id'], [1, 2])
+        assert len(list(ncs)) == 5
+        del first, second
+
+
+def test_ncstream_file_empty(tmpdir):
+    """Test opening an empty stored file."""
+    path = tmpdir.join('empty.ncs')
+    path.write_binary(b'')
+    with NcStreamFile(str(path)) as ncs:
+        assert not len(ncs)
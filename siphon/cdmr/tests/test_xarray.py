@@ -3,7 +3,11 @@
 # SPDX-License-Identifier: BSD-3-Clause
 """Test interaction with xarray library."""
 
-from numpy.testing import assert_almost_equal
+import threading
+import time
+
+from numpy.testing import assert_almost_equal, assert_array_equal
+import pytest
 from xarray import open_dataset
 
 from siphon.cdmr.xarray_support import CDMRemoteStore
@@ -21,3 +25,73 @@ def test_xarray_dataset():
     assert 'Temperature_isobaric' in ds
     subset = ds['Temperature_isobaric'][0, 0] * 1  # Doing math forces data request
     assert_almost_equal(subset[0, 0].values, 206.65640259, 6)
+
+
+def test_xarray_outer_indexing(fake_cdmr):
+    """Test that lists of indices are requested as a few slices in a single request."""
+    _, fake, data = fake_cdmr
+    ds = open_dataset(CDMRemoteStore('http://localhost:8080/thredds/cdmremote/fake'))
+    subset = ds['temp'].isel(time=1, x=[5, 0, 1, 2, 2], y=slice(1, 4)).values
+    assert_array_equal(subset, data[1, 1:4][:, [5, 0, 1, 2, 2]])
+    assert len(fake.requests) == 1
+
+
+def test_xarray_parallel_compute(fake_cdmr):
+    """Test that chunks are read concurrently when computing with dask threads."""
+    _, fake, data = fake_cdmr
+    dask = pytest.importorskip('dask')
+    lock = threading.Lock()
+    counts = {'in_flight': 0, 'max': 0}
+    fetch = fake.fetch_data_items
+
+    def fetch_data_items(items):
+        with lock:
+            counts['in_flight'] += 1
+            counts['max'] = max(counts['max'], counts['in_flight'])
+        time.sleep(0.05)
+        with lock:
+            counts['in_flight'] -= 1
+        return fetch(items)
+
+    fake.fetch_data_items = fetch_data_items
+    ds = open_dataset(CDMRemoteStore('http://localhost:8080/thredds/cdmremote/fake'),
+                      chunks={'time': 1})
+    with dask.config.set(scheduler='threads', num_workers=4):
+        assert_array_equal(ds['temp'].values, data)
+    assert len(fake.requests) == 4
+    assert counts['max'] > 1
+
+
+def test_xarray_backend_entrypoint(fake_cdmr):
+    """Test opening a dataset using the xarray backend engine."""
+    _, _, data = fake_cdmr
+    xarray_backends = pytest.importorskip('xarray.backends')
+    if not hasattr(xarray_backends, 'BackendEntrypoint'):
+        pytest.skip('xarray does not support backend entrypoints')
+    from siphon.cdmr.xarray_support import CDMRemoteBackendEntrypoint
+
+    url = 'http://localhost:8080/thredds/cdmremote/fake'
+    assert CDMRemoteBackendEntrypoint().guess_can_open(url)
+    ds = open_dataset(url, engine=CDMRemoteBackendEntrypoint)
+    assert ds['temp'].encoding['preferred_chunks'] == {'time': 4, 'y': 5, 'x': 6}
+    assert_array_equal(ds['rh'][2, :, [0, 3]].values, (data[2] / 120.)[:, [0, 3]])
+
+    pytest.importorskip('dask')
+    chunked = open_dataset(url, engine=CDMRemoteBackendEntrypoint, chunks={})
+    assert chunked['temp'].chunks == ((4,), (5,), (6,))
+    assert_array_equal(chunked['temp'][:, 0].values, data[:, 0])
+
+
+def test_xarray_close(fake_cdmr):
+    """Test that closing the xarray dataset closes the CDMRemote connection."""
+    _, fake, _ = fake_cdmr
+    xarray_backends = pytest.importorskip('xarray.backends')
+    if not hasattr(xarray_backends, 'BackendEntrypoint'):
+        pytest.skip('xarray does not support backend entrypoints')
+    from siphon.cdmr.xarray_support import CDMRemoteBackendEntrypoint
+
+    ds = open_dataset('http://localhost:8080/thredds/cdmremote/fake',
+                      engine=CDMRemoteBackendEntrypoint)
+    assert not fake.closed
+    ds.close()
+    assert fake.closed
@@ -6,42 +6,51 @@
 from xarray import Variable
 from xarray.backends.common import AbstractDataStore, BackendArray
 from xarray.core import indexing
-from xarray.core.utils import FrozenOrderedDict
+try:
+    from xarray.core.utils import FrozenDict
+except ImportError:  # Older xarray
+    from xarray.core.utils import FrozenOrderedDict as FrozenDict
 
 from . import Dataset
+from .dataset import block_shape
 
 
 class CDMArrayWrapper(BackendArray):
-    """Wrap a CDMRemote variable for access by xarray."""
+    """Wrap a CDMRemote variable for access by xarray.
+
+    Orthogonal (outer) indexing is supported, since that is how
+    :class:`siphon.cdmr.dataset.Variable` handles arrays of indices.
+    """
 
     def __init__(self, variable_name, datastore):
         """Initialize the wrapper."""
         self.datastore = datastore
         self.variable_name = variable_name
-
-        array = self.get_array()
-        self.shape = array.shape
-        self.dtype = array.dtype
+        self._array = datastore.ds.variables[variable_name]
+        self.shape = self._array.shape
+        self.dtype = self._array.dtype
 
     def get_array(self):
         """Get the actual array data from CDM Remote."""
-        return self.datastore.ds.variables[self.variable_name]
+        return self._array
 
-    def __getitem__(self, item):
+    def __getitem__(self, key):
         """Wrap getitem around the data."""
-        item, np_inds = indexing.decompose_indexer(item, self.shape,
-                                                   indexing.IndexingSupport.BASIC)
-        with self.datastore:
-            array = self.get_array()[item.tuple]
+        return indexing.explicit_indexing_adapter(key, self.shape,
+                                                  indexing.IndexingSupport.OUTER,
+                                                  self._getitem)
 
-        if len(np_inds.tuple) > 0:
-            array = indexing.NumpyIndexingAdapter(array)[np_inds]
-
-        return array
+    def _getitem(self, key):
+        """Read data for a tuple of integers, slices, and arrays of integers."""
+        return self.get_array()[key]
 
 
 class CDMRemoteStore(AbstractDataStore):
-    """Manage a store for accessing CDMRemote datasets with Siphon."""
+    """Manage a store for accessing CDMRemote datasets with Siphon.
+
+    Reads are not serialized: each thread makes requests with its own HTTP session, so
+    chunks of dask-backed variables are read concurrently when computing with threads.
+    """
 
     def __init__(self, url, deflate=None):
         """Initialize the data store."""
@@ -52,17 +61,59 @@ class CDMRemoteStore(AbstractDataStore):
     def open_store_variable(self, name, var):
         """Turn CDMRemote variable into something like a numpy.ndarray."""
         data = indexing.LazilyOuterIndexedArray(CDMArrayWrapper(name, self))
-        return Variable(var.dimensions, data, {a: getattr(var, a) for a in var.ncattrs()})
+        encoding = {}
+        if var.ndim and var.dtype.kind != 'O':
+            chunks = block_shape(var.shape, var.dtype.itemsize, 32 * 1024 * 1024)
+            encoding['preferred_chunks'] = dict(zip(var.dimensions, chunks))
+        return Variable(var.dimensions, data, {a: getattr(var, a) for a in var.ncattrs()},
+                        encoding)
 
     def get_variables(self):
         """Get the variables from underlying data set."""
-        return FrozenOrderedDict((k, self.open_store_variable(k, v))
-                                 for k, v in self.ds.variables.items())
+        return FrozenDict((k, self.open_store_variable(k, v))
+                          for k, v in self.ds.variables.items())
 
     def get_attrs(self):
         """Get the global attributes from underlying data set."""
-        return FrozenOrderedDict((a, getattr(self.ds, a)) for a in self.ds.ncattrs())
+        return FrozenDict((a, getattr(self.ds, a)) for a in self.ds.ncattrs())
 
     def get_dimensions(self):
         """Get the dimensions from underlying data set."""
-        return FrozenOrderedDict((k, len(v)) for k, v in self.ds.dimensions.items())
+        return FrozenDict((k, len(v)) for k, v in self.ds.dimensions.items())
+
+    def close(self):
+        """Release the threads and HTTP sessions used by the underlying data set."""
+        self.ds.close()
+
+
+try:
+    from xarray.backends import BackendEntrypoint
+    from xarray.backends.store import StoreBackendEntrypoint
+
+    class CDMRemoteBackendEntrypoint(BackendEntrypoint):
+        """Open CDMRemote datasets with :func:`xarray.open_dataset`.
+
+        Registered as ``engine='siphon_cdmremote'``. Pass ``chunks`` to
+        :func:`xarray.open_dataset` to get dask arrays, which by default follow
+        blocks that keep the inner dimensions whole.
+        """
+
+        description = 'Open datasets on a THREDDS Data Server using CDMRemote'
+        url = 'https://unidata.github.io/siphon'
+
+        def open_dataset(self, filename_or_obj, mask_and_scale=True, decode_times=True,
+                         concat_characters=True, decode_coords=True, drop_variables=None,
+                         use_cftime=None, decode_timedelta=None, deflate=None):
+            """Open a CDMRemote URL as an :class:`xarray.Dataset`."""
+            store = CDMRemoteStore(filename_or_obj, deflate=deflate)
+            return StoreBackendEntrypoint().open_dataset(
+                store, mask_and_scale=mask_and_scale, decode_times=decode_times,
+                concat_characters=concat_characters, decode_coords=decode_coords,
+                drop_variables=drop_variables, use_cftime=use_cftime,
+                decode_timedelta=decode_timedelta)
+
+        def guess_can_open(self, filename_or_obj):
+            """Guess whether the URL points to a CDMRemote endpoint."""
+            return isinstance(filename_or_obj, str) and '/cdmremote/' in filename_or_obj
+except ImportError:
+    pass
@@ -378,7 +378,7 @@ class HTTPEndPoint(object):
         self._session = session_manager.create_session()
         self._get_metadata()
 
-    def get_query(self, query):
+    def get_query(self, query, **kwargs):
         """Make a GET request, including a query, to the endpoint.
 
         The path of the request is to the base URL assigned to the endpoint.
@@ -387,6 +387,8 @@ class HTTPEndPoint(object):
         ----------
         query : DataQuery
             The query to pass when making the request
+        kwargs : arbitrary keyword arguments
+            Additional keyword arguments to pass to :meth:`requests.Session.get`.
 
         Returns
         -------
@@ -399,7 +401,7 @@ class HTTPEndPoint(object):
 
         """
         url = self._base[:-1] if self._base[-1] == '/' else self._base
-        return self.get(url, query)
+        return self.get(url, query, **kwargs)
 
     def url_path(self, path):
         """Assemble the full url to a path.
@@ -448,7 +450,7 @@ class HTTPEndPoint(object):
         """
         return self.get(self.url_path(path), query)
 
-    def get(self, path, params=None):
+    def get(self, path, params=None, **kwargs):
         """Make a GET request, optionally including a parameters, to a path.
 
         The path of the request is the full URL.
@@ -459,6 +461,8 @@ class HTTPEndPoint(object):
             The URL to request
         params : DataQuery, optional
             The query to pass when making the request
+        kwargs : arbitrary keyword arguments
+            Additional keyword arguments to pass to :meth:`requests.Session.get`.
 
         Returns
         -------
@@ -468,15 +472,18 @@ class HTTPEndPoint(object):
         Raises
         ------
         HTTPError
-            If the server returns anything other than a 200 (OK) code
+            If the server returns anything other than a 200 (OK) code, or a 304 (Not
+            Modified) code for a conditional request
 
         See Also
         --------
         get_query, get
 
         """
-        resp = self._session.get(path, params=params)
-        if resp.status_code != 200:
+        resp = self._session.get(path, params=params, **kwargs)
+        headers = kwargs.get('headers') or {}
+        conditional = 'If-None-Match' in headers or 'If-Modified-Since' in headers
+        if resp.status_code != 200 and not (conditional and resp.status_code == 304):
             if resp.headers.get('Content-Type', '').startswith('text/html'):
                 text = resp.reason
             else:
@@ -7,14 +7,20 @@ This includes forming proper queries as well as parsing the returned data.
 """
 
 import atexit
+from collections import namedtuple, OrderedDict
+from copy import deepcopy
+from datetime import datetime, timedelta
 from io import BytesIO
 from os import remove
 import platform
+import sys
+import threading
+import time
 import xml.etree.ElementTree as ET
 
 import numpy as np
 
-from .http_util import DataQuery, HTTPEndPoint, parse_iso_date
+from .http_util import DataQuery, HTTPEndPoint, parse_iso_date, utc
 from .ncss_dataset import NCSSDataset
 
 
@@ -45,19 +51,60 @@ class NCSS(HTTPEndPoint):
         takes a list of string values and unit str (can be :data:`None`), and returns the
         desired representation of values. Defaults to ignoring units and returning
         :func:`numpy.array`.
+    result_cache : NCSSResultCache or None
+        Cache used to answer queries from previously fetched results. When set, requests
+        that are subsets (in variables or time range) of earlier requests are satisfied
+        locally, with only the missing pieces fetched from the server. Defaults to
+        :data:`None`, which disables caching.
+    metadata_ttl : float
+        Number of seconds for which the metadata for a URL, once fetched, is shared with
+        other instances for the same URL. Defaults to 600. Setting to 0 disables sharing.
+
+    Notes
+    -----
+    The metadata is not requested from the server until it is first needed, so creating
+    an instance does not involve any requests.
 
     """
 
+    result_cache = None
+    metadata_ttl = 600
+
     # Need staticmethod to keep this from becoming a bound method, where self
     # is passed implicitly
     unit_handler = staticmethod(default_unit_handler)
 
     def _get_metadata(self):
+        # Metadata is requested when first used rather than here
+        self._metadata = None
+        self._variables = None
+
+    def _fetch_metadata(self):
         # Need to use .content here to avoid decode problems
         meta_xml = self.get_path('dataset.xml').content
         root = ET.fromstring(meta_xml)
-        self.metadata = NCSSDataset(root)
-        self.variables = set(self.metadata.variables)
+        return NCSSDataset(root)
+
+    @property
+    def metadata(self):
+        """Get the parsed dataset.xml for the endpoint, requesting it if needed."""
+        if self._metadata is None:
+            key = (type(self).__name__, self._base)
+            self._metadata = _metadata_cache.get(key, self._fetch_metadata,
+                                                 self.metadata_ttl)
+        return self._metadata
+
+    @property
+    def variables(self):
+        """Get the names of all variables available in this dataset."""
+        if self._variables is None:
+            self._variables = set(self.metadata.variables)
+        return self._variables
+
+    @staticmethod
+    def clear_metadata_cache():
+        """Remove all metadata shared between instances."""
+        _metadata_cache.clear()
 
     def query(self):
         """Return a new query for NCSS.
@@ -111,6 +158,8 @@ class NCSS(HTTPEndPoint):
         get_data_raw
 
         """
+        if self.result_cache is not None:
+            return self.result_cache.get_data(self, query)
         resp = self.get_query(query)
         return response_handlers(resp, self.unit_handler)
 
@@ -137,6 +186,195 @@ class NCSS(HTTPEndPoint):
         """
         return self.get_query(query).content
 
+    def get_data_arrow(self, query):
+        """Fetch point data from NCSS as Apache Arrow tables.
+
+        The CSV or XML response is parsed directly into Arrow columns, without
+        intermediate Python lists or dictionaries of arrays, so the result can be
+        converted to pandas (:meth:`pyarrow.Table.to_pandas`) or written to Parquet
+        without further copies of the numeric data. Units are stored in the metadata of
+        each field (under ``units``) rather than being processed by :attr:`unit_handler`.
+        Requires :mod:`pyarrow`.
+
+        Parameters
+        ----------
+        query : NCSSQuery
+            The parameters to send to the NCSS endpoint. The response format must be
+            CSV or XML.
+
+        Returns
+        -------
+        table : pyarrow.Table or list[pyarrow.Table]
+            The data returned. If the response contains several sets of columns (e.g.
+            variables on different vertical levels), a list of tables is returned.
+
+        See Also
+        --------
+        get_data, write_parquet
+
+        """
+        resp = self.get_query(query)
+        tables = _arrow_tables(resp.content, _mimetype(resp))
+        if not tables:
+            raise ValueError('Response contains no data.')
+        return squish(tables)
+
+    def write_parquet(self, query, where, block_size=1 << 22, **kwargs):
+        """Fetch point data from NCSS and write them to a Parquet file.
+
+        CSV responses are streamed from the server and written one block at a time, so
+        that large requests, such as many stations over a long time range, do not need
+        to be held in memory. Blocks of CSV for different stations must all have the
+        same columns. Requires :mod:`pyarrow`.
+
+        Parameters
+        ----------
+        query : NCSSQuery
+            The parameters to send to the NCSS endpoint. The response format must be
+            CSV or XML; XML responses are parsed in full before being written.
+        where : str or file-like object
+            The path or file to write to
+        block_size : int, optional
+            The number of bytes of CSV to parse into each block of rows.
+            Defaults to 4 MiB.
+        kwargs : arbitrary keyword arguments
+            Additional keyword arguments to pass to :class:`pyarrow.parquet.ParquetWriter`
+
+        Returns
+        -------
+        rows : int
+            The number of rows written
+
+        See Also
+        --------
+        get_data_arrow
+
+        """
+        import pyarrow.parquet as pq
+
+        resp = self.get_query(query, stream=True)
+        try:
+            mimetype = _mimetype(resp)
+            if mimetype == 'text/plain':
+                resp.raw.decode_content = True
+                schema, batches = _csv_arrow_batches(resp.raw, block_size)
+            else:
+                table = _arrow_tables(resp.content, mimetype)
+                if not table:
+                    raise ValueError('Response contains no data.')
+                elif len(table) != 1:
+                    raise ValueError('Response contains more than one set of columns.')
+                schema = table[0].schema
+                batches = table[0].to_batches()
+
+            rows = 0
+            with pq.ParquetWriter(where, schema, **kwargs) as writer:
+                for batch in batches:
+                    writer.write_batch(batch)
+                    rows += batch.num_rows
+            return rows
+        finally:
+            resp.close()
+
+    def plan_points(self, points, query, request_cost=100000):
+        """Plan the requests needed to fetch data at many points.
+
+        Estimates, using the axis information in :attr:`metadata`, the cost of
+        requesting each point separately versus requesting a grid that covers a group
+        of points and sampling it locally, and picks the cheapest combination. Points are
+        recursively split into groups, so a plan can mix grid and point requests.
+
+        Parameters
+        ----------
+        points : sequence of (float, float)
+            The longitude and latitude of each point
+        query : NCSSQuery
+            The variables, times, and other parameters to request. Any spatial query
+            is ignored.
+        request_cost : float, optional
+            The cost of making a request, expressed as the equivalent number of
+            bytes of transfer. Defaults to 100000.
+
+        Returns
+        -------
+        plan : list[PointsPlanStep]
+            The requests to make, each covering some of the points
+
+        See Also
+        --------
+        get_points
+
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        planner = _PointsPlanner(self.metadata, query, request_cost)
+        return planner.plan(points)
+
+    def get_points(self, points, query, max_workers=4, request_cost=100000):
+        """Fetch data at many points using the cheapest combination of requests.
+
+        The requests, as determined by :meth:`plan_points`, are made in parallel. Grid
+        requests are sampled at the grid point closest to each requested point. Either
+        way, the data are returned as columns with one row per point, time, and
+        vertical level (in that order).
+
+        Parameters
+        ----------
+        points : sequence of (float, float)
+            The longitude and latitude of each point
+        query : NCSSQuery
+            The variables, times, and other parameters to request. Any spatial query
+            is ignored. The format for point requests is taken from the query if set
+            (``'csv'`` or ``'xml'``), otherwise CSV is used.
+        max_workers : int, optional
+            Maximum number of requests to make at once. Defaults to 4.
+        request_cost : float, optional
+            The cost of making a request, expressed as the equivalent number of
+            bytes of transfer. Defaults to 100000.
+
+        Returns
+        -------
+        data : dict[str, object]
+            Columns of data, processed by :attr:`unit_handler`. Includes a ``point``
+            column with the index of the requested point for each row, as well as
+            ``lat`` and ``lon`` with the requested location.
+
+        See Also
+        --------
+        plan_points
+
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        # Keep the original values for making requests
+        locations = list(points)
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        planner = _PointsPlanner(self.metadata, query, request_cost)
+        plan = planner.plan(points)
+
+        tasks = []
+        for step in plan:
+            if step.kind == 'grid':
+                tasks.append((step.kind, step.points, planner.grid_query(step.box)))
+            else:
+                tasks.extend((step.kind, [ind], planner.point_query(*locations[ind]))
+                             for ind in step.points)
+
+        def fetch(task):
+            kind, inds, sub = task
+            result = response_handlers(self.get_query(sub), _raw_column)
+            if kind == 'grid':
+                return planner.sample_grid(result, points[inds])
+            return [_point_columns(result)]
+
+        by_point = [None] * len(points)
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for (_, inds, _), results in zip(tasks, pool.map(fetch, tasks)):
+                for ind, cols in zip(inds, results):
+                    by_point[ind] = cols
+
+        return _combine_point_columns(by_point, points, self.unit_handler,
+                                      planner.variables)
+
 
 class NCSSQuery(DataQuery):
     """Represent a query to the NetCDF Subset Service (NCSS).
@@ -264,6 +502,242 @@ class NCSSQuery(DataQuery):
         return self.add_query_parameter(vertCoord=level)
 
 
+class NCSSResultCache(object):
+    """Cache parsed NCSS results and answer new queries from them where possible.
+
+    Results are stored as fragments, each holding some variables over a range of times,
+    and keyed by the rest of the query (endpoint, spatial query, and any other
+    parameters). When a new query asks for variables and times that are already held,
+    it is answered without contacting the server. Otherwise, only the missing time slices
+    and variables are requested and the pieces are combined locally.
+
+    Time slicing is only done for queries made using :meth:`NCSSQuery.time_range`. Other
+    time queries become part of the key, so only variables are reused for those. Only
+    tabular returns (CSV and XML) that parse to a single collection of columns are stored;
+    anything else is passed through unchanged. Requests for ``'all'`` variables bypass
+    the cache.
+
+    A single cache instance can be shared by many :class:`NCSS` instances, and used from
+    several threads at once; threads asking for the same missing data at the same time
+    may each request it.
+
+    Each piece of a response is stored as soon as it is received, so if a later request
+    for the same query fails, trying the query again only requests what is still
+    missing. If a piece cannot be stored (e.g. it contains several collections of
+    columns), or the stored pieces do not line up in time, the whole query is requested
+    again and its result returned without being stored.
+
+    Attributes
+    ----------
+    max_bytes : int
+        Upper bound on the memory used by stored results. Least recently used fragments
+        are evicted to stay below this.
+    nbytes : int
+        Approximate number of bytes currently used by stored results
+
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        """Create an empty cache.
+
+        Parameters
+        ----------
+        max_bytes : int, optional
+            Upper bound on memory used by the cache, in bytes. Defaults to 64 MiB.
+
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._fragments = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Return the number of stored fragments."""
+        with self._lock:
+            return len(self._fragments)
+
+    def clear(self):
+        """Remove all stored results."""
+        with self._lock:
+            self._fragments.clear()
+            self.nbytes = 0
+
+    def get_data(self, ncss, query):
+        """Fetch parsed data for `query`, using stored results where possible.
+
+        Parameters
+        ----------
+        ncss : NCSS
+            The endpoint to request missing data from
+        query : NCSSQuery
+            The parameters of the request
+
+        Returns
+        -------
+        Parsed data response, in the same form as :meth:`NCSS.get_data`.
+
+        """
+        key, start, end = self._split_query(ncss, query)
+        if key is None:
+            return response_handlers(ncss.get_query(query), ncss.unit_handler)
+
+        variables = set(query.var)
+        with self._lock:
+            fragments = [frag for frag in self._fragments if frag.key == key]
+        missing = self._missing(fragments, start, end, variables)
+        for seg_start, seg_end, seg_vars in missing:
+            sub = deepcopy(query)
+            sub.var = set(seg_vars)
+            if start is not None:
+                sub.time_range(seg_start, seg_end)
+            result = response_handlers(ncss.get_query(sub), _raw_column)
+            frag = _Fragment.from_result(key, seg_vars, seg_start, seg_end, result)
+            if frag is None:
+                # Not something we can piece together, so hand back what we got if
+                # it answers the whole query.
+                if len(missing) == 1 and seg_vars == variables:
+                    return _finish_result(result, ncss.unit_handler)
+                break
+            fragments.append(frag)
+            self._store(frag)
+
+        ret = self._assemble(fragments, start, end, variables, ncss.unit_handler)
+        if ret is None:
+            return response_handlers(ncss.get_query(query), ncss.unit_handler)
+        return ret
+
+    @staticmethod
+    def _split_query(ncss, query):
+        """Separate a query into a cache key and a time range (if sliceable)."""
+        if not query.var or 'all' in query.var:
+            return None, None, None
+
+        time_query = dict(query.time_query)
+        start = end = None
+        if 'time_start' in time_query and 'time_end' in time_query:
+            start = _parse_query_time(time_query.pop('time_start'))
+            end = _parse_query_time(time_query.pop('time_end'))
+        key = (ncss.url_path(''), _freeze(time_query), _freeze(query.spatial_query),
+               _freeze(query.extra_params))
+        return key, start, end
+
+    @staticmethod
+    def _segments(fragments, start, end):
+        """Split the requested time range at the edges of the stored fragments."""
+        if start is None:
+            return [(None, None)]
+
+        bounds = {start, end}
+        for frag in fragments:
+            if frag.start <= end and frag.end >= start:
+                bounds.add(max(frag.start, start))
+                bounds.add(min(frag.end, end))
+        bounds = sorted(bounds)
+        if len(bounds) == 1:
+            return [(start, end)]
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    @staticmethod
+    def _owners(fragments, seg_start, seg_end, variables):
+        """Find a stored fragment holding each variable over a time segment."""
+        owners = {}
+        for frag in fragments:
+            if frag.covers(seg_start, seg_end):
+                for var in frag.variables & variables:
+                    owners.setdefault(var, frag)
+        return owners
+
+    def _missing(self, fragments, start, end, variables):
+        """Determine the requests needed to fill in what is not stored."""
+        missing = []
+        for seg_start, seg_end in self._segments(fragments, start, end):
+            need = variables - set(self._owners(fragments, seg_start, seg_end, variables))
+            if not need:
+                continue
+
+            # Merge with the previous request if it is adjacent and for the same variables
+            if missing and missing[-1][1] == seg_start and missing[-1][2] == need:
+                missing[-1] = (missing[-1][0], seg_end, need)
+            else:
+                missing.append((seg_start, seg_end, need))
+        return missing
+
+    def _assemble(self, fragments, start, end, variables, unit_handler):
+        """Combine stored fragments into the result for a query."""
+        pieces = OrderedDict()
+        for ind, (seg_start, seg_end) in enumerate(self._segments(fragments, start, end)):
+            owners = self._owners(fragments, seg_start, seg_end, variables)
+            if set(owners) != variables:
+                return None
+
+            # Coordinate columns (date, lat, lon, etc.) come from the first fragment
+            var_names = sorted(variables)
+            base = owners[var_names[0]]
+            base_rows = base.rows(seg_start, seg_end, ind == 0)
+            seg_cols = [(name, col.values[base_rows]) for name, col in base.columns.items()
+                        if name not in base.variables]
+            for var in var_names:
+                frag = owners[var]
+                rows = frag.rows(seg_start, seg_end, ind == 0)
+
+                # Make sure rows line up between the pieces we're combining
+                if frag is not base and (frag.times is None or base.times is None
+                                         or not np.array_equal(frag.times[rows],
+                                                               base.times[base_rows])):
+                    return None
+                if var not in frag.columns:
+                    return None
+                seg_cols.append((var, frag.columns[var].values[rows]))
+
+            for name, values in seg_cols:
+                pieces.setdefault(name, []).append(values)
+
+        # Mark what we used as recently used
+        with self._lock:
+            for frag in fragments:
+                if frag in self._fragments:
+                    self._fragments[frag] = self._fragments.pop(frag)
+
+        ret = {}
+        for name, values in pieces.items():
+            col = next(frag.columns[name] for frag in fragments if name in frag.columns)
+            values = values[0] if len(values) == 1 else np.concatenate(values)
+            ret[name] = _finish_column(col._replace(values=values), unit_handler)
+        return ret
+
+    def _store(self, frag):
+        """Add a fragment to the cache, evicting old ones as necessary."""
+        if frag.nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            self._fragments[frag] = None
+            self.nbytes += frag.nbytes
+            while self.nbytes > self.max_bytes:
+                old, _ = self._fragments.popitem(last=False)
+                self.nbytes -= old.nbytes
+
+
+class PointsPlanStep(namedtuple('PointsPlanStep', 'kind points box cost')):
+    """Represent one step in a plan for fetching data at many points.
+
+    Attributes
+    ----------
+    kind : str
+        ``'grid'`` for a single grid request sampled at all of `points`, or ``'points'``
+        for a separate point request for each of `points`
+    points : list[int]
+        Indices of the points covered by this step
+    box : tuple[float] or None
+        For grid requests, the (west, east, south, north) bounds of the request
+    cost : float
+        The estimated cost of the step, in equivalent bytes of transfer
+
+    """
+
+    __slots__ = ()
+
+
 #
 # The remainder of the file is not considered part of the public API.
 # Use at your own risk!
@@ -283,6 +757,10 @@ class ResponseRegistry(object):
             return func
         return dec
 
+    def __contains__(self, mimetype):
+        """Return whether a function is registered for a mimetype."""
+        return mimetype in self._reg
+
     @staticmethod
     def default(content, units):  # pylint:disable=unused-argument
         """Handle a mimetype when no function is registered."""
@@ -297,6 +775,39 @@ class ResponseRegistry(object):
 response_handlers = ResponseRegistry()
 
 
+class _MetadataCache(object):
+    """Share parsed metadata between NCSS instances for the same endpoint."""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, fetch, ttl):
+        """Get the metadata for an endpoint, calling `fetch` if none is stored."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] < ttl:
+                return entry[1]
+
+        # Fetch outside the lock so that requests for other URLs are not held up
+        metadata = fetch()
+        if ttl > 0:
+            with self._lock:
+                self._entries = {key: value for key, value in self._entries.items()
+                                 if now - value[0] < ttl}
+                self._entries[key] = (now, metadata)
+        return metadata
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            self._entries.clear()
+
+
+_metadata_cache = _MetadataCache()
+
+
 def squish(l):
     """If list contains only 1 element, return it instead."""
     return l if len(l) > 1 else l[0]
@@ -310,6 +821,617 @@ def combine_dicts(l):
     return ret
 
 
+# Support for NCSSResultCache
+_Column = namedtuple('_Column', 'values units handled')
+
+
+def _raw_column(data, units=None):
+    """Keep values and units, as a unit handler, for later handling by the cache."""
+    return _Column(np.asarray(data), units, True)
+
+
+def _finish_column(col, unit_handler):
+    """Convert a cached column into what the normal parsing would have returned."""
+    if not isinstance(col, _Column):
+        return col
+    values = col.values.tolist() if col.values.dtype == object else col.values
+    if col.handled:
+        return unit_handler(values, col.units)
+    return col.values.tolist()
+
+
+def _finish_result(result, unit_handler):
+    """Finish all columns in a result parsed using `_raw_column`."""
+    if isinstance(result, dict):
+        return {k: _finish_column(v, unit_handler) for k, v in result.items()}
+    elif isinstance(result, list):
+        return [_finish_result(item, unit_handler) for item in result]
+    return result
+
+
+def _freeze(params):
+    """Turn a dictionary of query parameters into something hashable."""
+    return tuple(sorted((k, str(v)) for k, v in params.items()))
+
+
+def _parse_query_time(s):
+    """Parse an ISO-formatted time from a query into a naive UTC datetime."""
+    s = s.rstrip('Z')
+    offset = timedelta(0)
+    if len(s) > 19 and s[-6] in '+-':
+        offset = timedelta(hours=int(s[-5:-3]), minutes=int(s[-2:]))
+        if s[-6] == '-':
+            offset = -offset
+        s = s[:-6]
+    fmt = '%Y-%m-%dT%H:%M:%S.%f' if '.' in s else '%Y-%m-%dT%H:%M:%S'
+    return datetime.strptime(s, fmt) - offset
+
+
+def _column_nbytes(values):
+    """Estimate the memory used by an array of values."""
+    nbytes = values.nbytes
+    if values.dtype == object:
+        nbytes += sum(sys.getsizeof(v) for v in values.flat)
+    return nbytes
+
+
+class _Fragment(object):
+    """Hold a piece of parsed NCSS results for some variables over a time range."""
+
+    def __init__(self, key, variables, start, end, columns, times):
+        self.key = key
+        self.variables = set(variables)
+        self.start = start
+        self.end = end
+        self.columns = columns
+        self.times = times
+        self.nbytes = sum(_column_nbytes(col.values) for col in columns.values())
+
+    @classmethod
+    def from_result(cls, key, variables, start, end, result):
+        """Create a fragment from a result, if it is something we can work with."""
+        if not isinstance(result, dict):
+            return None
+
+        columns = OrderedDict()
+        for name, value in result.items():
+            if not isinstance(value, _Column):
+                value = _Column(np.asarray(value), None, False)
+            columns[name] = value
+
+        times = None
+        if 'date' in columns:
+            try:
+                times = np.array([d.replace(tzinfo=None) for d in columns['date'].values],
+                                 dtype='datetime64[us]')
+            except (AttributeError, TypeError, ValueError):
+                pass
+
+        # Need times to be able to slice
+        if start is not None and times is None:
+            return None
+
+        return cls(key, variables, start, end, columns, times)
+
+    def covers(self, start, end):
+        """Return whether this fragment holds all times between `start` and `end`."""
+        return self.start is None or (self.start <= start and self.end >= end)
+
+    def rows(self, start, end, include_start):
+        """Select the rows that fall within the time segment."""
+        if start is None or self.times is None:
+            return slice(None)
+        start = np.datetime64(start, 'us')
+        lower = self.times >= start if include_start else self.times > start
+        return lower & (self.times <= np.datetime64(end, 'us'))
+
+
+# Support for planning requests for many points
+_time_unit_seconds = {'second': 1, 'sec': 1, 'minute': 60, 'min': 60, 'hour': 3600,
+                      'hr': 3600, 'day': 86400}
+
+
+def _decode_times(values, units):
+    """Convert times given as "<unit> since <date>" into naive UTC datetimes."""
+    try:
+        unit, since = units.split(' since ')
+        scale = _time_unit_seconds[unit.strip().lower().rstrip('s')]
+        base = _parse_query_time(since.strip())
+    except (AttributeError, KeyError, ValueError):
+        return None
+    return [base + timedelta(seconds=float(v) * scale) for v in values]
+
+
+def _axis_values(axis):
+    """Get the values of an axis from the parsed dataset.xml as an array."""
+    for attr in axis.get('attributes', []):
+        if 'values' in attr:
+            return np.asarray(attr['values'], dtype=np.float64)
+    return np.arange(axis.get('shape', [1])[0], dtype=np.float64)
+
+
+def _axis_attribute(axis, name):
+    """Get the value of an attribute of an axis from the parsed dataset.xml."""
+    for attr in axis.get('attributes', []):
+        if name in attr:
+            return attr[name]
+    return None
+
+
+class _PointsPlanner(object):
+    """Estimate costs and form requests for fetching data at many points."""
+
+    # Rough number of bytes taken by a value when written out as text
+    text_value_bytes = {'csv': 12, 'xml': 60}
+
+    # Rough number of bytes of header and coordinates in a netCDF grid return
+    grid_overhead = 16384
+
+    # Limit on how many times the points are split into groups
+    max_depth = 8
+
+    def __init__(self, metadata, query, request_cost):
+        self.query = query
+        self.request_cost = request_cost
+        self.accept = query.extra_params.get('accept', 'csv')
+        self.variables = sorted(query.var)
+
+        info = getattr(metadata, 'variables', {})
+        if not self.variables or 'all' in query.var:
+            raise ValueError('Query must list the variables to request.')
+        unknown = [var for var in self.variables if var not in info]
+        if unknown:
+            raise ValueError('Unknown variables: {}'.format(', '.join(unknown)))
+        shapes = {info[var].get('shape') for var in self.variables}
+        if len(shapes) != 1:
+            raise ValueError('All variables must have the same coordinates.')
+
+        self.itemsize = max(np.dtype(_ncss_types.get(info[var].get('type'), 'f4')).itemsize
+                            for var in self.variables)
+        self.lat = self.lon = None
+        self.ntimes = self.nlevels = 1
+        self.roles = {}
+        axes = getattr(metadata, 'axes', {})
+        for name in (shapes.pop() or '').split():
+            axis = axes.get(name, {})
+            role = axis.get('axisType')
+            self.roles[name] = role
+            if role == 'Lat':
+                self.lat = _axis_values(axis)
+            elif role == 'Lon':
+                self.lon = _axis_values(axis)
+            elif role == 'Time':
+                self.ntimes = self._count_times(axis)
+            elif role not in ('GeoX', 'GeoY') and 'vertCoord' not in query.extra_params:
+                self.nlevels = len(_axis_values(axis))
+
+        accept_list = getattr(metadata, 'accept_list', {})
+        self.grid_ok = (self.lat is not None and self.lon is not None
+                        and 'netcdf' in accept_list.get('Grid', [])
+                        and 'application/x-netcdf' in response_handlers)
+
+    def _count_times(self, axis):
+        """Estimate the number of times the query returns."""
+        time_query = self.query.time_query
+        values = _axis_values(axis)
+        if 'temporal' in time_query:
+            return len(values)
+        elif 'time_start' in time_query and 'time_end' in time_query:
+            times = _decode_times(values, _axis_attribute(axis, 'units'))
+            if times is None:
+                return len(values)
+            start = _parse_query_time(time_query['time_start'])
+            end = _parse_query_time(time_query['time_end'])
+            return max(1, sum(start <= t <= end for t in times))
+        return 1
+
+    @staticmethod
+    def _spacing(values):
+        """Find the typical spacing between grid points."""
+        return float(np.median(np.abs(np.diff(values)))) if len(values) > 1 else 0.
+
+    def box(self, points):
+        """Get a bounding box, padded by a grid point, around the points."""
+        dlon = self._spacing(self.lon)
+        dlat = self._spacing(self.lat)
+        west, south = points.min(axis=0)
+        east, north = points.max(axis=0)
+        return (float(west - dlon), float(east + dlon), float(south - dlat),
+                float(north + dlat))
+
+    def point_cost(self, count):
+        """Estimate the cost of requesting points one at a time."""
+        row_bytes = self.text_value_bytes.get(self.accept, 12) * (4 + len(self.variables))
+        return count * (self.request_cost + self.ntimes * self.nlevels * row_bytes)
+
+    def grid_cost(self, box):
+        """Estimate the cost of requesting the grid within a box."""
+        west, east, south, north = box
+        nlon = np.count_nonzero((self.lon - west) % 360 <= east - west)
+        nlat = np.count_nonzero((self.lat >= south) & (self.lat <= north))
+        return self.request_cost + self.grid_overhead + (nlon * nlat * self.ntimes
+                                                         * self.nlevels
+                                                         * len(self.variables)
+                                                         * self.itemsize)
+
+    def plan(self, points):
+        """Plan requests to cover all of the points."""
+        _, steps = self._plan(points, np.arange(len(points)), 0)
+
+        # Gather up all of the individual point requests into a single step
+        point_steps = [step for step in steps if step.kind == 'points']
+        steps = [step for step in steps if step.kind == 'grid']
+        if point_steps:
+            steps.append(PointsPlanStep('points',
+                                        sorted(sum((s.points for s in point_steps), [])),
+                                        None, sum(s.cost for s in point_steps)))
+        return steps
+
+    def _plan(self, points, inds, depth):
+        """Find the cheapest way to request a group of points."""
+        best_cost = self.point_cost(len(inds))
+        best = [PointsPlanStep('points', inds.tolist(), None, best_cost)]
+        if not len(inds):
+            return best_cost, []
+
+        if self.grid_ok:
+            box = self.box(points[inds])
+            cost = self.grid_cost(box)
+            if cost < best_cost:
+                best_cost = cost
+                best = [PointsPlanStep('grid', sorted(inds.tolist()), box, cost)]
+
+        # Try splitting the points at the largest gap along the direction they're most
+        # spread out, which separates clusters from each other and from outliers
+        if len(inds) > 1 and depth < self.max_depth:
+            group = points[inds]
+            spread = group.max(axis=0) - group.min(axis=0)
+            axis = int(np.argmax(spread))
+            if spread[axis] > 0:
+                order = np.argsort(group[:, axis], kind='mergesort')
+                split = int(np.argmax(np.diff(group[order, axis]))) + 1
+                left_cost, left = self._plan(points, inds[order[:split]], depth + 1)
+                right_cost, right = self._plan(points, inds[order[split:]], depth + 1)
+                if left_cost + right_cost < best_cost:
+                    return left_cost + right_cost, left + right
+
+        return best_cost, best
+
+    def grid_query(self, box):
+        """Create the query for a grid request covering a box."""
+        query = deepcopy(self.query)
+        query.lonlat_box(*box)
+        query.add_query_parameter(accept='netcdf')
+        return query
+
+    def point_query(self, lon, lat):
+        """Create the query for a single point."""
+        query = deepcopy(self.query)
+        query.lonlat_point(lon, lat)
+        query.add_query_parameter(accept=self.accept)
+        return query
+
+    def sample_grid(self, ds, points):
+        """Pull out the columns of data at each point from a grid request.
+
+        The dataset is closed once the data have been read.
+        """
+        try:
+            return self._sample_grid(ds, points)
+        finally:
+            close = getattr(ds, 'close', None)
+            if close is not None:
+                close()
+
+    def _sample_grid(self, ds, points):
+        """Read the columns of data at each point from an open grid return."""
+        if not hasattr(ds, 'variables'):
+            raise ValueError('Grid request did not return netCDF data.')
+
+        dims = ds.variables[self.variables[0]].dimensions
+        roles = {}
+        for dim in dims:
+            role = self.roles.get(dim)
+            if role is None and dim in ds.variables:
+                role = getattr(ds.variables[dim], '_CoordinateAxisType', None)
+            roles[dim] = role
+
+        def find(wanted):
+            found = [dim for dim in dims if wanted(roles[dim])]
+            return found[0] if found else None
+
+        lat_dim = find(lambda r: r == 'Lat')
+        lon_dim = find(lambda r: r == 'Lon')
+        time_dim = find(lambda r: r == 'Time')
+        vert_dim = find(lambda r: r not in ('Lat', 'Lon', 'Time'))
+        if lat_dim is None or lon_dim is None:
+            raise ValueError('Could not find latitude and longitude in grid return.')
+        order = [dim for dim in (time_dim, vert_dim, lat_dim, lon_dim) if dim is not None]
+        if len(order) != len(dims):
+            raise ValueError('Unexpected dimensions {} in grid return.'.format(dims))
+
+        lat = np.asarray(ds.variables[lat_dim][:], dtype=np.float64)
+        lon = np.asarray(ds.variables[lon_dim][:], dtype=np.float64)
+        ntimes = len(ds.dimensions[time_dim]) if time_dim else 1
+        nlevels = len(ds.dimensions[vert_dim]) if vert_dim else 1
+
+        common = OrderedDict()
+        if time_dim:
+            time_var = ds.variables[time_dim]
+            times = _decode_times(time_var[:], getattr(time_var, 'units', None))
+            if times is not None:
+                dates = np.empty(ntimes, dtype=object)
+                dates[:] = [t.replace(tzinfo=utc) for t in times]
+                common['date'] = _Column(np.repeat(dates, nlevels), None, True)
+        if vert_dim:
+            vert_var = ds.variables[vert_dim]
+            common['vertCoord'] = _Column(np.tile(np.asarray(vert_var[:]), ntimes),
+                                          getattr(vert_var, 'units', None), True)
+
+        data = []
+        for name in self.variables:
+            var = ds.variables[name]
+            values = var[:]
+            if np.ma.isMaskedArray(values):
+                values = (values.filled(np.nan) if values.dtype.kind == 'f'
+                          else values.data)
+            values = np.transpose(values, [dims.index(dim) for dim in order])
+            data.append((name, values.reshape(ntimes, nlevels, len(lat), len(lon)),
+                         getattr(var, 'units', None)))
+
+        ret = []
+        for lon_pt, lat_pt in points:
+            j = np.argmin(np.abs(lat - lat_pt))
+            k = np.argmin(np.abs((lon - lon_pt + 180) % 360 - 180))
+            cols = OrderedDict(common)
+            for name, values, units in data:
+                cols[name] = _Column(values[:, :, j, k].ravel(), units, True)
+            ret.append(cols)
+        return ret
+
+
+# Map types in dataset.xml to numpy types
+_ncss_types = {'byte': 'i1', 'short': 'i2', 'int': 'i4', 'long': 'i8', 'float': 'f4',
+               'double': 'f8'}
+
+
+def _point_columns(result):
+    """Get the columns from a parsed point request, without the location."""
+    if not isinstance(result, dict):
+        raise ValueError('Point request did not return a single set of columns.')
+
+    cols = OrderedDict()
+    for name, value in result.items():
+        if name in ('lat', 'lon'):
+            continue
+        if not isinstance(value, _Column):
+            value = _Column(np.asarray(value), None, True)
+        cols[name] = value
+    return cols
+
+
+def _combine_point_columns(by_point, points, unit_handler, required=()):
+    """Combine the columns for each point into a single set of columns.
+
+    Point and grid requests can return different sets of columns (e.g. a station
+    column only from point requests), so any column missing for a point is filled with
+    missing values. Columns in `required` must be present for every point.
+    """
+    names = ['point', 'lat', 'lon']
+    units = {}
+    examples = {}
+    for ind, cols in enumerate(by_point):
+        for name, col in cols.items():
+            if name not in units:
+                names.append(name)
+                units[name] = col.units
+                examples[name] = ind
+
+    pieces = {name: [] for name in names}
+    for ind, cols in enumerate(by_point):
+        missing = [name for name in required if name not in cols]
+        if missing:
+            if missing[0] in examples:
+                raise ValueError('Returns for points {} and {} do not have the same '
+                                 'columns; point {} is missing {}.'.format(
+                                     examples[missing[0]], ind, ind, ', '.join(missing)))
+            raise ValueError('Return for point {} is missing {}.'.format(
+                ind, ', '.join(missing)))
+        nrows = len(next(iter(cols.values())).values) if cols else 0
+        pieces['point'].append(np.full(nrows, ind, dtype=np.intp))
+        pieces['lon'].append(np.full(nrows, points[ind, 0]))
+        pieces['lat'].append(np.full(nrows, points[ind, 1]))
+        for name in names[3:]:
+            col = cols.get(name)
+            pieces[name].append(col.values if col is not None
+                                else _missing_values(by_point[examples[name]][name].values,
+                                                     nrows))
+
+    return {name: _finish_column(_Column(np.concatenate(pieces[name]), units.get(name),
+                                         True), unit_handler)
+            for name in names}
+
+
+def _missing_values(example, count):
+    """Create missing values to stand in for a column like `example`."""
+    if example.dtype.kind in 'fc':
+        return np.full(count, np.nan, dtype=example.dtype)
+    elif example.dtype.kind in 'iub':
+        return np.full(count, np.nan)
+    return np.full(count, None, dtype=object)
+
+
+# Conversion of point returns from NCSS to Apache Arrow
+def _mimetype(resp):
+    """Get the mimetype of a response, without any parameters."""
+    return resp.headers['content-type'].split(';')[0]
+
+
+def _arrow_field(name, units, dtype):
+    """Create an Arrow field, with units (if any) in its metadata."""
+    import pyarrow as pa
+    return pa.field(name, dtype, metadata={'units': units} if units else None)
+
+
+def _arrow_tables(data, mimetype):
+    """Parse the CSV or XML content of a point response into Arrow tables."""
+    if mimetype == 'text/plain':
+        return [_csv_arrow_table(d) for d in data.split(b'\n\n') if d.strip()]
+    elif mimetype == 'application/xml':
+        return _xml_arrow_tables(ET.fromstring(data))
+    raise ValueError('Arrow output requires CSV or XML data, not {}.'.format(mimetype))
+
+
+def _csv_arrow_options(block_size=None):
+    """Create the options for parsing NCSS CSV with Arrow."""
+    import pyarrow as pa
+    from pyarrow import csv
+
+    return {'read_options': csv.ReadOptions(block_size=block_size),
+            'convert_options': csv.ConvertOptions(
+                column_types={'date': pa.timestamp('s', tz='UTC')})}
+
+
+def _csv_arrow_schema(schema):
+    """Split the units out of the column names in CSV from NCSS."""
+    import pyarrow as pa
+
+    names, units = parse_csv_header(','.join(schema.names))
+    return pa.schema([_arrow_field(name, units.get(name), field.type)
+                      for name, field in zip(names, schema)])
+
+
+def _csv_arrow_table(data):
+    """Parse a single CSV dataset from NCSS into an Arrow table."""
+    import pyarrow as pa
+    from pyarrow import csv
+
+    table = csv.read_csv(pa.BufferReader(data), **_csv_arrow_options())
+    return pa.Table.from_arrays(table.columns, schema=_csv_arrow_schema(table.schema))
+
+
+def _csv_arrow_batches(fobj, block_size):
+    """Incrementally parse CSV from NCSS into Arrow record batches.
+
+    Returns the schema and an iterator over the batches. NCSS separates datasets (e.g.
+    stations) with blank lines, each with its own header line; every block is parsed
+    using a new reader, and must have the same columns as the first, which also sets the
+    type of each column.
+    """
+    import pyarrow as pa
+    from pyarrow import csv
+
+    blocks = _CSVBlocks(fobj)
+    if not blocks.next_block():
+        raise ValueError('Response contains no data.')
+    reader = csv.open_csv(blocks, **_csv_arrow_options(block_size))
+    raw_schema = reader.schema
+    schema = _csv_arrow_schema(raw_schema)
+
+    def batches(reader):
+        while True:
+            for batch in reader:
+                yield pa.RecordBatch.from_arrays(batch.columns, schema=schema)
+            if not blocks.next_block():
+                return
+
+            # Parse later blocks with the types found in the first
+            options = _csv_arrow_options(block_size)
+            options['convert_options'].column_types = dict(zip(raw_schema.names,
+                                                               raw_schema.types))
+            reader = csv.open_csv(blocks, **options)
+            if reader.schema.names != raw_schema.names:
+                raise ValueError('Response contains more than one set of columns.')
+
+    return schema, batches(reader)
+
+
+class _CSVBlocks(object):
+    """Present one blank line-separated block of a CSV stream at a time as a file."""
+
+    chunk_size = 1 << 16
+    closed = False
+
+    def __init__(self, fobj):
+        """Wrap the stream."""
+        self._fobj = fobj
+        self._buf = b''
+        self._eof = False
+        self._block_done = False
+
+    def readable(self):
+        """Return whether the stream can be read."""
+        return True
+
+    def _fill(self, size):
+        """Add more of the stream to the buffer."""
+        chunk = self._fobj.read(size)
+        self._buf += chunk
+        self._eof = not chunk
+
+    def read(self, size=-1):
+        """Read up to `size` bytes, stopping at the end of the current block."""
+        if self._block_done:
+            return b''
+
+        # Make sure the separator is seen if it could fall within the requested bytes
+        sep = self._buf.find(b'\n\n')
+        while sep < 0 and not self._eof and (size < 0 or len(self._buf) <= size):
+            self._fill(max(size, self.chunk_size))
+            sep = self._buf.find(b'\n\n')
+
+        end = sep + 1 if sep >= 0 else len(self._buf)
+        if 0 <= size < end:
+            end = size
+        out, self._buf = self._buf[:end], self._buf[end:]
+        if sep >= 0 and end == sep + 1:
+            self._block_done = True
+        elif self._eof and not self._buf:
+            self._block_done = True
+        return out
+
+    def next_block(self):
+        """Move to the next block, returning whether there is one."""
+        self._block_done = False
+        while not self._buf.strip(b'\n') and not self._eof:
+            self._fill(self.chunk_size)
+        self._buf = self._buf.lstrip(b'\n')
+        if not self._buf:
+            self._block_done = True
+        return not self._block_done
+
+
+def _xml_arrow_tables(elem):
+    """Parse XML point data from NCSS into Arrow tables."""
+    import pyarrow as pa
+
+    parsed = [parse_xml_point(p) for p in elem.findall('point')]
+    if not parsed:
+        return []
+    points, units = zip(*parsed)
+    all_units = combine_dicts(units)
+
+    # Group points by the contents of each point
+    datasets = OrderedDict()
+    for p in points:
+        datasets.setdefault(tuple(p), []).append(p)
+
+    tables = []
+    for names, group in datasets.items():
+        fields = []
+        cols = []
+        for name in names:
+            if name == 'date':
+                dtype = pa.timestamp('s', tz='UTC')
+                col = pa.array([p[name] for p in group], type=dtype)
+            else:
+                col = pa.array(np.array([p[name] for p in group], dtype=np.float64))
+            fields.append(_arrow_field(name, all_units.get(name), col.type))
+            cols.append(col)
+        tables.append(pa.Table.from_arrays(cols, schema=pa.schema(fields)))
+    return tables
+
+
 # Parsing of XML returns from NCSS
 @response_handlers.register('application/xml')
 def parse_xml(data, handle_units):
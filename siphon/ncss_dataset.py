@@ -6,7 +6,7 @@
 from __future__ import print_function
 
 import logging
-import re
+import threading
 
 import numpy as np
 
@@ -21,13 +21,20 @@ def _without_namespace(tagname):
     return tagname
 
 
+# Numpy types used when converting numeric typed values
+_numeric_types = {'byte': np.int64, 'short': np.int64, 'int': np.int64, 'long': np.int64,
+                  'float': np.float64, 'double': np.float64}
+
+
 class _Types(object):
     @staticmethod
-    def handle_typed_values(val, type_name, value_type):
+    def handle_typed_values(val, type_name, value_type, as_array=False):
         """Translate typed values into the appropriate python object.
 
         Takes an element name, value, and type and returns a list
         with the string value(s) properly converted to a python type.
+        Numeric values are converted all at once by numpy, and can be
+        returned as an array instead of a list.
 
         TypedValues are handled in ucar.ma2.DataType in netcdfJava
         in the DataType enum. Possibilities are:
@@ -68,22 +75,25 @@ class _Types(object):
         value_type : string
             The string representation of the type attribute of the xml element
 
+        as_array : bool, optional
+            Whether to return numeric values as a :class:`numpy.ndarray`. Defaults
+            to False.
+
         Returns
         -------
-        val : list
-            A list containing the properly typed python values.
+        val : list or numpy.ndarray
+            A list containing the properly typed python values, or an array for
+            numeric values if `as_array` is True.
 
         """
-        if value_type in ['byte', 'short', 'int', 'long']:
+        if value_type in _numeric_types:
             try:
-                val = [int(v) for v in re.split('[ ,]', val) if v]
+                val = np.array(val.replace(',', ' ').split(), dtype=_numeric_types[value_type])
+                if not as_array:
+                    val = val.tolist()
             except ValueError:
-                log.warning('Cannot convert "%s" to int. Keeping type as str.', val)
-        elif value_type in ['float', 'double']:
-            try:
-                val = [float(v) for v in re.split('[ ,]', val) if v]
-            except ValueError:
-                log.warning('Cannot convert "%s" to float. Keeping type as str.', val)
+                log.warning('Cannot convert "%s" to %s. Keeping type as str.', val,
+                            'float' if value_type in ('float', 'double') else 'int')
         elif value_type == 'boolean':
             try:
                 # special case for boolean type
@@ -108,7 +118,7 @@ class _Types(object):
             log.warning('%s type %s not understood. Keeping as String.',
                         type_name, value_type)
 
-        if not isinstance(val, list):
+        if not isinstance(val, (list, np.ndarray)):
             val = [val]
 
         return val
@@ -130,8 +140,10 @@ class _Types(object):
         type_name = 'value'
         val = element.text
         if val:
-            if value_type:
-                val = self.handle_typed_values(val, type_name, value_type)
+            # Only numeric values are converted; others are split into strings, as for
+            # values with no type
+            if value_type in _numeric_types:
+                val = self.handle_typed_values(val, type_name, value_type, as_array=True)
             else:
                 val = val.split()
         else:
@@ -142,9 +154,8 @@ class _Types(object):
             if increment_attrs == element_attrs:
                 start = float(element.attrib['start'])
                 inc = float(element.attrib['increment'])
-                npts = float(element.attrib['npts'])
+                npts = int(float(element.attrib['npts']))
                 val = start + np.arange(npts) * inc
-                val = val.tolist()
 
         return {'values': val}
 
@@ -215,6 +226,9 @@ class NCSSDataset(object):
     Note that only gridded ncss datasets may contain the attributes
     `gridsets`, `axes`, `coordinate_transforms`, and `lat_lon_box`.
 
+    Each section of the document is only parsed when the corresponding
+    attribute is first accessed.
+
     Attributes
     ----------
     variables : dict[str, str]
@@ -236,7 +250,8 @@ class NCSSDataset(object):
         A dictionary of gridSets contained within the dataset
 
     axes : dict[str, object]
-        A dictionary of coordinate axes
+        A dictionary of coordinate axes. Numeric coordinate values are given as
+        :class:`numpy.ndarray`
 
     coordinate_transforms : dict[str, object]
         A dictionary of coordinate transforms
@@ -258,37 +273,73 @@ class NCSSDataset(object):
 
         """
         self._types = _Types()
+        self._values = {'gridsets': {}, 'variables': {}, 'axes': {},
+                        'coordinate_transforms': {}, 'accept_list': {},
+                        'lat_lon_box': None, 'time_span': None, 'featureDataset': None}
 
-        self.gridsets = {}
-        self.variables = {}
-        self.axes = {}
-        self.coordinate_transforms = {}
-        self.accept_list = {}
-
-        self.lat_lon_box = None
-        self.time_span = None
-        self.featureDataset = None
+        # Sort the elements by tag so that each section can be parsed when first used
+        self._elements = {}
+        self._parsed = set()
+        self._lock = threading.RLock()
 
         element_name = element.tag
 
         if element_name == 'gridDataset' or element_name == 'capabilities':
 
-            self.featureDataset = {'type': 'grid',
-                                   'url': element.attrib['location']}
-            for child in element:
-                self._parse_element(child)
+            self._values['featureDataset'] = {'type': 'grid',
+                                              'url': element.attrib['location']}
+            children = list(element)
 
         else:
-            self._parse_element(element)
+            children = [element]
+
+        for child in children:
+            if child.tag in self._parsers:
+                self._elements.setdefault(child.tag, []).append(child)
+            else:
+                log.warning('No parser found for element %s', child.tag)
+
+    # The elements that need to be parsed to fill in each attribute
+    _sections = {'gridsets': ('gridSet',), 'variables': ('gridSet', 'variable'),
+                 'axes': ('axis',), 'coordinate_transforms': ('coordTransform',),
+                 'lat_lon_box': ('LatLonBox',), 'time_span': ('TimeSpan',),
+                 'accept_list': ('AcceptList',), 'featureDataset': ('featureDataset',)}
 
-        things_to_del = []
-        for thing in self.__dict__:
-            if not (thing.startswith('_') or thing.startswith('__')):
-                if not getattr(self, thing):
-                    things_to_del.append(thing)
+    _parsers = {'gridSet': '_parse_gridset', 'axis': '_parse_axis',
+                'coordTransform': '_parse_coordTransform', 'LatLonBox': '_parse_LatLonBox',
+                'TimeSpan': '_parse_TimeSpan', 'AcceptList': '_parse_AcceptList',
+                'featureDataset': '_parse_featureDataset', 'variable': '_parse_variable'}
 
-        for thing in things_to_del:
-            delattr(self, thing)
+    def __getattr__(self, name):
+        """Parse the section of the document needed for an attribute on first access.
+
+        Attributes for which the document has no information are not present.
+        """
+        if name.startswith('_') or name not in self._sections:
+            raise AttributeError(name)
+
+        for tag in self._sections[name]:
+            self._load(tag)
+
+        value = self._values[name]
+        if not value:
+            raise AttributeError(name)
+
+        # Store so that future access skips this
+        setattr(self, name, value)
+        return value
+
+    def _load(self, tag):
+        """Parse all elements with a given tag, if not already done.
+
+        Instances are shared between threads by the metadata cache, so parsing is
+        done holding a lock, and a tag is only marked once its elements are parsed.
+        """
+        with self._lock:
+            if tag not in self._parsed:
+                for element in self._elements.get(tag, []):
+                    self._parse_element(element)
+                self._parsed.add(tag)
 
     def _get_handler(self, handler_name):
         return self._types.lookup(handler_name)
@@ -296,15 +347,8 @@ class NCSSDataset(object):
     def _parse_element(self, element):
         element_name = element.tag
 
-        parser = {'gridSet': self._parse_gridset, 'axis': self._parse_axis,
-                  'coordTransform': self._parse_coordTransform,
-                  'LatLonBox': self._parse_LatLonBox, 'TimeSpan': self._parse_TimeSpan,
-                  'AcceptList': self._parse_AcceptList,
-                  'featureDataset': self._parse_featureDataset,
-                  'variable': self._parse_variable}
-
         try:
-            parser[element_name](element)
+            getattr(self, self._parsers[element_name])(element)
         except KeyError:
             log.warning('No parser found for element %s', element_name)
 
@@ -324,12 +368,12 @@ class NCSSDataset(object):
                 grid_name = tmp['name']
                 tmp.pop('name', None)
                 grid_set.setdefault(child_name, {})[grid_name] = tmp
-                self.variables[grid_name] = tmp
+                self._values['variables'][grid_name] = tmp
             else:
                 log.warning('Unknown child in %s: %s', element_name, child_name)
                 grid_set[child.tag] = 'not handled by _parse_gridset'
 
-        self.gridsets.update({gridset_name: grid_set})
+        self._values['gridsets'].update({gridset_name: grid_set})
 
     def _parse_axis(self, element):
         # element_name = element.tag
@@ -346,12 +390,16 @@ class NCSSDataset(object):
         for child in element:
             child_name = child.tag
             handler = self._get_handler(child_name)
-            attrs.append(handler(child))
+            if child_name == 'values':
+                # Convert values using the axis type so numeric ones end up as an array
+                attrs.append(handler(child, value_type=axis.get('type')))
+            else:
+                attrs.append(handler(child))
 
         if attrs:
             axis['attributes'] = attrs
 
-        self.axes.update({axis_name: axis})
+        self._values['axes'].update({axis_name: axis})
 
     def _parse_coordTransform(self, element):  # noqa
         coord_trans = {}
@@ -369,20 +417,20 @@ class NCSSDataset(object):
         if params:
             coord_trans['parameters'] = params
 
-        self.coordinate_transforms.update({name: coord_trans})
+        self._values['coordinate_transforms'].update({name: coord_trans})
 
     def _parse_LatLonBox(self, element):  # noqa
         llb = {}
         for child in element:
             llb[child.tag] = float(child.text)
-        self.lat_lon_box = llb
+        self._values['lat_lon_box'] = llb
 
     def _parse_TimeSpan(self, element):  # noqa
         ts = {}
         for child in element:
             ts[child.tag] = child.text
 
-        self.time_span = ts
+        self._values['time_span'] = ts
 
     def _parse_AcceptList(self, element):  # noqa
         grid_req_types = ['Grid', 'GridAsPoint']
@@ -403,24 +451,24 @@ class NCSSDataset(object):
             if point:
                 # this is a PointFeatureCollection ncss
                 return_type = child.text
-                self.accept_list.setdefault('PointFeatureCollection',
-                                            []).append(return_type)
+                self._values['accept_list'].setdefault('PointFeatureCollection',
+                                                       []).append(return_type)
             elif grid:
                 # this is a grid ncss
                 for grandchild in child:
                     return_type = grandchild.text
-                    self.accept_list.setdefault(request_type,
-                                                []).append(return_type)
+                    self._values['accept_list'].setdefault(request_type,
+                                                           []).append(return_type)
             else:
                 log.warning('Cannot have grid=%s and point=%s', grid, point)
 
     def _parse_featureDataset(self, element):  # noqa
         handler = self._get_handler(element.tag)
-        self.featureDataset = handler(element)
+        self._values['featureDataset'] = handler(element)
 
     def _parse_variable(self, element):
         handler = self._get_handler(element.tag)
         tmp = handler(element)
         name = tmp['name']
         tmp = tmp.pop('name', None)
-        self.variables[name] = tmp
+        self._values['variables'][name] = tmp
@@ -4,11 +4,16 @@
 """Test NCSS access code."""
 
 from contextlib import contextmanager
-from datetime import datetime
+from datetime import datetime, timedelta
+from io import BytesIO
 
 import numpy as np
+from numpy.testing import assert_array_equal
+import pytest
 
-from siphon.ncss import NCSS, NCSSQuery, ResponseRegistry
+from siphon.http_util import utc
+from siphon.ncss import (default_unit_handler, NCSS, NCSSQuery, NCSSResultCache,
+                         ResponseRegistry)
 import siphon.testing
 
 recorder = siphon.testing.get_recorder(__file__)
@@ -80,6 +85,7 @@ class TestNCSS(object):
         """Set up for tests with a default valid query."""
         dt = datetime(2015, 6, 12, 15, 0, 0)
         self.ncss = NCSS(self.server + self.urlPath)
+        assert self.ncss.variables  # Metadata is fetched lazily, so do it in the cassette
         self.nq = self.ncss.query().lonlat_point(-105, 40).time(dt)
         self.nq.variables('Temperature_isobaric', 'Relative_humidity_isobaric')
 
@@ -126,6 +132,50 @@ class TestNCSS(object):
         assert csv_data['lat'][0] == 40
         assert csv_data['lon'][0] == -105
 
+    @recorder.use_cassette('ncss_gfs_csv_point')
+    def test_arrow_csv_point(self):
+        """Test parsing CSV point returns into Arrow."""
+        pa = pytest.importorskip('pyarrow')
+        self.nq.accept('csv')
+        table = self.ncss.get_data_arrow(self.nq)
+
+        assert table.column('lat')[0].as_py() == 40
+        assert table.column('lon')[0].as_py() == -105
+        assert table.schema.field('date').type == pa.timestamp('s', tz='UTC')
+        field = table.schema.field('Temperature_isobaric')
+        assert field.type == pa.float64()
+        assert field.metadata[b'units'] == b'K'
+        df = table.to_pandas()
+        assert len(df) == 26
+        assert_array_equal(df['vertCoord'].values[:2], [1000., 2000.])
+        assert df['Temperature_isobaric'].values[0] == 233.5
+
+    @recorder.use_cassette('ncss_gfs_xml_point')
+    def test_arrow_xml_point(self):
+        """Test parsing XML point returns into Arrow."""
+        pa = pytest.importorskip('pyarrow')
+        self.nq.accept('xml')
+        table = self.ncss.get_data_arrow(self.nq)
+
+        assert table.column('lat')[0].as_py() == 40
+        assert table.column('lon')[0].as_py() == -105
+        assert table.column('date')[0].as_py() == datetime(2015, 6, 12, 15, tzinfo=utc)
+        assert table.schema.field('Relative_humidity_isobaric').metadata[b'units'] == b'%'
+        assert table.schema.field('Temperature_isobaric').type == pa.float64()
+
+    @recorder.use_cassette('ncss_gfs_csv_point')
+    def test_write_parquet(self, tmpdir):
+        """Test writing CSV point returns to Parquet in blocks."""
+        pq = pytest.importorskip('pyarrow.parquet')
+        self.nq.accept('csv')
+        path = str(tmpdir.join('points.parquet'))
+        rows = self.ncss.write_parquet(self.nq, path, block_size=1024)
+        table = pq.read_table(path)
+
+        assert rows == table.num_rows == 26
+        assert table.schema.field('Temperature_isobaric').metadata[b'units'] == b'K'
+        assert_array_equal(table.column('vertCoord').to_numpy()[:2], [1000., 2000.])
+
     @recorder.use_cassette('ncss_gfs_csv_point')
     def test_unit_handler_csv(self):
         """Test unit-handling from CSV returns."""
@@ -201,3 +251,397 @@ class TestNCSS(object):
         with response_context():
             csv_data = self.ncss.get_data(self.nq)
             assert csv_data.startswith(b'date,lat')
+
+
+@recorder.use_cassette('ncss_test_metadata')
+def test_result_cache_variable_subset():
+    """Test that a query for a subset of variables is answered from the cache."""
+    ncss = NCSS(TestNCSS.server + TestNCSS.urlPath)
+    ncss.result_cache = NCSSResultCache()
+    query = ncss.query().lonlat_point(-105, 40).time(datetime(2015, 6, 12, 15))
+    query.variables('Temperature_isobaric', 'Relative_humidity_isobaric').accept('xml')
+    with recorder.use_cassette('ncss_gfs_xml_point'):
+        full = ncss.get_data(query)
+
+    # The cassette is no longer active, so this fails if it hits the server
+    query.var = {'Temperature_isobaric'}
+    subset = ncss.get_data(query)
+    assert 'Relative_humidity_isobaric' not in subset
+    assert_array_equal(subset['Temperature_isobaric'], full['Temperature_isobaric'])
+    assert_array_equal(subset['vertCoord'], full['vertCoord'])
+    assert subset['date'] == full['date']
+
+
+class FakeResponse(object):
+    """Mimic the parts of :class:`requests.Response` used for parsing."""
+
+    def __init__(self, content, mimetype='application/xml'):
+        """Wrap content."""
+        self.headers = {'content-type': mimetype}
+        self.content = content
+
+
+class FakeNCSS(object):
+    """Stand in for an NCSS endpoint by generating hourly XML point data."""
+
+    unit_handler = staticmethod(default_unit_handler)
+
+    def __init__(self):
+        """Start with no queries made."""
+        self.queries = []
+
+    @staticmethod
+    def url_path(path):
+        """Return a fixed URL."""
+        return 'http://test/ncss/' + path
+
+    def get_query(self, query):
+        """Generate a response for the query."""
+        self.queries.append(query)
+        start = datetime.strptime(query.time_query['time_start'], '%Y-%m-%dT%H:%M:%S')
+        end = datetime.strptime(query.time_query['time_end'], '%Y-%m-%dT%H:%M:%S')
+        points = []
+        while start <= end:
+            data = ['<data name="date">{:%Y-%m-%dT%H:%M:%SZ}</data>'.format(start)]
+            data.extend('<data name="{0}" units="K">{1}</data>'.format(
+                        var, start.hour + len(var)) for var in sorted(query.var))
+            points.append('<point>{}</point>'.format(''.join(data)))
+            start += timedelta(hours=1)
+        return FakeResponse('<grid>{}</grid>'.format(''.join(points)).encode('utf-8'))
+
+
+def test_result_cache_time_slices():
+    """Test that only missing time slices and variables are requested."""
+    ncss = FakeNCSS()
+    cache = NCSSResultCache()
+    query = NCSSQuery().variables('a').lonlat_point(-105, 40)
+    query.time_range(datetime(2017, 1, 1, 6), datetime(2017, 1, 1, 12))
+    cache.get_data(ncss, query)
+
+    query = NCSSQuery().variables('a', 'bb').lonlat_point(-105, 40)
+    query.time_range(datetime(2017, 1, 1, 0), datetime(2017, 1, 1, 18))
+    data = cache.get_data(ncss, query)
+
+    assert len(ncss.queries) == 4
+    assert ncss.queries[1].var == {'a', 'bb'}
+    assert ncss.queries[2].var == {'bb'}
+    assert ncss.queries[2].time_query['time_start'] == '2017-01-01T06:00:00'
+    assert ncss.queries[2].time_query['time_end'] == '2017-01-01T12:00:00'
+    assert ncss.queries[3].var == {'a', 'bb'}
+    assert_array_equal(data['a'], np.arange(19) + 1)
+    assert_array_equal(data['bb'], np.arange(19) + 2)
+    assert len(data['date']) == 19
+
+    # Everything is now cached
+    query.time_range(datetime(2017, 1, 1, 3), datetime(2017, 1, 1, 9)).var = {'bb'}
+    data = cache.get_data(ncss, query)
+    assert len(ncss.queries) == 4
+    assert_array_equal(data['bb'], np.arange(3, 10) + 2)
+    assert 'a' not in data
+
+
+def test_result_cache_retry():
+    """Test that retrying after a failed request only requests what is still missing."""
+    ncss = FakeNCSS()
+    cache = NCSSResultCache()
+    query = NCSSQuery().variables('a').lonlat_point(-105, 40)
+    query.time_range(datetime(2017, 1, 1, 6), datetime(2017, 1, 1, 12))
+    cache.get_data(ncss, query)
+
+    get_query = ncss.get_query
+
+    def fail_second(query):
+        if len(ncss.queries) == 2:
+            ncss.queries.append(query)
+            raise IOError('Connection lost')
+        return get_query(query)
+
+    ncss.get_query = fail_second
+    query = NCSSQuery().variables('a').lonlat_point(-105, 40)
+    query.time_range(datetime(2017, 1, 1, 0), datetime(2017, 1, 1, 18))
+    with pytest.raises(IOError):
+        cache.get_data(ncss, query)
+
+    data = cache.get_data(ncss, query)
+    assert len(ncss.queries) == 4
+    assert ncss.queries[3].time_query['time_start'] == '2017-01-01T12:00:00'
+    assert len(data['a']) == 19
+
+
+def test_result_cache_threads():
+    """Test using a cache from several threads at once."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    ncss = FakeNCSS()
+    cache = NCSSResultCache(max_bytes=2000)
+
+    def get(hour):
+        query = NCSSQuery().variables('a').lonlat_point(-105, 40)
+        query.time_range(datetime(2017, 1, 1, hour), datetime(2017, 1, 1, hour + 3))
+        return cache.get_data(ncss, query)
+
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(get, list(range(20)) * 4))
+    for hour, data in zip(list(range(20)) * 4, results):
+        assert_array_equal(data['a'], np.arange(hour, hour + 4) + 1)
+    assert cache.nbytes <= 2000
+
+
+def test_result_cache_eviction():
+    """Test that the cache stays within its size bound."""
+    ncss = FakeNCSS()
+    cache = NCSSResultCache(max_bytes=1000)
+    for day in range(1, 5):
+        query = NCSSQuery().variables('a')
+        query.time_range(datetime(2017, 1, day, 0), datetime(2017, 1, day, 12))
+        cache.get_data(ncss, query)
+        assert cache.nbytes <= 1000
+
+    assert len(cache) < 4
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.nbytes == 0
+
+
+@pytest.fixture
+def gfs_ncss():
+    """Create an NCSS instance with metadata from a GFS run."""
+    with recorder.use_cassette('ncss_test_metadata'):
+        ncss = NCSS(TestNCSS.server + TestNCSS.urlPath)
+        assert ncss.metadata
+        return ncss
+
+
+def gfs_points_query(ncss):
+    """Create a query for isobaric variables."""
+    query = ncss.query().time(datetime(2015, 6, 12, 15)).accept('xml')
+    return query.variables('Temperature_isobaric', 'Relative_humidity_isobaric')
+
+
+def test_plan_points_sparse(gfs_ncss):
+    """Test that widely separated points are requested individually."""
+    plan = gfs_ncss.plan_points([(-105, 40), (10, 50)], gfs_points_query(gfs_ncss))
+    assert len(plan) == 1
+    assert plan[0].kind == 'points'
+    assert plan[0].points == [0, 1]
+
+
+def test_plan_points_mixed(gfs_ncss):
+    """Test that a dense cluster uses a grid request while outliers use points."""
+    rng = np.random.RandomState(20170101)
+    points = np.column_stack([rng.uniform(-106, -104, 300), rng.uniform(39, 41, 300)])
+    points = np.vstack([points, [(10, 50), (100, -30)]])
+    plan = gfs_ncss.plan_points(points, gfs_points_query(gfs_ncss))
+
+    assert [step.kind for step in plan] == ['grid', 'points']
+    assert plan[0].points == list(range(300))
+    west, east, south, north = plan[0].box
+    assert west < -105.9 and east > -104.1 and south < 39.1 and north > 40.9
+    assert plan[1].points == [300, 301]
+
+
+def test_plan_points_bad_vars(gfs_ncss):
+    """Test that variables with different coordinates cannot be planned together."""
+    query = gfs_points_query(gfs_ncss).variables('Pressure_convective_cloud_bottom')
+    with pytest.raises(ValueError):
+        gfs_ncss.plan_points([(-105, 40)], query)
+
+
+@recorder.use_cassette('ncss_gfs_xml_point')
+def test_get_points_point_request(gfs_ncss):
+    """Test getting data with point requests."""
+    data = gfs_ncss.get_points([(-105, 40)], gfs_points_query(gfs_ncss))
+    assert_array_equal(data['point'], 0)
+    assert_array_equal(data['lat'], 40)
+    assert_array_equal(data['lon'], -105)
+    assert data['Temperature_isobaric'][0] == 233.5
+    assert data['vertCoord'][0] == 1000
+    assert len(data['date']) == len(data['Temperature_isobaric'])
+
+
+def gfs_grid_content(tmpdir):
+    """Create the content of a netCDF grid return around Boulder."""
+    from netCDF4 import Dataset
+
+    fname = str(tmpdir.join('grid.nc'))
+    with Dataset(fname, 'w') as nc:
+        for name, size in [('time2', 2), ('isobaric3', 3), ('lat', 4), ('lon', 5)]:
+            nc.createDimension(name, size)
+        nc.createVariable('time2', 'f8', ('time2',)).setncatts(
+            {'units': 'Hour since 2015-06-12T12:00:00Z'})
+        nc.variables['time2'][:] = [3, 6]
+        nc.createVariable('isobaric3', 'f4', ('isobaric3',)).setncatts({'units': 'Pa'})
+        nc.variables['isobaric3'][:] = [50000, 70000, 85000]
+        nc.createVariable('lat', 'f4', ('lat',))[:] = [41, 40.5, 40, 39.5]
+        nc.createVariable('lon', 'f4', ('lon',))[:] = [254, 254.5, 255, 255.5, 256]
+        for offset, name in enumerate(['Relative_humidity_isobaric',
+                                       'Temperature_isobaric']):
+            var = nc.createVariable(name, 'f4', ('time2', 'isobaric3', 'lat', 'lon'))
+            var.units = 'K'
+            var[:] = np.arange(2 * 3 * 4 * 5).reshape(2, 3, 4, 5) + 1000 * offset
+    with open(fname, 'rb') as fobj:
+        return fobj.read()
+
+
+def test_get_points_grid_request(gfs_ncss, tmpdir, monkeypatch):
+    """Test getting data by sampling a grid request."""
+    from siphon.ncss import _PointsPlanner
+
+    datasets = []
+    sample = _PointsPlanner._sample_grid
+    monkeypatch.setattr(_PointsPlanner, '_sample_grid',
+                        lambda self, ds, points: sample(self, datasets.append(ds) or ds,
+                                                        points))
+    content = gfs_grid_content(tmpdir)
+    queries = []
+
+    def get_query(query):
+        queries.append(query)
+        return FakeResponse(content, 'application/x-netcdf')
+
+    gfs_ncss.get_query = get_query
+    query = gfs_points_query(gfs_ncss)
+    data = gfs_ncss.get_points([(-105, 40), (-104.1, 40.9)], query, request_cost=1e7)
+
+    assert len(queries) == 1
+    assert queries[0].extra_params['accept'] == 'netcdf'
+    assert not datasets[0].isopen()
+    assert_array_equal(data['point'], [0] * 6 + [1] * 6)
+    assert_array_equal(data['lon'], [-105] * 6 + [-104.1] * 6)
+    assert_array_equal(data['vertCoord'], [50000, 70000, 85000] * 4)
+    assert data['date'][0] == datetime(2015, 6, 12, 15, tzinfo=utc)
+    assert data['date'][3] == datetime(2015, 6, 12, 18, tzinfo=utc)
+
+    # Point 0 is at lat index 2, lon index 2; point 1 at lat index 0, lon index 4
+    expected = np.arange(120).reshape(2, 3, 4, 5)
+    assert_array_equal(data['Relative_humidity_isobaric'][:6], expected[:, :, 2, 2].ravel())
+    assert_array_equal(data['Relative_humidity_isobaric'][6:], expected[:, :, 0, 4].ravel())
+    assert_array_equal(data['Temperature_isobaric'][6:], expected[:, :, 0, 4].ravel() + 1000)
+
+
+def test_get_points_mixed(gfs_ncss, tmpdir):
+    """Test combining returns from grid and point requests with different columns."""
+    content = gfs_grid_content(tmpdir)
+    point = ('<grid><point><data name="date">2015-06-12T15:00:00Z</data>'
+             '<data name="lat" units="degrees_north">50</data>'
+             '<data name="lon" units="degrees_east">10</data>'
+             '<data name="alt" units="m">12.5</data>'
+             '<data name="Relative_humidity_isobaric" units="%">50</data>'
+             '<data name="Temperature_isobaric" units="K">280</data>'
+             '</point></grid>').encode('utf-8')
+
+    def get_query(query):
+        if query.extra_params['accept'] == 'netcdf':
+            return FakeResponse(content, 'application/x-netcdf')
+        return FakeResponse(point)
+
+    gfs_ncss.get_query = get_query
+    query = gfs_points_query(gfs_ncss)
+    points = [(-105, 40), (-104.1, 40.9), (10, 50)]
+    plan = gfs_ncss.plan_points(points, query, request_cost=1e6)
+    assert [step.kind for step in plan] == ['grid', 'points']
+    data = gfs_ncss.get_points(points, query, request_cost=1e6)
+
+    assert_array_equal(data['point'], [0] * 6 + [1] * 6 + [2])
+    assert_array_equal(data['Temperature_isobaric'][-1], 280)
+    assert_array_equal(data['Temperature_isobaric'][6:12],
+                       np.arange(120).reshape(2, 3, 4, 5)[:, :, 0, 4].ravel() + 1000)
+    assert np.isnan(data['vertCoord'][-1])
+    assert np.isnan(data['alt'][:12]).all()
+    assert data['alt'][-1] == 12.5
+    assert data['date'][-1] == datetime(2015, 6, 12, 15, tzinfo=utc)
+
+
+def test_get_points_missing_variable(gfs_ncss):
+    """Test that a return missing a requested variable is an error naming the points."""
+    point = ('<grid><point><data name="date">2015-06-12T15:00:00Z</data>'
+             '<data name="Temperature_isobaric" units="K">280</data>'
+             '</point></grid>').encode('utf-8')
+    gfs_ncss.get_query = lambda query: FakeResponse(point)
+    with pytest.raises(ValueError) as exc:
+        gfs_ncss.get_points([(-105, 40)], gfs_points_query(gfs_ncss))
+    assert 'Relative_humidity_isobaric' in str(exc.value)
+
+
+def csv_stream_response(content):
+    """Make a fake streamed CSV response."""
+    resp = FakeResponse(content, 'text/plain')
+    resp.raw = BytesIO(content)
+    resp.close = lambda: None
+    return resp
+
+
+def test_write_parquet_multiple_blocks(gfs_ncss, tmpdir):
+    """Test writing CSV with several blank line-separated blocks to Parquet."""
+    pq = pytest.importorskip('pyarrow.parquet')
+    header = 'station,date,temp[unit="K"]\n'
+    content = (header + '1,2015-06-12T15:00:00Z,280.5\n1,2015-06-12T16:00:00Z,281\n\n'
+               + header + '2,2015-06-12T15:00:00Z,290\n').encode('utf-8')
+    gfs_ncss.get_query = lambda query, stream: csv_stream_response(content)
+    path = str(tmpdir.join('points.parquet'))
+    rows = gfs_ncss.write_parquet(gfs_ncss.query(), path, block_size=1024)
+    table = pq.read_table(path)
+
+    assert rows == table.num_rows == 3
+    assert table.schema.field('temp').metadata[b'units'] == b'K'
+    assert_array_equal(table.column('station').to_numpy(), [1, 1, 2])
+    assert_array_equal(table.column('temp').to_numpy(), [280.5, 281., 290.])
+
+
+def test_write_parquet_different_columns(gfs_ncss, tmpdir):
+    """Test that CSV blocks with different columns cannot be written to one file."""
+    pytest.importorskip('pyarrow.parquet')
+    content = b'station,temp\n1,280\n\nstation,rh\n2,50\n'
+    gfs_ncss.get_query = lambda query, stream: csv_stream_response(content)
+    with pytest.raises(ValueError):
+        gfs_ncss.write_parquet(gfs_ncss.query(), str(tmpdir.join('points.parquet')))
+
+
+@pytest.mark.parametrize('content', [b'', b'\n\n'])
+def test_write_parquet_empty_csv(gfs_ncss, tmpdir, content):
+    """Test that an empty CSV response is reported clearly."""
+    pytest.importorskip('pyarrow.parquet')
+    gfs_ncss.get_query = lambda query, stream: csv_stream_response(content)
+    with pytest.raises(ValueError) as exc:
+        gfs_ncss.write_parquet(gfs_ncss.query(), str(tmpdir.join('points.parquet')))
+    assert 'no data' in str(exc.value)
+
+
+def test_arrow_empty_xml(gfs_ncss, tmpdir):
+    """Test that an XML response without points is reported clearly."""
+    pytest.importorskip('pyarrow.parquet')
+    resp = FakeResponse(b'<grid></grid>')
+    resp.close = lambda: None
+    gfs_ncss.get_query = lambda query, **kwargs: resp
+    with pytest.raises(ValueError) as exc:
+        gfs_ncss.get_data_arrow(gfs_ncss.query())
+    assert 'no data' in str(exc.value)
+
+    with pytest.raises(ValueError) as exc:
+        gfs_ncss.write_parquet(gfs_ncss.query(), str(tmpdir.join('points.parquet')))
+    assert 'no data' in str(exc.value)
+
+
+def test_metadata_lazy():
+    """Test that creating an NCSS instance makes no requests."""
+    ncss = NCSS('http://localhost:1/thredds/ncss/grib/not/there')
+    assert ncss.query() is not None
+
+
+@recorder.use_cassette('ncss_test_metadata')
+def test_metadata_shared():
+    """Test that instances for the same URL share the fetched metadata."""
+    NCSS.clear_metadata_cache()
+    ncss = NCSS(TestNCSS.server + TestNCSS.urlPath)
+    ncss2 = NCSS(TestNCSS.server + TestNCSS.urlPath)
+    assert ncss2.metadata is ncss.metadata
+    assert 'Temperature_isobaric' in ncss2.variables
+
+
+@recorder.use_cassette('ncss_test_metadata', allow_playback_repeats=True)
+def test_metadata_not_shared(monkeypatch):
+    """Test that a TTL of 0 disables sharing metadata between instances."""
+    monkeypatch.setattr(NCSS, 'metadata_ttl', 0)
+    ncss = NCSS(TestNCSS.server + TestNCSS.urlPath)
+    ncss2 = NCSS(TestNCSS.server + TestNCSS.urlPath)
+    assert ncss2.metadata is not ncss.metadata
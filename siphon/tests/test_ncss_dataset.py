@@ -6,6 +6,9 @@
 import logging
 import xml.etree.ElementTree as ET
 
+import numpy as np
+from numpy.testing import assert_array_equal
+
 from siphon.http_util import session_manager
 from siphon.ncss_dataset import _Types, NCSSDataset
 from siphon.testing import get_recorder
@@ -233,22 +236,44 @@ class TestSimpleTypes(object):
         """Test parsing multiple floats in a value tag to actual float values."""
         xml = '<values>50000.0 70000.0 85000.0</values>'
         element = ET.fromstring(xml)
-        expected = {'values': [50000.0, 70000.0, 85000.0]}
         actual = self.types.handle_values(element, value_type='float')
-        assert expected == actual
+        assert list(actual) == ['values']
+        assert actual['values'].dtype == np.float64
+        assert_array_equal(actual['values'], [50000.0, 70000.0, 85000.0])
 
     def test_value_4(self):
         """Test parsing multiple ints in a value tag to actual int values."""
         xml = '<values>50000 70000 85000</values>'
         element = ET.fromstring(xml)
-        expected = {'values': [50000, 70000, 85000]}
         actual = self.types.handle_values(element, value_type='int')
-        assert expected == actual
+        assert list(actual) == ['values']
+        assert actual['values'].dtype == np.int64
+        assert_array_equal(actual['values'], [50000, 70000, 85000])
+
+    def test_value_comma_separated(self):
+        """Test parsing comma-separated values in a value tag."""
+        element = ET.fromstring('<values>1.5,2.5, 3.5</values>')
+        actual = self.types.handle_values(element, value_type='double')
+        assert_array_equal(actual['values'], [1.5, 2.5, 3.5])
+
+    def test_value_invalid_float(self, caplog):
+        """Test parsing values that are not actually floats."""
+        element = ET.fromstring('<values>1.5 a</values>')
+        actual = self.types.handle_values(element, value_type='float')
+        assert 'Cannot convert "1.5 a" to float. Keeping type as str.' in caplog.text
+        assert actual == {'values': ['1.5 a']}
 
     def test_value_range_inc0(self):
         """Test parsing a values tag with start, inc, n with inc of 0."""
         element = ET.fromstring('<values start="60.0" increment="0.0" npts="5"/>')
-        assert self.types.handle_values(element) == {'values': [60.0, 60.0, 60.0, 60.0, 60.0]}
+        assert_array_equal(self.types.handle_values(element)['values'],
+                           [60.0, 60.0, 60.0, 60.0, 60.0])
+
+    def test_value_range(self):
+        """Test parsing a values tag with start, inc, n."""
+        element = ET.fromstring('<values start="90.0" increment="-0.5" npts="4"/>')
+        assert_array_equal(self.types.handle_values(element)['values'],
+                           [90.0, 89.5, 89.0, 88.5])
 
     def test_projection_box(self):
         """Test parsing a projection box."""
@@ -366,6 +391,19 @@ def test_dataset_elements_axis():
     assert len(actual['height_above_ground']) == 4
     assert actual['height_above_ground']['attributes']
     assert len(actual['height_above_ground']['attributes']) == 8
+    values = actual['height_above_ground']['attributes'][-1]['values']
+    assert isinstance(values, np.ndarray)
+    assert_array_equal(values, [2.0])
+
+
+def test_dataset_elements_axis_strings():
+    """Test that values for an axis with a non-numeric type are split into strings."""
+    xml = ('<gridDataset location="test"><axis name="ens" shape="3" type="String" '
+           'axisType="Ensemble"><values>a b c</values></axis>'
+           '<axis name="run" shape="2"><values>x y</values></axis></gridDataset>')
+    axes = NCSSDataset(ET.fromstring(xml)).axes
+    assert axes['ens']['attributes'][-1]['values'] == ['a', 'b', 'c']
+    assert axes['run']['attributes'][-1]['values'] == ['x', 'y']
 
 
 def test_dataset_elements_grid_set():
@@ -583,3 +621,36 @@ def test_dataset_parsing_tds5(recwarn):
     element = ET.fromstring(session_manager.urlopen(url).read())
     NCSSDataset(element)
     assert len(recwarn) == 0
+
+
+@recorder.use_cassette('GFS_Global_0p5_Grid_Dataset_xml')
+def test_dataset_lazy_sections():
+    """Test that sections of the dataset are only parsed when accessed."""
+    url = ('http://thredds.ucar.edu/thredds/ncss/grib/NCEP/GFS/'
+           'Global_0p5deg/GFS_Global_0p5deg_20150602_0000.grib2/'
+           'dataset.xml')
+    element = ET.fromstring(session_manager.urlopen(url).read())
+    parsed = NCSSDataset(element)
+    assert parsed.lat_lon_box
+    assert 'gridSet' not in parsed._parsed
+    assert 'axis' not in parsed._parsed
+    assert parsed.gridsets
+    assert 'gridSet' in parsed._parsed
+    assert 'axis' not in parsed._parsed
+
+
+@recorder.use_cassette('GFS_Global_0p5_Grid_Dataset_xml')
+def test_dataset_parsing_threads():
+    """Test that threads accessing a section at once all see it fully parsed."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    url = ('http://thredds.ucar.edu/thredds/ncss/grib/NCEP/GFS/'
+           'Global_0p5deg/GFS_Global_0p5deg_20150602_0000.grib2/'
+           'dataset.xml')
+    element = ET.fromstring(session_manager.urlopen(url).read())
+    expected = NCSSDataset(element).variables
+
+    parsed = NCSSDataset(element)
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(lambda _: sorted(parsed.variables), range(8)))
+    assert all(res == sorted(expected) for res in results)